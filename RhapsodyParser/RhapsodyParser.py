@@ -1,88 +1,1312 @@
+import argparse
+import array
+import bisect
+import codecs
+import hashlib
+import io
+import json
+import mmap
 import os
 import re
+import sqlite3
+import sys
+import tempfile
 import time
+from collections import deque, namedtuple, OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from six import string_types
+from six.moves import intern
 
 from lxml import etree
 
+__version__ = '1.0.0'
+
 class RhapsodyProjectParser:
     """RhapsodyProjectParser
     Utility class for translating rhapsody style project into a dictionary of xml files.
     """
     
+    LINK_TYPES = (('ISubsystem', '.sbs'), ('IClass', '.cls'), ('IComponent', '.cmp'))
+    
+    @staticmethod
+    def parse(filename, parseDependencies=True, workers=None, cache_dir=None, index=False, stats=None, element_index=False, hashes=False, **kwargs):
+        """ Translates a rhapsody style project into a dictionary of xml trees per project file.
+        When workers is greater than 1 the linked files are parsed by a pool of worker processes.
+        When cache_dir is a directory or a RhapsodyParseCache unchanged files are loaded from the cache instead of being parsed.
+        When index is True a RhapsodyProjectIndex of the project is built as files are parsed and kept up to date by reparse.
+        When stats is a RhapsodyParseStats the timings and node counts of each file are recorded in it.
+        When element_index is True a RhapsodyProjectElementIndex of the blocks by type and name is built while files are parsed.
+        When hashes is True the content hash of every block is recorded per file while parsing, for use by diff.
+        When errors is a list the files are parsed leniently, the problems found in each file are kept in the errors dictionary
+        of the project by file name and the list is filled with all of them in the order of the files, see RhapsodyProject.
+        Other keyword arguments, such as skip_types, are passed on to RhapsodyFileParser.parse for every file."""
+        
+        if not isinstance(filename, string_types):
+            raise ValueError('Expected filename of type string')
+        elif workers is not None and (not isinstance(workers, int) or 1 > workers):
+            raise ValueError('Expected workers to be a positive integer')
+        elif stats is not None and not isinstance(stats, RhapsodyParseStats):
+            raise ValueError('Invalid stats (Expected RhapsodyParseStats)')
+        elif 'compact' == kwargs.get('tree') and ((workers is not None and 1 < workers) or index):
+            raise ValueError('Compact trees can not be parsed by workers or indexed')
+        
+        start = time.perf_counter()
+        cache = RhapsodyProjectParser._getCache(cache_dir)
+        basepath = RhapsodyProjectParser._getProjectDirectory(filename)
+    
+        projectFiles = RhapsodyProject(filename, basepath, parseDependencies, kwargs)
+        if index:
+            projectFiles.index = RhapsodyProjectIndex()
+        if element_index:
+            projectFiles.elements = RhapsodyProjectElementIndex()
+        if hashes:
+            projectFiles.hashes = {}
+        projectFiles._addUnit(filename, *RhapsodyProjectParser._parseUnit(filename, basepath, cache, kwargs, stats, element_index, hashes))
+        
+        if parseDependencies:
+            if workers is not None and 1 < workers:
+                RhapsodyProjectParser._parseDependenciesParallel(projectFiles, filename, workers, cache, stats)
+            else:
+                RhapsodyProjectParser._parseDependencies(projectFiles, filename, cache, stats)
+        projectFiles._updateErrors()
+        
+        if stats is not None:
+            stats.elapsed += time.perf_counter() - start
+            
+        return projectFiles
+    
+    @staticmethod
+    def parseLazy(filename, max_units=None, max_bytes=None, cache_dir=None):
+        """ Finds the files of a rhapsody style project without translating them.
+        Returns a RhapsodyLazyProject which translates each file when it is first accessed."""
+        return RhapsodyLazyProject(filename, max_units, max_bytes, cache_dir)
+    
+    @staticmethod
+    def reparse(projectFiles, cache_dir=None, stats=None):
+        """ Updates a project returned by parse, translating only the files which changed since they were parsed.
+        Newly linked files are added and files which are no longer linked to are removed from the project, along with their errors.
+        When stats is a RhapsodyParseStats the timings and node counts of each translated file are recorded in it."""
+        
+        if not isinstance(projectFiles, RhapsodyProject):
+            raise ValueError('Invalid project (Expected project returned by RhapsodyProjectParser.parse)')
+        elif RhapsodyProjectParser._getFileStat(projectFiles.filename) is None:
+            raise ValueError('Missing project file:\n\t%s' % (projectFiles.filename))
+        elif 'compact' == projectFiles.options.get('tree') and cache_dir is not None:
+            raise ValueError('Compact trees can not be cached')
+        
+        cache = RhapsodyProjectParser._getCache(cache_dir)
+        changed = []
+        added = []
+        
+        for filename in list(projectFiles):
+            stat = RhapsodyProjectParser._getFileStat(filename)
+            if stat is not None and stat != projectFiles.fileStats.get(filename):
+                projectFiles._addUnit(filename, *RhapsodyProjectParser._parseUnit(filename, projectFiles._getBasepath(filename), cache, projectFiles.options, stats, projectFiles.elements is not None, projectFiles.hashes is not None))
+                changed.append(filename)
+        
+        # walk the links from the project file, adding files which are now linked to
+        reachable = set([projectFiles.filename])
+        stack = [projectFiles.filename]
+        
+        while stack and projectFiles.parseDependencies:
+            for filename in reversed(projectFiles.links[stack.pop()]):
+                if filename in reachable or True != os.path.isfile(filename):
+                    continue
+                
+                if filename not in projectFiles:
+                    projectFiles._addUnit(filename, *RhapsodyProjectParser._parseUnit(filename, projectFiles._getBasepath(filename), cache, projectFiles.options, stats, projectFiles.elements is not None, projectFiles.hashes is not None))
+                    added.append(filename)
+                
+                reachable.add(filename)
+                stack.append(filename)
+        
+        removed = [filename for filename in projectFiles if filename not in reachable]
+        for filename in removed:
+            projectFiles._removeUnit(filename)
+        projectFiles._updateErrors()
+        
+        return RhapsodyProjectChanges(changed, added, removed)
+    
+    @staticmethod
+    def watch(projectFiles, interval=1.0, cache_dir=None):
+        """ Polls the files of a project returned by parse every interval seconds.
+        Each time files have changed the project is updated with reparse and the changes are yielded."""
+        
+        if not isinstance(projectFiles, RhapsodyProject):
+            raise ValueError('Invalid project (Expected project returned by RhapsodyProjectParser.parse)')
+        
+        cache = RhapsodyProjectParser._getCache(cache_dir)
+        
+        while True:
+            changes = RhapsodyProjectParser.reparse(projectFiles, cache)
+            if changes:
+                yield changes
+            time.sleep(interval)
+    
+    @staticmethod
+    def diff(oldProject, newProject):
+        """ Compares two versions of a project returned by parse, returning a RhapsodyDiff per changed file.
+        Files are keyed by their path relative to the project file and elements moved between files are reported as moved.
+        Projects parsed with hashes=True are compared without hashing their trees again."""
+        
+        for projectFiles in (oldProject, newProject):
+            if not isinstance(projectFiles, RhapsodyProject):
+                raise ValueError('Invalid project (Expected project returned by RhapsodyProjectParser.parse)')
+        
+        oldUnits = RhapsodyProjectParser._getRelativeUnits(oldProject)
+        newUnits = RhapsodyProjectParser._getRelativeUnits(newProject)
+        differ = _RhapsodyDiffer()
+        
+        for unit in list(newUnits) + [unit for unit in oldUnits if unit not in newUnits]:
+            oldFilename = oldUnits.get(unit)
+            newFilename = newUnits.get(unit)
+            differ.addUnit(unit,
+                           oldProject[oldFilename] if oldFilename is not None else None,
+                           newProject[newFilename] if newFilename is not None else None,
+                           RhapsodyProjectParser._getHashes(oldProject, oldFilename),
+                           RhapsodyProjectParser._getHashes(newProject, newFilename))
+        
+        return OrderedDict((unit, changes) for unit, changes in differ.finish().items() if changes)
+    
+    @staticmethod
+    def _getRelativeUnits(projectFiles):
+        """ Returns the files of a project keyed by their path relative to the directory of the project file"""
+        
+        directory = os.path.dirname(os.path.abspath(projectFiles.filename))
+        return OrderedDict((os.path.relpath(os.path.abspath(filename), directory), filename) for filename in projectFiles)
+    
+    @staticmethod
+    def _getHashes(projectFiles, filename):
+        if filename is None:
+            return None
+        elif projectFiles.hashes is not None and filename in projectFiles.hashes:
+            return projectFiles.hashes[filename]
+        
+        return RhapsodyFileParser.hashTree(projectFiles[filename])
+    
+    @staticmethod
+    def _getProjectDirectory(filename):
+        """ Returns the directory holding the files of the given project file"""
+        
+        if not isinstance(filename, string_types):
+            raise ValueError('Expected filename of type string')
+        
+        basepath, basename = os.path.split(filename)
+        name, ext = os.path.splitext(basename)
+        basepath = os.path.join(basepath, name + '_rpy')
+                
+        if ext.lower() != ".rpy":
+            raise ValueError('Invalid project file (Expected rpy type file):\n\t%s' % (filename))
+        elif True != os.path.isdir(basepath):
+            raise ValueError('Missing project directory:\n\t%s' % (basepath))
+        
+        return basepath
+    
+    @staticmethod
+    def _getCache(cache_dir):
+        if cache_dir is None or isinstance(cache_dir, RhapsodyParseCache):
+            return cache_dir
+        elif isinstance(cache_dir, string_types):
+            return RhapsodyParseCache(cache_dir)
+        
+        raise ValueError('Invalid cache (Expected directory name or RhapsodyParseCache)')
+    
+    @staticmethod
+    def _getFileStat(filename):
+        """ Returns the size and modification time of a file, or None when it does not exist"""
+        
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        
+        return (stat.st_size, stat.st_mtime_ns)
+    
+    @staticmethod
+    def _parseUnit(filename, basepath, cache=None, options=None, stats=None, indexElements=False, hashTree=False):
+        """ Translates a single project file with the given parse options, using the cache when one is given.
+        Returns the xml tree, the state of the file before it was read, the files it links to,
+        when indexElements is True the RhapsodyElementIndex of the tree, when hashTree is True the hashes of its blocks
+        and when the options parse leniently the problems found in the file."""
+        
+        stat = RhapsodyProjectParser._getFileStat(filename)
+        fileNames = []
+        options = options or {}
+        elementIndex = RhapsodyElementIndex() if indexElements else None
+        hashes = {} if hashTree else None
+        errors = None
+        
+        if options.get('errors') is not None:
+            # each file gets a list of its own so its problems can be told apart
+            errors = []
+            options = dict(options, errors=errors)
+        
+        if stats is not None:
+            stats = stats.addUnit(filename)
+        
+        if cache is not None:
+            root = cache.parse(filename, fileNames, stats=stats, element_index=elementIndex, hashes=hashes, **options)
+        else:
+            root = RhapsodyFileParser.parse(filename, links=fileNames, stats=stats, element_index=elementIndex, hashes=hashes, **options)
+        
+        if stats is not None:
+            start = time.perf_counter()
+        
+        links = RhapsodyProjectParser._getLinks(fileNames, basepath)
+        
+        if stats is not None:
+            stats.scan += time.perf_counter() - start
+        
+        return root, stat, links, elementIndex, hashes, errors
+    
+    @staticmethod
+    def _parseDependencies(projectFiles, filename, cache=None, stats=None):
+        """ Searches for any files linked to by the given project file and adds any found to the dictionary"""
+        
+        for linked in projectFiles.links[filename]:
+            if linked not in projectFiles and os.path.isfile(linked):
+                link_path,_ = os.path.split(linked)
+                projectFiles._addUnit(linked, *RhapsodyProjectParser._parseUnit(linked, link_path, cache, projectFiles.options, stats, projectFiles.elements is not None, projectFiles.hashes is not None))
+                RhapsodyProjectParser._parseDependencies(projectFiles, linked, cache, stats)
+    
+    @staticmethod
+    def _parseDependenciesParallel(projectFiles, filename, workers, cache=None, stats=None):
+        """ Parses the files linked to by the given project file using a pool of worker processes.
+        Links found in each file are scheduled as soon as that file has been parsed, the files are added to the project
+        once all of them are parsed in the same order as _parseDependencies adds them."""
+        
+        scheduled = set(projectFiles)
+        results = {}
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            links = projectFiles.links[filename]
+            
+            while True:
+                for linked in links:
+                    if linked not in scheduled and os.path.isfile(linked):
+                        scheduled.add(linked)
+                        pending.add(executor.submit(_parseUnitWorker, linked, cache, projectFiles.options, stats is not None))
+                
+                if not pending:
+                    break
+                
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                links = []
+                for future in done:
+                    linked, data, stat, linkedFiles, unitStats, errors, cacheCounts = future.result()
+                    results[linked] = (RhapsodyFileParser._fromSerialized(data), stat, linkedFiles, unitStats, errors)
+                    if cache is not None:
+                        cache.hits += cacheCounts[0]
+                        cache.misses += cacheCounts[1]
+                    links.extend(linkedFiles)
+        
+        # walk the links depth first as _parseDependencies does
+        stack = [iter(projectFiles.links[filename])]
+        while stack:
+            linked = next(stack[-1], None)
+            if linked is None:
+                stack.pop()
+                continue
+            elif linked not in results or linked in projectFiles:
+                continue
+            
+            root, stat, linkedFiles, unitStats, errors = results[linked]
+            projectFiles._addUnit(linked, root, stat, linkedFiles, errors=errors)
+            if stats is not None:
+                stats.units[linked] = unitStats
+            stack.append(iter(linkedFiles))
+    
+    @staticmethod
+    def _getLinks(fileNames, basepath):
+        """ Returns the subsystem, class and component files linked to by the file names found while parsing, whether or not they exist"""
+        
+        links = []
+        
+        for linkType, linkExt in RhapsodyProjectParser.LINK_TYPES:
+            for fileNameType, fileName in fileNames:
+                if linkType != fileNameType or (2 >= len(fileName)):
+                    continue
+                    
+                links.append(os.path.join(basepath, fileName[1:-1] + linkExt))
+        
+        return links
+
+def _parseUnitWorker(filename, cache=None, options=None, recordStats=False):
+    """ Parses a single project file in a worker process.
+    The tree is returned as serialized xml along with the files it links to, since lxml trees can not be pickled,
+    its stats when recordStats is True, the problems found when the options parse leniently
+    and the cache hits and misses, since the cache is a copy in the worker."""
+    
+    link_path,_ = os.path.split(filename)
+    stats = RhapsodyParseStats() if recordStats else None
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+    root, stat, links, _, _, errors = RhapsodyProjectParser._parseUnit(filename, link_path, cache, options, stats)
+    cacheCounts = (cache.hits - hits, cache.misses - misses) if cache is not None else (0, 0)
+    
+    return filename, RhapsodyFileParser._toSerialized(root), stat, links, stats.units[filename] if recordStats else None, errors, cacheCounts
+
+class RhapsodyProject(dict):
+    """RhapsodyProject
+    Dictionary of xml trees per project file returned by RhapsodyProjectParser.parse.
+    Also records the size and modification time of each file when it was parsed and the files it links to,
+    which lets RhapsodyProjectParser.reparse update the project incrementally with the same parse options.
+    When the project is parsed leniently errors holds the RhapsodyParseError list of each file which has problems.
+    """
+    
+    def __init__(self, filename, basepath, parseDependencies=True, options=None):
+        dict.__init__(self)
+        self.filename = filename
+        self.basepath = basepath
+        self.parseDependencies = parseDependencies
+        self.options = options or {}
+        self.fileStats = {}
+        self.links = {}
+        self.index = None
+        self.elements = None
+        self.hashes = None
+        self.errors = OrderedDict() if self.options.get('errors') is not None else None
+    
+    @property
+    def graph(self):
+        """ Graph of the links between the files of the project"""
+        return RhapsodyUnitGraph(self)
+    
+    def _getBasepath(self, filename):
+        """ Returns the directory which links in the given project file are relative to"""
+        
+        if filename == self.filename:
+            return self.basepath
+        
+        link_path,_ = os.path.split(filename)
+        return link_path
+    
+    def _addUnit(self, filename, root, stat, links, elementIndex=None, hashes=None, errors=None):
+        self[filename] = root
+        self.fileStats[filename] = stat
+        self.links[filename] = links
+        
+        if self.index is not None:
+            self.index.addUnit(filename, root)
+        if self.elements is not None:
+            self.elements.addUnit(filename, elementIndex if elementIndex is not None else RhapsodyElementIndex(root))
+        if self.hashes is not None:
+            self.hashes[filename] = hashes if hashes is not None else RhapsodyFileParser.hashTree(root)
+        if self.errors is not None:
+            self.errors.pop(filename, None)
+            if errors:
+                self.errors[filename] = errors
+    
+    def _removeUnit(self, filename):
+        del self[filename]
+        self.fileStats.pop(filename, None)
+        self.links.pop(filename, None)
+        
+        if self.index is not None:
+            self.index.removeUnit(filename)
+        if self.elements is not None:
+            self.elements.removeUnit(filename)
+        if self.hashes is not None:
+            self.hashes.pop(filename, None)
+        if self.errors is not None:
+            self.errors.pop(filename, None)
+    
+    def _updateErrors(self):
+        """ Fills the errors list of the parse options with the errors of every file, in the order of the files"""
+        
+        if self.errors is None:
+            return
+        
+        self.options['errors'][:] = [error for filename in self if filename in self.errors for error in self.errors[filename]]
+
+class RhapsodyLazyProject(Mapping):
+    """RhapsodyLazyProject
+    Read-only mapping of project files to xml trees which translates each file only when it is accessed.
+    The files and the links between them are found up front with a scan that builds no trees. Once more than
+    max_units files, or files totalling more than max_bytes, are loaded the least recently used trees are
+    released and translated again if they are accessed later.
+    """
+    
+    def __init__(self, filename, max_units=None, max_bytes=None, cache_dir=None):
+        if max_units is not None and 1 > max_units:
+            raise ValueError('Expected max_units to be a positive integer')
+        elif max_bytes is not None and 0 > max_bytes:
+            raise ValueError('Expected max_bytes to be a positive integer')
+        
+        self.filename = filename
+        self.basepath = RhapsodyProjectParser._getProjectDirectory(filename)
+        self.max_units = max_units
+        self.max_bytes = max_bytes
+        self.links = {}
+        self.fileSizes = {}
+        self._cache = RhapsodyProjectParser._getCache(cache_dir)
+        self._loaded = OrderedDict()
+        self._loadedBytes = 0
+        
+        # find the linked files in the same order as RhapsodyProjectParser.parse
+        stack = [(filename, self.basepath)]
+        while stack:
+            filename, basepath = stack.pop()
+            self.links[filename] = RhapsodyProjectParser._getLinks(RhapsodyFileParser.scanLinks(filename), basepath)
+            self.fileSizes[filename] = os.path.getsize(filename)
+            
+            for linked in reversed(self.links[filename]):
+                if linked not in self.links and os.path.isfile(linked):
+                    link_path,_ = os.path.split(linked)
+                    stack.append((linked, link_path))
+        
+        self._units = list(self.links)
+    
+    def __getitem__(self, filename):
+        if filename in self._loaded:
+            self._loaded.move_to_end(filename)
+            return self._loaded[filename]
+        elif filename not in self.links:
+            raise KeyError(filename)
+        
+        if self._cache is not None:
+            root = self._cache.parse(filename)
+        else:
+            root = RhapsodyFileParser.parse(filename)
+        
+        self._loaded[filename] = root
+        self._loadedBytes += self.fileSizes[filename]
+        self._evict()
+        
+        return root
+    
+    def __contains__(self, filename):
+        return filename in self.links
+    
+    def __iter__(self):
+        return iter(self._units)
+    
+    def __len__(self):
+        return len(self._units)
+    
+    @property
+    def graph(self):
+        """ Graph of the links between the files of the project"""
+        return RhapsodyUnitGraph(self)
+    
+    def isLoaded(self, filename):
+        """ Returns whether the tree of the given file is currently held in memory"""
+        return filename in self._loaded
+    
+    def release(self, filename=None):
+        """ Releases the tree of the given file, or of all files when no file is given"""
+        
+        for loaded in ([filename] if filename is not None else list(self._loaded)):
+            if loaded in self._loaded:
+                del self._loaded[loaded]
+                self._loadedBytes -= self.fileSizes[loaded]
+    
+    def _evict(self):
+        """ Releases the least recently used trees, always keeping the most recently accessed one"""
+        
+        while 1 < len(self._loaded) and self._isOverBudget():
+            self.release(next(iter(self._loaded)))
+    
+    def _isOverBudget(self):
+        if self.max_units is not None and len(self._loaded) > self.max_units:
+            return True
+        
+        return self.max_bytes is not None and self._loadedBytes > self.max_bytes
+
+class RhapsodyProjectIndex:
+    """RhapsodyProjectIndex
+    Index of the model elements of a project by GUID, along with the handles which refer to each GUID.
+    Files can be added and removed as they are parsed, so the index can be kept up to date incrementally.
+    """
+    
+    def __init__(self, projectFiles=None):
+        self.guids = {}
+        self.references = {}
+        self._unitGuids = {}
+        self._unitReferences = {}
+        
+        if projectFiles is not None:
+            for filename in projectFiles:
+                self.addUnit(filename, projectFiles[filename])
+    
+    def addUnit(self, filename, root):
+        """ Indexes the model elements and handles of a project file, replacing any previous version of the file"""
+        
+        if filename in self._unitGuids:
+            self.removeUnit(filename)
+        
+        unitGuids = []
+        unitReferences = []
+        
+        for id_node in root.iter('_id'):
+            node = id_node.getparent()
+            guid = id_node.text
+            
+            if RhapsodyProjectIndex._isHandle(node):
+                self.references.setdefault(guid, []).append((filename, node))
+                unitReferences.append(guid)
+            else:
+                self.guids[guid] = (filename, node)
+                unitGuids.append(guid)
+        
+        self._unitGuids[filename] = unitGuids
+        self._unitReferences[filename] = unitReferences
+    
+    def removeUnit(self, filename):
+        """ Removes the model elements and handles of a project file from the index"""
+        
+        for guid in self._unitGuids.pop(filename, []):
+            entry = self.guids.get(guid)
+            if entry is not None and filename == entry[0]:
+                del self.guids[guid]
+        
+        for guid in set(self._unitReferences.pop(filename, [])):
+            references = [reference for reference in self.references[guid] if filename != reference[0]]
+            if references:
+                self.references[guid] = references
+            else:
+                del self.references[guid]
+    
+    def find(self, guid):
+        """ Returns (project file, element) for the model element with the given GUID, or None when it is not in the project"""
+        return self.guids.get(guid)
+    
+    def resolve(self, handle):
+        """ Returns (project file, element) for the model element referred to by a handle such as _dependsOn, or None when it is not in the project"""
+        
+        id_node = handle.find('_id')
+        if id_node is None:
+            return None
+        
+        return self.guids.get(id_node.text)
+    
+    def getReferences(self, guid):
+        """ Returns (project file, handle) for each handle which refers to the given GUID"""
+        return list(self.references.get(guid, []))
+    
+    @staticmethod
+    def _isHandle(node):
+        return '_dependsOn' == node.tag or node.get('type', '').endswith('Handle')
+
+class RhapsodyElementIndex(object):
+    """RhapsodyElementIndex
+    Index of the blocks of a file by type, and by the name held in their _name attribute with the quotes removed.
+    Filled by the parser when passed as element_index, or built from an existing tree.
+    Placeholders of blocks skipped with keep_skipped are not indexed until they are expanded.
+    """
+    
+    def __init__(self, root=None):
+        self.types = {}
+        self.names = {}
+        
+        if root is not None:
+            self.addTree(root)
+    
+    def addName(self, node, name):
+        if name is not None and 2 <= len(name) and '"' == name[0] and '"' == name[-1]:
+            name = name[1:-1]
+        self.names.setdefault(name, []).append(node)
+    
+    def addTree(self, root):
+        """ Adds the blocks of a tree in document order, as the parser does"""
+        
+        types = self.types
+        if root.get('type') is not None:
+            types.setdefault(root.get('type'), []).append(root)
+        
+        parents = [root]
+        stack = [iter(root)]
+        
+        while stack:
+            child = next(stack[-1], None)
+            
+            if child is None:
+                stack.pop()
+                parents.pop()
+                continue
+            
+            blockType = child.get('type')
+            if blockType is not None:
+                if child.get('rhapsody_skipped') is not None:
+                    # placeholders of skipped blocks are not indexed, as the parser does
+                    continue
+                types.setdefault(blockType, []).append(child)
+            elif '_name' == child.tag:
+                self.addName(parents[-1], child.text)
+                continue
+            elif 'elementList' != child.tag:
+                continue
+            
+            parents.append(child)
+            stack.append(iter(child))
+    
+    def findType(self, blockType):
+        """ Returns the blocks of the given type"""
+        return list(self.types.get(blockType, []))
+    
+    def findName(self, name, blockType=None):
+        """ Returns the blocks with the given name, only those of blockType when it is given"""
+        return [node for node in self.names.get(name, []) if blockType is None or blockType == node.get('type')]
+
+class RhapsodyProjectElementIndex:
+    """RhapsodyProjectElementIndex
+    Index of the blocks of all files of a project by type and name, merged from the RhapsodyElementIndex of each file.
+    Files can be added and removed as they are parsed, so the index can be kept up to date incrementally.
+    """
+    
+    def __init__(self, projectFiles=None):
+        self.types = {}
+        self.names = {}
+        self.units = {}
+        
+        if projectFiles is not None:
+            for filename in projectFiles:
+                self.addUnit(filename, RhapsodyElementIndex(projectFiles[filename]))
+    
+    def addUnit(self, filename, elementIndex):
+        """ Merges the index of a project file, replacing any previous version of the file"""
+        
+        if filename in self.units:
+            self.removeUnit(filename)
+        
+        self.units[filename] = elementIndex
+        for merged, unit in ((self.types, elementIndex.types), (self.names, elementIndex.names)):
+            for key, nodes in unit.items():
+                merged.setdefault(key, []).extend((filename, node) for node in nodes)
+    
+    def removeUnit(self, filename):
+        """ Removes the blocks of a project file from the index"""
+        
+        elementIndex = self.units.pop(filename, None)
+        if elementIndex is None:
+            return
+        
+        for merged, unit in ((self.types, elementIndex.types), (self.names, elementIndex.names)):
+            for key in unit:
+                entries = [entry for entry in merged[key] if filename != entry[0]]
+                if entries:
+                    merged[key] = entries
+                else:
+                    del merged[key]
+    
+    def findType(self, blockType):
+        """ Returns (project file, element) for each block of the given type"""
+        return list(self.types.get(blockType, []))
+    
+    def findName(self, name, blockType=None):
+        """ Returns (project file, element) for each block with the given name, only those of blockType when it is given"""
+        return [entry for entry in self.names.get(name, []) if blockType is None or blockType == entry[1].get('type')]
+
+class RhapsodyProjectExporter(object):
+    """RhapsodyProjectExporter
+    Flattens the model elements of projects into SQLite tables so questions across many projects are a single query.
+    The elements table holds the GUID, type, name, owner GUID, file and depth of every model element and the refs table
+    the GUID each _dependsOn handle refers to. Files are only exported again when their size or modification time changed.
+    """
+    
+    ELEMENT_COLUMNS = ('guid', 'type', 'name', 'parent', 'unit', 'depth')
+    REF_COLUMNS = ('source', 'target', 'name', 'unit')
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS units (unit TEXT PRIMARY KEY, project TEXT, size INTEGER, mtime INTEGER);
+        CREATE TABLE IF NOT EXISTS elements (guid TEXT, type TEXT, name TEXT, parent TEXT, unit TEXT, depth INTEGER);
+        CREATE TABLE IF NOT EXISTS refs (source TEXT, target TEXT, name TEXT, unit TEXT);
+        CREATE INDEX IF NOT EXISTS units_project ON units (project);
+        CREATE INDEX IF NOT EXISTS elements_guid ON elements (guid);
+        CREATE INDEX IF NOT EXISTS elements_type ON elements (type);
+        CREATE INDEX IF NOT EXISTS elements_name ON elements (name);
+        CREATE INDEX IF NOT EXISTS elements_parent ON elements (parent);
+        CREATE INDEX IF NOT EXISTS elements_unit ON elements (unit);
+        CREATE INDEX IF NOT EXISTS refs_source ON refs (source);
+        CREATE INDEX IF NOT EXISTS refs_target ON refs (target);
+        CREATE INDEX IF NOT EXISTS refs_unit ON refs (unit);
+        '''
+    
+    def __init__(self, database):
+        if isinstance(database, string_types):
+            self.connection = sqlite3.connect(database)
+        elif isinstance(database, sqlite3.Connection):
+            self.connection = database
+        else:
+            raise ValueError('Invalid database (Expected filename or sqlite3 connection)')
+        
+        self.connection.executescript(RhapsodyProjectExporter.SCHEMA)
+    
+    def exportProject(self, filename, cache_dir=None):
+        """ Exports the files of a project file which changed since they were last exported, holding one tree in memory at a time.
+        Files which are no longer part of the project are removed. Returns the files which were exported."""
+        
+        projectFiles = RhapsodyLazyProject(filename, max_units=1, cache_dir=cache_dir)
+        project = os.path.abspath(filename)
+        exported = []
+        
+        with self.connection:
+            for unit in projectFiles:
+                stat = RhapsodyProjectParser._getFileStat(unit)
+                if not self._isCurrent(unit, stat):
+                    self._addUnit(unit, projectFiles[unit], stat, project)
+                    exported.append(unit)
+            
+            self._removeStale(project, projectFiles)
+        
+        projectFiles.release()
+        return exported
+    
+    def addProject(self, projectFiles):
+        """ Exports the files of a project returned by RhapsodyProjectParser.parse which changed since they were last exported.
+        Files which are no longer part of the project are removed. Returns the files which were exported."""
+        
+        if not isinstance(projectFiles, RhapsodyProject):
+            raise ValueError('Invalid project (Expected project returned by RhapsodyProjectParser.parse)')
+        
+        project = os.path.abspath(projectFiles.filename)
+        exported = []
+        
+        with self.connection:
+            for unit in projectFiles:
+                stat = projectFiles.fileStats.get(unit)
+                if not self._isCurrent(unit, stat):
+                    self._addUnit(unit, projectFiles[unit], stat, project)
+                    exported.append(unit)
+            
+            self._removeStale(project, projectFiles)
+        
+        return exported
+    
+    def addUnit(self, filename, root, project=None):
+        """ Exports the tree of a single file, replacing any previous version of the file"""
+        
+        with self.connection:
+            self._addUnit(filename, root, None, os.path.abspath(project) if project is not None else None)
+    
+    def removeUnit(self, filename):
+        """ Removes the elements and references of a file"""
+        
+        with self.connection:
+            self._removeUnit(os.path.abspath(filename))
+    
+    def toArrays(self, table='elements'):
+        """ Returns the columns of the elements or refs table as a dictionary of typed NumPy arrays, which requires numpy"""
+        
+        import numpy
+        
+        columns = {'elements': RhapsodyProjectExporter.ELEMENT_COLUMNS, 'refs': RhapsodyProjectExporter.REF_COLUMNS}.get(table)
+        if columns is None:
+            raise ValueError('Invalid table (Expected elements or refs)')
+        
+        rows = self.connection.execute('SELECT %s FROM %s' % (', '.join(columns), table)).fetchall()
+        arrays = {}
+        for index, column in enumerate(columns):
+            values = [row[index] for row in rows]
+            if 'depth' == column:
+                arrays[column] = numpy.array(values, dtype=numpy.int32)
+            else:
+                arrays[column] = numpy.array([value if value is not None else '' for value in values], dtype=numpy.str_)
+        
+        return arrays
+    
+    def close(self):
+        self.connection.close()
+    
+    def _isCurrent(self, filename, stat):
+        """ Returns whether a file was exported with the given size and modification time"""
+        
+        if stat is None:
+            return False
+        
+        row = self.connection.execute('SELECT size, mtime FROM units WHERE unit = ?', (os.path.abspath(filename), )).fetchone()
+        return row is not None and tuple(row) == tuple(stat)
+    
+    def _addUnit(self, filename, root, stat, project):
+        unit = os.path.abspath(filename)
+        refs = []
+        
+        self._removeUnit(unit)
+        self.connection.execute('INSERT INTO units VALUES (?, ?, ?, ?)', (unit, project, stat[0] if stat else None, stat[1] if stat else None))
+        self.connection.executemany('INSERT INTO elements VALUES (?, ?, ?, ?, ?, ?)', RhapsodyProjectExporter._iterElements(root, unit, refs))
+        self.connection.executemany('INSERT INTO refs VALUES (?, ?, ?, ?)', refs)
+    
+    def _removeUnit(self, unit):
+        for table in ('units', 'elements', 'refs'):
+            self.connection.execute('DELETE FROM %s WHERE unit = ?' % (table), (unit, ))
+    
+    def _removeStale(self, project, projectFiles):
+        """ Removes the files exported for a project which it no longer links to"""
+        
+        units = set(os.path.abspath(filename) for filename in projectFiles)
+        for (unit, ) in self.connection.execute('SELECT unit FROM units WHERE project = ?', (project, )).fetchall():
+            if unit not in units:
+                self._removeUnit(unit)
+    
+    @staticmethod
+    def _iterElements(root, unit, refs):
+        """ Yields a row for each model element of a tree in document order, appending a row to refs for each _dependsOn handle"""
+        
+        # each stack entry holds a block, the GUID of the element which owns it and its depth
+        stack = [(root, None, 0)]
+        
+        while stack:
+            node, parent, depth = stack.pop()
+            
+            if RhapsodyProjectIndex._isHandle(node):
+                if '_dependsOn' == node.tag and parent is not None:
+                    refs.append((parent, node.findtext('_id'), RhapsodyProjectExporter._getName(node), unit))
+                continue
+            
+            guid = node.findtext('_id') if node.get('rhapsody_skipped') is None else None
+            if guid is not None:
+                yield (guid, node.get('type'), RhapsodyProjectExporter._getName(node), parent, unit, depth)
+                parent = guid
+                depth += 1
+            
+            children = [(child, parent, depth) for child in node if child.get('type') is not None or 'elementList' == child.tag]
+            children.reverse()
+            stack.extend(children)
+    
+    @staticmethod
+    def _getName(node):
+        """ Returns the _name of a block with the quotes removed"""
+        
+        name = node.findtext('_name')
+        if name is not None and 2 <= len(name) and '"' == name[0] and '"' == name[-1]:
+            name = name[1:-1]
+        
+        return name
+
+class RhapsodyProjectConverter:
+    """RhapsodyProjectConverter
+    Converts rhapsody style projects into an xml file per project file, used by the rhapsody-convert command.
+    A manifest in the output directory records the size and modification time of each converted file,
+    so an interrupted or repeated run only converts the files which changed since their output was written.
+    """
+    
+    MANIFEST = 'rhapsody-convert.json'
+    
+    @staticmethod
+    def convert(inputs, output, workers=None, force=False, progress=None):
+        """ Converts the projects given as rpy files, or found in the given directories, into the output directory.
+        When workers is greater than 1 the projects are converted by a pool of worker processes.
+        When force is True files are converted even when the manifest shows their output is up to date.
+        When progress is a function it is called with each project and its result as it completes.
+        Returns a dictionary of totals along with the failed projects and their errors."""
+        
+        if workers is not None and (not isinstance(workers, int) or 1 > workers):
+            raise ValueError('Expected workers to be a positive integer')
+        
+        start = time.perf_counter()
+        projects = RhapsodyProjectConverter.findProjects(inputs)
+        manifestFile = os.path.join(output, RhapsodyProjectConverter.MANIFEST)
+        manifest = RhapsodyProjectConverter._loadManifest(manifestFile)
+        report = OrderedDict([('projects', len(projects)), ('converted', 0), ('skipped', 0), ('bytes', 0), ('seconds', 0.0), ('failed', OrderedDict())])
+        tasks = [(filename, os.path.join(output, name), {} if force else RhapsodyProjectConverter._getEntries(manifest, filename)) for filename, name in projects]
+        
+        if not os.path.isdir(output):
+            os.makedirs(output)
+        
+        if workers is not None and 1 < workers:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = [executor.submit(_convertProjectWorker, *task) for task in tasks]
+                for future in as_completed(results):
+                    RhapsodyProjectConverter._addResult(report, manifest, manifestFile, future.result(), progress)
+        else:
+            for task in tasks:
+                RhapsodyProjectConverter._addResult(report, manifest, manifestFile, _convertProjectWorker(*task), progress)
+        
+        report['seconds'] = time.perf_counter() - start
+        return report
+    
+    @staticmethod
+    def findProjects(inputs):
+        """ Returns (project file, output name) for each rpy file given or found below the given directories.
+        The output name is the path of the project file relative to the directory it was found in, without the extension."""
+        
+        if isinstance(inputs, string_types):
+            inputs = [inputs]
+        
+        projects = []
+        
+        for source in inputs:
+            if os.path.isdir(source):
+                for directory, directories, filenames in os.walk(source):
+                    directories.sort()
+                    for filename in sorted(filenames):
+                        if '.rpy' == os.path.splitext(filename)[1].lower():
+                            filename = os.path.join(directory, filename)
+                            projects.append((filename, os.path.splitext(os.path.relpath(filename, source))[0]))
+            elif os.path.isfile(source):
+                projects.append((source, os.path.splitext(os.path.basename(source))[0]))
+            else:
+                raise ValueError('Missing project file or directory:\n\t%s' % (source))
+        
+        return projects
+    
+    @staticmethod
+    def convertProject(filename, directory, entries=None):
+        """ Converts the files of a project into xml files in the given directory, keeping the layout of the project.
+        Files whose size and modification time match their entry and whose output exists are skipped, one tree is held in memory at a time.
+        Returns the manifest entries of the project along with the number of files converted and skipped and the bytes read."""
+        
+        entries = entries or {}
+        projectFiles = RhapsodyLazyProject(filename, max_units=1)
+        basepath = os.path.dirname(os.path.abspath(filename))
+        converted = {}
+        skipped = 0
+        size = 0
+        
+        for unit in projectFiles:
+            key = os.path.abspath(unit)
+            target = os.path.join(directory, os.path.relpath(key, basepath) + '.xml')
+            stat = RhapsodyProjectParser._getFileStat(unit)
+            
+            entry = entries.get(key)
+            if entry is not None and list(stat) == entry[:2] and target == entry[2] and os.path.isfile(target):
+                converted[key] = entry
+                skipped += 1
+                continue
+            
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+            RhapsodyProjectConverter.writeXml(projectFiles[unit], target)
+            projectFiles.release(unit)
+            
+            converted[key] = [stat[0], stat[1], target]
+            size += stat[0]
+        
+        return converted, len(converted) - skipped, skipped, size
+    
+    @staticmethod
+    def writeXml(root, target):
+        """ Writes an xml tree to a file incrementally, one top level block at a time, without building a string of the whole tree.
+        The file is written under a temporary name and renamed once complete, so an interrupted run never leaves partial output."""
+        
+        temporary = target + '.tmp'
+        
+        with etree.xmlfile(temporary, encoding='utf-8') as xf:
+            with xf.element(root.tag, OrderedDict(root.items())):
+                for child in root:
+                    xf.write(child)
+                    xf.flush()
+        
+        os.replace(temporary, target)
+    
+    @staticmethod
+    def _getEntries(manifest, filename):
+        """ Returns the manifest entries of the files in the directory of a project file"""
+        
+        prefix = os.path.join(os.path.dirname(os.path.abspath(filename)), '')
+        return dict((key, entry) for key, entry in manifest.items() if key.startswith(prefix))
+    
+    @staticmethod
+    def _addResult(report, manifest, manifestFile, result, progress):
+        filename, entries, converted, skipped, size, error = result
+        
+        if error is not None:
+            report['failed'][filename] = error
+        else:
+            manifest.update(entries)
+            RhapsodyProjectConverter._saveManifest(manifest, manifestFile)
+            report['converted'] += converted
+            report['skipped'] += skipped
+            report['bytes'] += size
+        
+        if progress is not None:
+            progress(filename, result)
+    
+    @staticmethod
+    def _loadManifest(manifestFile):
+        if not os.path.isfile(manifestFile):
+            return {}
+        
+        try:
+            with open(manifestFile, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            # a damaged manifest only means every file is converted again
+            return {}
+    
+    @staticmethod
+    def _saveManifest(manifest, manifestFile):
+        """ Writes the manifest under a temporary name and renames it, so it is complete even when the run is interrupted"""
+        
+        with open(manifestFile + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(manifestFile + '.tmp', manifestFile)
+
+def _convertProjectWorker(filename, directory, entries=None):
+    """ Converts a single project in a worker process, returning the error instead of raising it so one bad project does not stop the run"""
+    
+    try:
+        converted, count, skipped, size = RhapsodyProjectConverter.convertProject(filename, directory, entries)
+    except (ValueError, OSError, etree.Error) as e:
+        return filename, {}, 0, 0, 0, str(e)
+    
+    return filename, converted, count, skipped, size, None
+
+class RhapsodyUnitGraph:
+    """RhapsodyUnitGraph
+    Graph of the links between the files of a project, built from the links recorded while the project was parsed.
+    """
+    
+    def __init__(self, projectFiles):
+        self.edges = {}
+        self.reverseEdges = {}
+        self.missing = {}
+        
+        for filename in projectFiles:
+            self.edges[filename] = []
+            self.reverseEdges[filename] = []
+            self.missing[filename] = []
+        
+        for filename in projectFiles:
+            for linked in projectFiles.links.get(filename, []):
+                if linked in projectFiles:
+                    if linked not in self.edges[filename]:
+                        self.edges[filename].append(linked)
+                        self.reverseEdges[linked].append(filename)
+                elif True != os.path.isfile(linked):
+                    self.missing[filename].append(linked)
+    
+    def topologicalOrder(self):
+        """ Returns the project files ordered so each file comes before the files it links to"""
+        
+        incoming = dict((filename, len(linking)) for filename, linking in self.reverseEdges.items())
+        ready = deque(filename for filename in self.edges if 0 == incoming[filename])
+        order = []
+        
+        while ready:
+            filename = ready.popleft()
+            order.append(filename)
+            for linked in self.edges[filename]:
+                incoming[linked] -= 1
+                if 0 == incoming[linked]:
+                    ready.append(linked)
+        
+        if len(order) != len(self.edges):
+            raise ValueError('Cyclic links between project files:\n\t%s' % ('\n\t'.join(sorted(set(self.edges) - set(order)))))
+        
+        return order
+    
+    def getLinkedUnits(self, filename):
+        """ Returns the project files which the given file links to directly or indirectly"""
+        return self._walk(self.edges, filename)
+    
+    def getLinkingUnits(self, filename):
+        """ Returns the project files which link to the given file directly or indirectly"""
+        return self._walk(self.reverseEdges, filename)
+    
+    def getMissingFiles(self):
+        """ Returns (project file, linked file) for each link to a file which does not exist"""
+        return [(filename, linked) for filename in self.missing for linked in self.missing[filename]]
+    
     @staticmethod
-    def parse(filename, parseDependencies=True):
-        """ Translates a rhapsody style project into a dictionary of xml trees per project file"""
+    def _walk(edges, filename):
+        if filename not in edges:
+            raise ValueError('Unknown project file:\n\t%s' % (filename))
         
-        if not isinstance(filename, string_types):
-            raise ValueError('Expected filename of type string')
+        found = set()
+        stack = [filename]
+        
+        while stack:
+            for linked in edges[stack.pop()]:
+                if linked not in found:
+                    found.add(linked)
+                    stack.append(linked)
+        
+        found.discard(filename)
+        return found
+
+class RhapsodyProjectChanges(namedtuple('RhapsodyProjectChanges', ['changed', 'added', 'removed'])):
+    """RhapsodyProjectChanges
+    Project files which were translated again, added or removed by RhapsodyProjectParser.reparse.
+    """
+    
+    def __bool__(self):
+        return bool(self.changed or self.added or self.removed)
+    
+    __nonzero__ = __bool__
+
+class RhapsodyParseError(namedtuple('RhapsodyParseError', ['line', 'column', 'message'])):
+    """RhapsodyParseError
+    Problem found by RhapsodyFileParser.fromString with errors, at a line and column counted from 1.
+    """
+    
+    def __str__(self):
+        return '%s at line %d, column %d' % (self.message, self.line, self.column)
+
+class RhapsodyDiff(namedtuple('RhapsodyDiff', ['added', 'removed', 'moved', 'modified'])):
+    """RhapsodyDiff
+    GUIDs of the model elements added, removed, moved to another owner or with changed content between two versions of a file.
+    """
+    
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved or self.modified)
+    
+    __nonzero__ = __bool__
+
+class _RhapsodyDiffer:
+    """_RhapsodyDiffer
+    Compares old and new versions of files, pairing model elements by GUID and skipping blocks with equal hashes.
+    Elements found on only one side of a file are matched across all of the files before they are reported as added or removed,
+    so elements moved to another owner or another file are reported as moved.
+    """
+    
+    def __init__(self):
+        self.units = OrderedDict()
+        self.oldOrphans = {}
+        self.newOrphans = {}
+    
+    def addUnit(self, unit, oldRoot, newRoot, oldHashes=None, newHashes=None):
+        """ Compares the old and new trees of a file, either of which may be None when the file was added or removed"""
+        
+        self.units[unit] = (set(), set(), set(), set())
+        
+        if oldRoot is None or newRoot is None:
+            if oldRoot is not None:
+                self._addOrphans(unit, oldRoot, None, self.oldOrphans)
+            if newRoot is not None:
+                self._addOrphans(unit, newRoot, None, self.newOrphans)
+            return
+        elif oldHashes is not None and newHashes is not None and oldHashes.get(oldRoot) == newHashes.get(newRoot):
+            return
+        
+        guid = self._getGuid(oldRoot)
+        if guid != self._getGuid(newRoot):
+            self._addOrphans(unit, oldRoot, None, self.oldOrphans)
+            self._addOrphans(unit, newRoot, None, self.newOrphans)
+            return
+        
+        self._compare(unit, oldRoot, newRoot, guid, oldHashes or {}, newHashes or {}, False)
+    
+    def finish(self):
+        """ Matches the elements found on only one side of each file, returning a RhapsodyDiff per file"""
+        
+        matched = set(self.oldOrphans).intersection(self.newOrphans)
+        
+        for guid in matched:
+            oldUnit, oldNode, oldOwner, oldHashes = self.oldOrphans[guid]
+            newUnit, newNode, newOwner, newHashes = self.newOrphans[guid]
             
-        basepath, basename = os.path.split(filename)
-        name, ext = os.path.splitext(basename)
-        basepath = os.path.join(basepath, name + '_rpy')
+            if oldUnit != newUnit or oldOwner != newOwner:
+                self.units[newUnit][2].add(guid)
+            
+            # the elements below are matched on their own so only the content of this element is compared
+            if oldHashes.get(oldNode) is None or oldHashes.get(oldNode) != newHashes.get(newNode):
+                self._compare(newUnit, oldNode, newNode, guid, oldHashes, newHashes, True)
+        
+        for guid, (unit, _, _, _) in self.oldOrphans.items():
+            if guid not in matched:
+                self.units[unit][1].add(guid)
+        for guid, (unit, _, _, _) in self.newOrphans.items():
+            if guid not in matched:
+                self.units[unit][0].add(guid)
+        
+        return OrderedDict((unit, RhapsodyDiff(*[sorted(guids) for guids in changes])) for unit, changes in self.units.items())
+    
+    def _compare(self, unit, oldRoot, newRoot, owner, oldHashes, newHashes, orphaned):
+        """ Descends the paired blocks of two trees whose hashes differ, recording the elements whose content changed.
+        When orphaned is True the elements below the given blocks have already been collected and are not compared."""
+        
+        modified = self.units[unit][3]
+        stack = [(oldRoot, newRoot, owner)]
+        
+        while stack:
+            old, new, owner = stack.pop()
+            changed = old.get('type') != new.get('type')
+            packed = old.get('rhapsody_values') is not None or new.get('rhapsody_values') is not None
+            if packed:
+                changed = changed or self._getValues(old) != self._getValues(new)
+            oldChildren = self._getChildren(old, packed)
+            newChildren = self._getChildren(new, packed)
+            
+            for key, oldChild in oldChildren.items():
+                newChild = newChildren.get(key)
                 
-        if ext.lower() != ".rpy":
-            raise ValueError('Invalid project file (Expected rpy type file):\n\t%s' % (filename))
-        elif True != os.path.isdir(basepath):
-            raise ValueError('Missing project directory:\n\t%s' % (basepath))
+                if '#' == key[0]:
+                    if not orphaned and newChild is None:
+                        self._addOrphans(unit, oldChild, owner, self.oldOrphans, oldHashes)
+                    elif not orphaned:
+                        oldDigest = oldHashes.get(oldChild)
+                        if oldDigest is None or oldDigest != newHashes.get(newChild):
+                            stack.append((oldChild, newChild, key[1]))
+                elif newChild is None:
+                    changed = True
+                    if not orphaned:
+                        self._addOrphans(unit, oldChild, owner, self.oldOrphans, oldHashes)
+                elif oldChild.get('type') is None and 'elementList' != oldChild.tag:
+                    changed = changed or newChild.get('type') is not None or (oldChild.text or '') != (newChild.text or '')
+                elif oldChild.get('rhapsody_skipped') is not None or newChild.get('rhapsody_skipped') is not None:
+                    changed = changed or oldChild.get('type') != newChild.get('type') or oldChild.text != newChild.text
+                else:
+                    oldDigest = oldHashes.get(oldChild)
+                    if oldDigest is None or oldDigest != newHashes.get(newChild):
+                        stack.append((oldChild, newChild, owner))
+            
+            for key, newChild in newChildren.items():
+                if key not in oldChildren:
+                    changed = changed or '#' != key[0]
+                    if not orphaned:
+                        self._addOrphans(unit, newChild, owner, self.newOrphans, newHashes)
+            
+            if changed and owner is not None:
+                modified.add(owner)
     
-        projectFiles = {}
-        root = RhapsodyFileParser.parse(filename)
-        projectFiles[filename] = root
+    def _addOrphans(self, unit, root, owner, orphans, hashes=None):
+        """ Collects the elements in a tree found on only one side of a file along with the GUID of their owner"""
         
-        if parseDependencies:
-            RhapsodyProjectParser._parseDependencies(projectFiles, root, basepath)
+        stack = [(root, owner)]
+        
+        while stack:
+            node, owner = stack.pop()
+            guid = self._getGuid(node)
+            if guid is not None:
+                orphans[guid] = (unit, node, owner, hashes or {})
+                owner = guid
             
-        return projectFiles
+            for child in node:
+                if child.get('type') is not None or 'elementList' == child.tag:
+                    stack.append((child, owner))
     
     @staticmethod
-    def _parseDependencies(projectFiles, node, basepath):
-        """ Searches for any files linked to by the given xml tree and adds any found to the dictionary"""
+    def _getChildren(node, skipValues=False):
+        """ Returns the children of a block keyed by GUID for elements, or by name and position for everything else.
+        When skipValues is True single values in the value list are left out, as they are compared by _getValues."""
         
-        # find linked subsystem files
-        for filenameNode in node.xpath("//*[@type='ISubsystem']/fileName"):
-            if (2 >= len(filenameNode.text)):
-                continue
-                
-            filename = os.path.join(basepath, filenameNode.text[1:-1] + ".sbs")
-            
-            if (True != os.path.isfile(filename)):
-                continue
-            elif filename not in projectFiles:
-                link_path,_ = os.path.split(filename)
-                linked_node = RhapsodyFileParser.parse(filename)
-                projectFiles[filename] = linked_node
-                RhapsodyProjectParser._parseDependencies(projectFiles, linked_node, link_path)
-        
-        # find linked class files
-        for filenameNode in node.xpath("//*[@type='IClass']/fileName"):
-            if (2 >= len(filenameNode.text)):
-                continue
-                
-            filename = os.path.join(basepath, filenameNode.text[1:-1] + ".cls")
-
-            if (True != os.path.isfile(filename)):
-                continue
-            elif filename not in projectFiles:
-                link_path,_ = os.path.split(filename)
-                linked_node = RhapsodyFileParser.parse(filename)
-                projectFiles[filename] = linked_node
-                RhapsodyProjectParser._parseDependencies(projectFiles, linked_node, link_path)
-         
-        # find linked component files
-        for filenameNode in node.xpath("//*[@type='IComponent']/fileName"):
-            if (2 >= len(filenameNode.text)):
-                continue
-                
-            filename = os.path.join(basepath, filenameNode.text[1:-1] + ".cmp")
-
-            if (True != os.path.isfile(filename)):
+        children = OrderedDict()
+        counts = {}
+        
+        for child in node:
+            if skipValues and 'value' == child.tag and child.get('type') is None:
                 continue
-            elif filename not in projectFiles:
-                link_path,_ = os.path.split(filename)
-                linked_node = RhapsodyFileParser.parse(filename)
-                projectFiles[filename] = linked_node
-                RhapsodyProjectParser._parseDependencies(projectFiles, linked_node, link_path)
+            guid = _RhapsodyDiffer._getGuid(child)
+            if guid is not None:
+                key = ('#', guid)
+            else:
+                key = (child.tag, counts.get(child.tag, 0))
+                counts[child.tag] = key[1] + 1
+            children[key] = child
+        
+        return children
+    
+    @staticmethod
+    def _getValues(node):
+        """ Returns the single values of a block, or None when its value list holds blocks"""
+        
+        try:
+            return RhapsodyFileParser.getValues(node)
+        except ValueError:
+            return None
+    
+    @staticmethod
+    def _getGuid(node):
+        """ Returns the GUID of a model element, or None for scalars, handles and blocks without one"""
+        
+        if node.get('type') is None or node.get('rhapsody_skipped') is not None or RhapsodyProjectIndex._isHandle(node):
+            return None
+        
+        return node.findtext('_id')
 
 class RhapsodyFileParser:
     """RhapsodyFileParser
@@ -96,31 +1320,190 @@ class RhapsodyFileParser:
     VALUE_RE = re.compile(r'\s*-\s+value\s+=\s*', re.MULTILINE|re.DOTALL)
     CHILD_QUOTE_RE = re.compile(r'\s*(\"(?<!\\)\")\s*;', re.MULTILINE|re.DOTALL)
     CHILD_VALUE_RE = re.compile(r'(?=[^"]*"[^"]*(?:"[^"]*"[^"]*)*$);', re.MULTILINE|re.DOTALL) #re.compile(r'\s*(.*?);\s*', re.MULTILINE|re.DOTALL)
+    MEMBER_RE = re.compile(r'\s*(?:\}\s*|-\s+(\S+)\s+=\s*)', re.MULTILINE|re.DOTALL) # } or - <name> =
+    CONTENT_RE = re.compile(r'\s*\{\s*(\S+)\s+|([^;"]*(?:"[^"]*"[^;"]*)*);', re.MULTILINE|re.DOTALL) # { <block type> or <value>;
+    SKIP_RE = re.compile(r'[^{}"]*(?:"[^"]*"[^{}"]*)*([{}])\s*', re.MULTILINE|re.DOTALL) # next { or } outside of quotes
+    PACKED_ITEM_PATTERN = r'[^;{}"]*(?:"[^"]*"[^;{}"]*)*;' # <value>; without blocks
+    PACKED_ITEM_RE = re.compile(PACKED_ITEM_PATTERN, re.MULTILINE|re.DOTALL)
+    PACKED_RUN = 64
+    PACKED_RUN_RE = re.compile(r'(?:%s){%d}' % (PACKED_ITEM_PATTERN, PACKED_RUN), re.MULTILINE|re.DOTALL) # PACKED_RUN items at once
+    RECOVER_RE = re.compile(r'\s(?=-\s+\S+\s+=|\})', re.MULTILINE|re.DOTALL) # whitespace before - <name> = or }
+    MISSING_SEMICOLON_RE = re.compile(r'"[^"]*"|(\n\s*-\s+\S+\s+=)', re.MULTILINE|re.DOTALL) # "<quoted>" or - <name> = on a following line of a value
+    PACKED_VALUE_RE = re.compile(r'([^;"]*(?:"[^"]*"[^;"]*)*);', re.MULTILINE|re.DOTALL) # <value>;
+    ENGINES = ('scanner', 'regex')
+    TREES = ('lxml', 'compact')
+    LINK_BLOCK_TYPES = frozenset(('ISubsystem', 'IClass', 'IComponent'))
+    INVALID_CHAR_RE = re.compile(u'[^\u0009\u000A\u000D\u0020-\uD7FF\uE000-\uFFFD\U00010000-\U0010FFFF]') # characters which are not allowed in xml
+    BOMS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'), (codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+    LINK_SCAN_RE = re.compile(r'[-"{}](?:(?<=")[^"]*"|(?<=\{)\s*(\S+)\s|(?<=\})()|(?<=-)\s+fileName\s+=\s*([^;"]*(?:"[^"]*"[^;"]*)*);)', re.MULTILINE|re.DOTALL) # "<quoted>" or { <block type> or } or - fileName = <value>;
     
     @staticmethod
-    def parse(source):
-        """ Translate rhapsody file into xml. Takes in file descriptor or a string filename"""
+    def parse(source, encoding=None, stats=None, **kwargs):
+        """ Translate rhapsody file into xml. Takes in file descriptor, a string filename or the bytes of a file.
+        When encoding is given the file is memory mapped and decoded with it, 'detect' detects the encoding as fromString does.
+        When stats is a RhapsodyParseStats the timings and node counts of the file are recorded in it.
+        Keyword arguments are passed on to fromString."""
         
         content = None
         
+        if stats is not None:
+            stats = RhapsodyParseStats._getUnit(stats, source if isinstance(source, string_types) else getattr(source, 'name', None))
+            start = time.perf_counter()
+        
         if isinstance(source, string_types):
-            with open(source, 'r') as f:
-                content = f.read()
+            if encoding is None:
+                with open(source, 'r') as f:
+                    content = f.read()
+            else:
+                with open(source, 'rb') as f:
+                    if 0 == os.fstat(f.fileno()).st_size:
+                        content = f.read()
+                    else:
+                        content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
         elif hasattr(source, 'read'):
             content = source.read()
+        elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            content = source
         else:
-            raise ValueError('Invalid source (Expected file object or filename)')
+            raise ValueError('Invalid source (Expected file object, filename or bytes)')
+        
+        if stats is not None:
+            stats.read += time.perf_counter() - start
         
-        return RhapsodyFileParser.fromString(content)
+        try:
+            return RhapsodyFileParser.fromString(content, encoding=encoding, stats=stats, **kwargs)
+        finally:
+            if isinstance(content, mmap.mmap) and content is not source:
+                content.close()
     
     @staticmethod
-    def fromString(content):
-        """ Translate rhapsody formatted string into xml."""
-         
-        content = ''.join(c for c in content if RhapsodyFileParser._valid_xml_char_ordinal(c))
+    def fromString(content, engine='scanner', links=None, tree='lxml', skip_types=None, skip_attributes=None, keep_skipped=False, encoding=None, stats=None, element_index=None, hashes=None, pack_values=False, errors=None):
+        """ Translate rhapsody formatted string into xml.
+        The content can also be bytes, a memoryview or an mmap, which is decoded with the given encoding.
+        Without an encoding it is detected from the byte order mark, otherwise utf-8 is tried before falling back to latin-1.
+        The scanner engine tokenizes the content in a single non-recursive pass, the regex engine is the original recursive parser.
+        When links is a list the (block type, file name) of each linked subsystem, class and component is appended to it.
+        When tree is 'compact' a read-only RhapsodyCompactElement tree is returned instead of an lxml tree.
+        Blocks with a type in skip_types and attributes named in skip_attributes are left out of the tree and the size of a value list
+        only counts the values which are kept, when keep_skipped is True each skipped block is kept as an unparsed placeholder which can be parsed later with expand.
+        When stats is a RhapsodyParseStats, or the RhapsodyUnitStats of a file, the timings and node counts are recorded in it.
+        When element_index is a RhapsodyElementIndex each block is added to it by type and name as it is built.
+        When hashes is a dictionary the content hash of each block is added to it as the block is built, see hashTree.
+        When pack_values is True value lists holding only single values are kept as their raw text in a rhapsody_values attribute
+        of the enclosing block instead of as value elements, see getValues and expandValues. Packed lists are not expanded when
+        they are accessed, so find('value') finds nothing while size still counts the values until expandValues is called.
+        When errors is a list the content is parsed leniently, each problem is appended to it as a RhapsodyParseError and parsing
+        continues from the next attribute or end of block, so a partial tree is returned instead of raising ValueError."""
+        
+        if engine not in RhapsodyFileParser.ENGINES:
+            raise ValueError('Invalid engine (Expected one of %s)' % (', '.join(RhapsodyFileParser.ENGINES)))
+        elif tree not in RhapsodyFileParser.TREES:
+            raise ValueError('Invalid tree (Expected one of %s)' % (', '.join(RhapsodyFileParser.TREES)))
+        elif 'compact' == tree and 'scanner' != engine:
+            raise ValueError('Compact trees are only built by the scanner engine')
+        elif (skip_types or skip_attributes) and 'scanner' != engine:
+            raise ValueError('Skipping is only supported by the scanner engine')
+        elif pack_values and 'scanner' != engine:
+            raise ValueError('Packed values are only supported by the scanner engine')
+        elif errors is not None and 'scanner' != engine:
+            raise ValueError('Error recovery is only supported by the scanner engine')
+        
+        if isinstance(skip_types, string_types):
+            skip_types = (skip_types, )
+        if isinstance(skip_attributes, string_types):
+            skip_attributes = (skip_attributes, )
+        
+        if stats is not None:
+            stats = RhapsodyParseStats._getUnit(stats, None)
+            stats.bytes += len(content)
+            start = time.perf_counter()
+        
+        if not isinstance(content, string_types):
+            content = RhapsodyFileParser._decode(content, encoding)
+        content = RhapsodyFileParser._sanitize(content)
         contentLength = len(content)
         
+        if stats is not None:
+            stats.sanitize += time.perf_counter() - start
+            start = time.perf_counter()
+        
+        if 'compact' == tree:
+            root = RhapsodyCompactElement('root')
+        else:
+            root = etree.Element('root')
+        
+        match = RhapsodyFileParser.FILE_INFO_RE.match(content)
+        if match is None:
+            if errors is None:
+                raise ValueError('Expected file information at line %d' % (RhapsodyFileParser._getLineNum(content, 0)))
+            errors.append(RhapsodyParseError(1, 1, 'Expected file information'))
+            return root
+        
+        root.set('rhapsody_type', match.group(1))
+        root.set('rhapsody_version', match.group(2))
+        root.set('rhapsody_lang', match.group(3))
+        root.set('id', match.group(4))
+        contentOffset = match.end()
+        
+        if 'scanner' == engine:
+            for _ in RhapsodyFileParser._scanBlock(root, content, contentOffset, links=links, compact=('compact' == tree),
+                                                   skipTypes=frozenset(skip_types or ()), skipAttributes=frozenset(skip_attributes or ()),
+                                                   keepSkipped=keep_skipped, elements=element_index, hashes=hashes,
+                                                   packValues=pack_values, errors=errors):
+                pass
+        else:
+            root, _ = RhapsodyFileParser._parseBlock(root, content, contentLength, contentOffset)
+            if links is not None:
+                links.extend(RhapsodyFileParser._findLinks(root))
+            if element_index is not None:
+                element_index.addTree(root)
+            if hashes is not None:
+                RhapsodyFileParser.hashTree(root, hashes)
+        
+        if stats is not None:
+            stats.tokenize += time.perf_counter() - start
+            stats.countNodes(root)
+
+        return root
+    
+    @staticmethod
+    def iterparse(source, events=('end',), tag=None, chunk_size=65536):
+        """ Incrementally translate rhapsody file into xml. Takes in a text or binary file object or a string filename.
+        Returns an iterator of (event, element) tuples in the style of lxml.etree.iterparse, where the events are 'start' and 'end'.
+        The input is read in chunks, so elements that are no longer needed can be cleared to keep memory usage flat."""
+        
+        if not isinstance(source, string_types) and not hasattr(source, 'read'):
+            raise ValueError('Invalid source (Expected file object or filename)')
+        
+        for event in events:
+            if event not in ('start', 'end'):
+                raise ValueError('Invalid event %s (Expected start or end)' % (event))
+        
+        if 1 > chunk_size:
+            raise ValueError('Expected chunk_size to be a positive integer')
+        
+        if isinstance(tag, string_types):
+            tag = (tag, )
+        if tag is not None:
+            tag = frozenset(tag)
+        
+        return RhapsodyFileParser._iterparse(source, 'start' in events, 'end' in events, tag, chunk_size)
+    
+    @staticmethod
+    def _iterparse(source, startEvents, endEvents, tags, chunkSize):
+        if isinstance(source, string_types):
+            with open(source, 'r') as f:
+                for event in RhapsodyFileParser._iterparse(f, startEvents, endEvents, tags, chunkSize):
+                    yield event
+            return
+        
+        stream = _RhapsodyStream(source, chunkSize)
+        content, contentOffset = stream.extend('', 0)
+        
         match = RhapsodyFileParser.FILE_INFO_RE.match(content)
+        while not stream.eof and (match is None or match.end() == len(content)):
+            content, contentOffset = stream.extend(content, contentOffset)
+            match = RhapsodyFileParser.FILE_INFO_RE.match(content)
         if match is None:
             raise ValueError('Expected file information at line %d' % (RhapsodyFileParser._getLineNum(content, 0)))
         
@@ -131,78 +1514,651 @@ class RhapsodyFileParser:
         root.set('id', match.group(4))
         contentOffset = match.end()
         
-        root, _ = RhapsodyFileParser._parseBlock(root, content, contentLength, contentOffset)
+        for event in RhapsodyFileParser._scanBlock(root, content, contentOffset, stream, startEvents, endEvents, tags):
+            yield event
+    
+    @staticmethod
+    def scanLinks(source):
+        """ Returns the (block type, file name) of each linked subsystem, class and component without translating the file.
+        Only quoted strings, block boundaries and fileName attributes are matched, so this is much faster than parse."""
+        
+        if isinstance(source, string_types):
+            with open(source, 'r') as f:
+                content = f.read()
+        elif hasattr(source, 'read'):
+            content = source.read()
+        else:
+            raise ValueError('Invalid source (Expected file object or filename)')
+        
+        links = []
+        blockTypes = []
+        linkTypes = RhapsodyFileParser.LINK_BLOCK_TYPES
+        
+        for match in RhapsodyFileParser.LINK_SCAN_RE.finditer(content):
+            blockType, blockEnd, fileName = match.groups()
+            if blockType is not None:
+                blockTypes.append(blockType)
+            elif blockEnd is not None:
+                if blockTypes:
+                    blockTypes.pop()
+            elif fileName is not None and blockTypes and blockTypes[-1] in linkTypes:
+                links.append((blockTypes[-1], fileName))
+        
+        return links
+    
+    @staticmethod
+    def expand(node, links=None):
+        """ Parses a placeholder left by fromString with keep_skipped in place, so it holds the same content as a full parse.
+        When links is a list the links found in the block are appended to it."""
+        
+        if 'true' != node.get('rhapsody_skipped'):
+            raise ValueError('Element %s is not a skipped block' % (node.tag))
+        
+        content = node.text
+        node.text = None
+        if isinstance(node, RhapsodyCompactElement):
+            del node._attrib['rhapsody_skipped']
+        else:
+            del node.attrib['rhapsody_skipped']
+        
+        for _ in RhapsodyFileParser._scanBlock(node, content, 0, links=links, compact=isinstance(node, RhapsodyCompactElement)):
+            pass
+        
+        return node
+    
+    @staticmethod
+    def getValues(node, typecode=None):
+        """ Returns the single values in the value list of a block, whether it is packed or held as value elements.
+        When typecode is given the values are converted into an array.array of that type, such as 'l' or 'd'."""
+        
+        packed = node.get('rhapsody_values')
+        if packed is not None:
+            values = RhapsodyFileParser._splitValues(packed)
+        else:
+            values = []
+            for child in node.iterchildren('value'):
+                if child.get('type') is not None:
+                    raise ValueError('Value list of %s holds blocks' % (node.tag))
+                values.append(child.text or '')
+        
+        if typecode is None:
+            return values
+        
+        return array.array(typecode, map(float if typecode in 'fd' else int, values))
+    
+    @staticmethod
+    def expandValues(node):
+        """ Replaces the packed value list of a block left by fromString with pack_values by value elements in place,
+        so it holds the same content as a full parse."""
+        
+        packed = node.get('rhapsody_values')
+        if packed is None:
+            raise ValueError('Element %s has no packed values' % (node.tag))
+        
+        values = RhapsodyFileParser._splitValues(packed)
+        
+        if isinstance(node, RhapsodyCompactElement):
+            del node._attrib['rhapsody_values']
+            items = node._items
+            index = 0
+            while 'size' != items[index]:
+                index += 1 if isinstance(items[index], RhapsodyCompactElement) else 2
+            
+            tag = intern('value')
+            packed = [None] * (2 * len(values))
+            packed[0::2] = [tag] * len(values)
+            packed[1::2] = values
+            items[index + 2:index + 2] = packed
+        else:
+            del node.attrib['rhapsody_values']
+            index = node.index(node.find('size')) + 1
+            elements = []
+            for text in values:
+                element = etree.Element('value')
+                element.text = text
+                elements.append(element)
+            node[index:index] = elements
+        
+        return node
+    
+    @staticmethod
+    def toString(root):
+        """ Translate xml tree into a rhapsody formatted string"""
+        
+        output = io.StringIO()
+        RhapsodyFileParser.write(root, output)
+        
+        return output.getvalue()
+    
+    @staticmethod
+    def write(root, target, chunk_size=4096):
+        """ Translate xml tree into rhapsody format, writing it to a file object or a string filename.
+        The output is written in chunks of chunk_size pieces as the tree is walked, so no string holding the whole file is built.
+        Elements with a type attribute are written as blocks and all other elements as values, parsing the output gives an identical tree."""
+        
+        if isinstance(target, string_types):
+            with open(target, 'w') as f:
+                RhapsodyFileParser.write(root, f, chunk_size)
+            return
+        elif not hasattr(target, 'write'):
+            raise ValueError('Invalid target (Expected file object or filename)')
+        
+        pieces = ['%s version %s %s %s\n' % (root.get('rhapsody_type', ''), root.get('rhapsody_version', ''), root.get('rhapsody_lang', ''), root.get('id', ''))]
+        
+        for piece in RhapsodyFileParser._writeBlock(root):
+            pieces.append(piece)
+            if len(pieces) >= chunk_size:
+                target.write(''.join(pieces))
+                pieces = []
+        
+        pieces.append('\n')
+        target.write(''.join(pieces))
+    
+    @staticmethod
+    def hashTree(root, hashes=None):
+        """ Returns a dictionary of the content hash of each block in a tree, as computed while parsing with hashes.
+        Each hash covers the type of the block and the name and content of everything below it, so blocks with
+        equal hashes are equal wherever they are in the tree."""
+        
+        if hashes is None:
+            hashes = {}
+        
+        # each stack entry holds a block or element list, its remaining children, its hash and whether it is a list
+        stack = [(root, iter(root), hashlib.sha1((root.get('type', '') + '\0').encode('utf-8')), False)]
+        
+        while stack:
+            node, children, hasher, isList = stack[-1]
+            child = next(children, None)
+            
+            if child is None:
+                stack.pop()
+                if not isList:
+                    digest = hashes[node] = hasher.digest()
+                    if stack:
+                        stack[-1][2].update(b'B' + node.tag.encode('utf-8') + b'\0' + digest)
+                continue
+            
+            blockType = child.get('type')
+            if blockType is None:
+                if 'elementList' == child.tag:
+                    hasher.update(('L%d\0' % (len(child))).encode('utf-8'))
+                    # the items are hashed as part of the enclosing block
+                    stack.append((child, iter(child), hasher, True))
+                else:
+                    hasher.update(('S%s\0%s\0' % (child.tag, child.text or '')).encode('utf-8'))
+                    if 'size' == child.tag and node.get('rhapsody_values') is not None:
+                        hasher.update(RhapsodyFileParser._getValueRecords(node.get('rhapsody_values')))
+            elif child.get('rhapsody_skipped') is not None:
+                digest = hashes[child] = hashlib.sha1(b'R' + child.text.encode('utf-8')).digest()
+                hasher.update(b'B' + child.tag.encode('utf-8') + b'\0' + digest)
+            else:
+                stack.append((child, iter(child), hashlib.sha1((blockType + '\0').encode('utf-8')), False))
+        
+        return hashes
+    
+    @staticmethod
+    def diff(oldRoot, newRoot, oldHashes=None, newHashes=None):
+        """ Compares two versions of a file, returning a RhapsodyDiff of the model elements which changed.
+        Elements are paired by GUID and subtrees with equal hashes are skipped, so the hashes from parsing make the cost scale with the change."""
+        
+        differ = _RhapsodyDiffer()
+        differ.addUnit(None, oldRoot, newRoot,
+                       oldHashes if oldHashes is not None else RhapsodyFileParser.hashTree(oldRoot),
+                       newHashes if newHashes is not None else RhapsodyFileParser.hashTree(newRoot))
+        
+        return differ.finish()[None]
+    
+    @staticmethod
+    def getGuidDict(root):
+        guid_dict = {}
+        
+        # find all model elements with a GUID
+        for node in root.xpath("//_id/.."):
+            # ignore dependencies
+            if ('_dependsOn' != node.tag): 
+                id_node = node.find('_id')
+                if id_node is not None:
+                    guid_dict[id_node.text] = node
 
-        return root
+        return guid_dict
+    
+    @staticmethod
+    def _writeBlock(node):
+        """ Yields the rhapsody formatted text of a block and all of its nested blocks.
+        Open blocks are kept on an explicit stack so deeply nested trees can not exceed the recursion limit."""
+        
+        # each stack entry holds an enclosing block, its remaining children, its level and the list being written
+        stack = []
+        block = node
+        children = iter(node)
+        level = 0
+        listTag = None
+        
+        yield '{ %s \n' % (node.get('type', ''))
+        
+        while (True):
+            child = next(children, None)
+            
+            if child is None:
+                if 'element' == listTag:
+                    # end of element list
+                    yield '\t'*(level + 1) + '\n'
+                    block, children, level, listTag = stack.pop()
+                    continue
+                elif 'value' == listTag:
+                    yield '\n'
+                
+                yield '\t'*level + '}'
+                if not stack:
+                    break
+                
+                block, children, level, listTag = stack.pop()
+                if 'value' != listTag:
+                    yield '\n'
+                continue
+            
+            tag = child.tag
+            indent = '\t'*(level + 1)
+            
+            if 'value' == listTag and 'value' == tag:
+                if child.get('type') is None:
+                    yield (child.text or '') + ';'
+                    continue
+                yield '\n' + indent
+            elif 'element' == listTag:
+                yield indent
+            else:
+                if 'value' == listTag:
+                    # end of value list
+                    yield '\n'
+                    listTag = None
+                
+                if 'size' == tag:
+                    yield indent + '- size = %s;\n' % (child.text)
+                    if (0 != int(child.text)):
+                        yield indent + '- value = '
+                        listTag = 'value'
+                        if block.get('rhapsody_values') is not None:
+                            yield block.get('rhapsody_values')
+                    continue
+                elif 'elementList' == tag:
+                    yield indent + '- elementList = %d;\n' % (len(child))
+                    stack.append((block, children, level, listTag))
+                    children = iter(child)
+                    listTag = 'element'
+                    continue
+                
+                yield indent + '- %s = ' % (tag)
+                if child.get('type') is None:
+                    yield (child.text or '') + ';\n'
+                    continue
+            
+            if child.get('rhapsody_skipped') is not None:
+                # placeholder holding the raw text of a skipped block
+                yield child.text
+                if 'value' != listTag:
+                    yield '\n'
+                continue
+            
+            # start of nested block
+            yield '{ %s \n' % (child.get('type'))
+            stack.append((block, children, level, listTag))
+            block = child
+            children = iter(child)
+            level += 1
+            listTag = None
+    
+    @staticmethod
+    def _scanBlock(node, content, contentOffset, stream=None, startEvents=False, endEvents=False, tags=None, links=None, compact=False, skipTypes=None, skipAttributes=None, keepSkipped=False, elements=None, hashes=None, packValues=False, errors=None):
+        """ Parses a block and all of its nested blocks in a single pass, yielding (event, element) tuples for the requested events.
+        Open blocks are kept on an explicit stack so deeply nested content can not exceed the recursion limit.
+        When a stream is given the content is only a window of the input, which is extended whenever a token reaches its end.
+        When links is a list the (block type, file name) of each linked subsystem, class and component is appended to it.
+        When compact is True the node is a RhapsodyCompactElement and the tree is built from compact elements, which do not support events.
+        Blocks with a type in skipTypes and attributes named in skipAttributes are passed over without building them,
+        when keepSkipped is True a skipped block is kept as a placeholder element holding its raw text, otherwise skipped values are taken off the size of their list.
+        When elements is a RhapsodyElementIndex each block is added to it as it is built.
+        When hashes is a dictionary the hash of each block is added to it as the block ends, see hashTree.
+        When packValues is True value lists holding only single values are matched at once and kept as raw text, without events.
+        When errors is a list, and no stream is given, problems are appended to it and parsing continues, see _recover."""
+        
+        memberMatch = RhapsodyFileParser.MEMBER_RE.match
+        contentMatch = RhapsodyFileParser.CONTENT_RE.match
+        SubElement = etree.SubElement
+        addScalar = None
+        events = startEvents or endEvents
+        linkTypes = RhapsodyFileParser.LINK_BLOCK_TYPES
+        skipping = bool(skipTypes or skipAttributes)
+        skipTypes = skipTypes or ()
+        skipAttributes = skipAttributes or ()
+        typeIndex = elements.types if elements is not None else None
+        packValues = packValues and stream is None and not events and 'value' not in skipAttributes
+        recovering = errors is not None and stream is None
+        lineIndex = _RhapsodyLineIndex(content) if recovering else None
+        closing = False
+        validTags = set(('size', 'value', 'elementList'))
+        # blocks which had list items skipped, with the number of values to take off their size
+        resized = {}
+        
+        if compact:
+            SubElement, addScalar = RhapsodyCompactElement._getBuilder()
+        
+        match = RhapsodyFileParser.BLOCK_START_RE.match(content, contentOffset)
+        while stream is not None and not stream.eof and (match is None or match.end() == len(content)):
+            content, contentOffset = stream.extend(content, contentOffset)
+            match = RhapsodyFileParser.BLOCK_START_RE.match(content, contentOffset)
+        if match is None:
+            if not recovering:
+                raise ValueError("Invalid block at line %d" % (RhapsodyFileParser._getStreamLineNum(stream, content, contentOffset)))
+            RhapsodyFileParser._recover(content, contentOffset, errors, lineIndex, 'Invalid block')
+            return
+        
+        node.set('type', match.group(1))
+        contentOffset = match.end()
+        
+        if typeIndex is not None:
+            typeIndex.setdefault(match.group(1), []).append(node)
+        
+        hasher = None
+        if hashes is not None:
+            hasher = hashlib.sha1((match.group(1) + '\0').encode('utf-8'))
+        
+        if startEvents and (tags is None or node.tag in tags):
+            yield ('start', node)
+        
+        # each stack entry holds the enclosing block, the state of its value list and its hash
+        stack = []
+        listNode = None
+        listTag = None
+        remaining = 0
+        
+        while (True):
+            if remaining:
+                # next item of a value list or element list
+                remaining -= 1
+                parent = listNode
+                tag = listTag
+                listItem = True
+            else:
+                listItem = False
+                if events and 'element' == listTag:
+                    # end of element list
+                    if endEvents and (tags is None or 'elementList' in tags):
+                        yield ('end', listNode)
+                    listTag = None
+                
+                match = memberMatch(content, contentOffset)
+                while stream is not None and not stream.eof and (match is None or match.end() == len(content)):
+                    content, contentOffset = stream.extend(content, contentOffset)
+                    match = memberMatch(content, contentOffset)
+                if match is not None:
+                    contentOffset = match.end()
+                    tag = match.group(1)
+                elif not recovering:
+                    raise ValueError('Expected } at line %d' % (RhapsodyFileParser._getStreamLineNum(stream, content, contentOffset)))
+                else:
+                    if not closing:
+                        contentOffset = RhapsodyFileParser._recover(content, contentOffset, errors, lineIndex, 'Expected }')
+                        if contentOffset < len(content):
+                            continue
+                    # close the open blocks at the end of the content
+                    closing = True
+                    tag = None
+                
+                if tag is None:
+                    # end of block
+                    if resized and node in resized:
+                        RhapsodyFileParser._resize(node, resized.pop(node))
+                        if hashes is not None:
+                            # the size and list records hashed so far count the skipped items, so the block is hashed from its tree
+                            hasher = None
+                            RhapsodyFileParser.hashTree(node, hashes)
+                    if endEvents and (tags is None or node.tag in tags):
+                        yield ('end', node)
+                    if hashes is not None:
+                        if hasher is not None:
+                            hashes[node] = hasher.digest()
+                        record = b'B' + node.tag.encode('utf-8') + b'\0' + hashes[node]
+                    if not stack:
+                        break
+                    node, listNode, listTag, remaining, hasher = stack.pop()
+                    if hashes is not None:
+                        hasher.update(record)
+                    continue
+                elif ('size' == tag):
+                    match = RhapsodyFileParser.SIZE_RE.match(content, contentOffset)
+                    while stream is not None and not stream.eof and (match is None or match.end() == len(content)):
+                        content, contentOffset = stream.extend(content, contentOffset)
+                        match = RhapsodyFileParser.SIZE_RE.match(content, contentOffset)
+                    if match is None:
+                        if not recovering:
+                            raise ValueError('Invalid size attribute at line %d' % (RhapsodyFileParser._getStreamLineNum(stream, content, contentOffset)))
+                        contentOffset = RhapsodyFileParser._recover(content, contentOffset, errors, lineIndex, 'Invalid size attribute')
+                        continue
+                    contentOffset = match.end()
+                    
+                    if addScalar is not None:
+                        addScalar(node, 'size', match.group(1))
+                    else:
+                        child = SubElement(node, 'size')
+                        child.text = match.group(1)
+                        
+                        if events and (tags is None or 'size' in tags):
+                            if startEvents:
+                                yield ('start', child)
+                            if endEvents:
+                                yield ('end', child)
+                    
+                    if hashes is not None:
+                        hasher.update(('Ssize\0%s\0' % (match.group(1))).encode('utf-8'))
+                    
+                    count = int(match.group(1))
+                    if (0 != count):
+                        match = RhapsodyFileParser.VALUE_RE.match(content, contentOffset)
+                        while stream is not None and not stream.eof and (match is None or match.end() == len(content)):
+                            content, contentOffset = stream.extend(content, contentOffset)
+                            match = RhapsodyFileParser.VALUE_RE.match(content, contentOffset)
+                        if match is None:
+                            if not recovering:
+                                raise ValueError('Invalid value attribute at line %d' % (RhapsodyFileParser._getStreamLineNum(stream, content, contentOffset)))
+                            contentOffset = RhapsodyFileParser._recover(content, contentOffset, errors, lineIndex, 'Invalid value attribute')
+                            continue
+                        contentOffset = match.end()
+                        
+                        if packValues:
+                            # match runs of items and then the rest one by one, the list is only packed when all of them are single values
+                            runs, rest = divmod(count, RhapsodyFileParser.PACKED_RUN)
+                            packedEnd = contentOffset
+                            for itemMatch, repeat in ((RhapsodyFileParser.PACKED_RUN_RE.match, runs), (RhapsodyFileParser.PACKED_ITEM_RE.match, rest)):
+                                for _ in range(repeat):
+                                    match = itemMatch(content, packedEnd)
+                                    if match is None:
+                                        break
+                                    packedEnd = match.end()
+                                if match is None:
+                                    break
+                            else:
+                                packed = content[contentOffset:packedEnd]
+                                node.set('rhapsody_values', packed)
+                                contentOffset = packedEnd
+                                if hashes is not None:
+                                    hasher.update(RhapsodyFileParser._getValueRecords(packed))
+                                continue
+                        
+                        listNode = node
+                        listTag = 'value'
+                        remaining = count
+                    continue
+                elif ('elementList' == tag):
+                    listNode = SubElement(node, 'elementList')
+                    match = RhapsodyFileParser.SIZE_RE.match(content, contentOffset)
+                    while stream is not None and not stream.eof and (match is None or match.end() == len(content)):
+                        content, contentOffset = stream.extend(content, contentOffset)
+                        match = RhapsodyFileParser.SIZE_RE.match(content, contentOffset)
+                    if match is None:
+                        if not recovering:
+                            raise ValueError('Invalid elementList attribute at line %d' % (RhapsodyFileParser._getStreamLineNum(stream, content, contentOffset)))
+                        contentOffset = RhapsodyFileParser._recover(content, contentOffset, errors, lineIndex, 'Invalid elementList attribute')
+                        continue
+                    contentOffset = match.end()
+                    listTag = 'element'
+                    remaining = int(match.group(1))
+                    
+                    if hashes is not None:
+                        hasher.update(('L%d\0' % (remaining)).encode('utf-8'))
+                    
+                    if startEvents and (tags is None or 'elementList' in tags):
+                        yield ('start', listNode)
+                    continue
+                
+                parent = node
+            
+            match = contentMatch(content, contentOffset)
+            while stream is not None and not stream.eof and (match is None or match.end() == len(content)):
+                content, contentOffset = stream.extend(content, contentOffset)
+                match = contentMatch(content, contentOffset)
+            if match is None:
+                if not recovering:
+                    raise ValueError('Missing ; at line %d' % (RhapsodyFileParser._getStreamLineNum(stream, content, contentOffset)))
+                contentOffset = RhapsodyFileParser._recover(content, contentOffset, errors, lineIndex, 'Missing ;')
+                remaining = 0
+                continue
+            contentOffset = match.end()
+            
+            blockType, text = match.groups()
+            if recovering and text is not None and '\n' in text:
+                # a value running into the attributes on the following lines is missing its ;
+                for missing in RhapsodyFileParser.MISSING_SEMICOLON_RE.finditer(text):
+                    if missing.group(1) is not None:
+                        contentOffset = RhapsodyFileParser._recover(content, match.start(2) + missing.start(), errors, lineIndex, 'Missing ;')
+                        text = text[:missing.start()].rstrip()
+                        break
+            if recovering and tag not in validTags:
+                # lxml only accepts attribute names which are valid xml names
+                try:
+                    etree.Element(tag)
+                except ValueError:
+                    RhapsodyFileParser._recover(content, content.rindex(tag, 0, match.start()), errors, lineIndex, 'Invalid attribute name')
+                    if text is None:
+                        try:
+                            content, _, _, contentOffset = RhapsodyFileParser._skipBlock(content, content.index('{', match.start()), stream)
+                        except ValueError:
+                            contentOffset = RhapsodyFileParser._recover(content, len(content), errors, lineIndex, 'Expected }')
+                            closing = True
+                    remaining = 0
+                    continue
+                validTags.add(tag)
+            if skipping and ((text is None and blockType in skipTypes) or tag in skipAttributes):
+                if text is None:
+                    blockStart = content.index('{', match.start())
+                    try:
+                        content, blockStart, blockEnd, contentOffset = RhapsodyFileParser._skipBlock(content, blockStart, stream)
+                    except ValueError:
+                        if not recovering:
+                            raise
+                        contentOffset = RhapsodyFileParser._recover(content, len(content), errors, lineIndex, 'Expected }')
+                        closing = True
+                        continue
+                    
+                    if keepSkipped:
+                        child = SubElement(parent, tag, type=blockType)
+                        child.set('rhapsody_skipped', 'true')
+                        child.text = content[blockStart:blockEnd]
+                        
+                        if hashes is not None:
+                            digest = hashes[child] = hashlib.sha1(b'R' + child.text.encode('utf-8')).digest()
+                            hasher.update(b'B' + tag.encode('utf-8') + b'\0' + digest)
+                        
+                        if events and (tags is None or tag in tags):
+                            if startEvents:
+                                yield ('start', child)
+                            if endEvents:
+                                yield ('end', child)
+                    elif listItem:
+                        resized[node] = resized.get(node, 0) + ('value' == tag)
+                    continue
+                elif not keepSkipped:
+                    if listItem:
+                        resized[node] = resized.get(node, 0) + ('value' == tag)
+                    continue
+            
+            if text is None:
+                # start of nested block
+                stack.append((node, listNode, listTag, remaining, hasher))
+                node = SubElement(parent, tag, type=blockType)
+                listTag = None
+                remaining = 0
+                
+                if hashes is not None:
+                    hasher = hashlib.sha1((blockType + '\0').encode('utf-8'))
+                
+                if typeIndex is not None:
+                    typeIndex.setdefault(blockType, []).append(node)
+                
+                if startEvents and (tags is None or tag in tags):
+                    yield ('start', node)
+            else:
+                if events:
+                    child = SubElement(parent, tag)
+                    child.text = text
+                    
+                    if tags is None or tag in tags:
+                        if startEvents:
+                            yield ('start', child)
+                        if endEvents:
+                            yield ('end', child)
+                elif addScalar is None:
+                    SubElement(parent, tag).text = text
+                else:
+                    addScalar(parent, tag, text)
+                
+                if links is not None and 'fileName' == tag and parent.get('type') in linkTypes:
+                    links.append((parent.get('type'), text))
+                if typeIndex is not None and '_name' == tag:
+                    elements.addName(parent, text)
+                if hashes is not None:
+                    hasher.update(('S%s\0%s\0' % (tag, text)).encode('utf-8'))
     
     @staticmethod
-    def toString(root):
-        file_type = root.get('rhapsody_type', '')
-        rhapsody_version = root.get('rhapsody_version', '')
-        file_lang = root.get('rhapsody_lang', '')
-        file_id = root.get('id', '')
+    def _resize(node, skipped):
+        """ Takes the skipped items of its value list off the size of a block, so the tree can be written and parsed again"""
         
-        content = '%s version %s %s %s\n' % (file_type, rhapsody_version, file_lang, file_id)
-        content += RhapsodyFileParser._toChildString(root, 0)
-        content += '\n'
+        if not skipped:
+            return
         
-        return content
+        size = str(int(node.findtext('size')) - skipped)
+        if isinstance(node, RhapsodyCompactElement):
+            node._setText('size', size)
+        else:
+            node.find('size').text = size
     
     @staticmethod
-    def getGuidDict(root):
-        guid_dict = {}
+    def _skipBlock(content, blockStart, stream):
+        """ Finds the end of the block opening at blockStart by counting the braces outside of quoted values.
+        Returns the content, which only keeps the window from the start of the block when it is extended from a stream,
+        the start and end of the block and the offset of the next token."""
         
-        # find all model elements with a GUID
-        for node in root.xpath("//_id/.."):
-            # ignore dependencies
-            if ('_dependsOn' != node.tag): 
-                id_node = node.find('_id')
-                if id_node is not None:
-                    guid_dict[id_node.text] = node
-
-        return guid_dict
-    
-    @staticmethod
-    def _toChildString(node, level):
-        content = ''
-    
-        if (0 == len(node)):
-            content += node.text + ';'
-        else:
-            content += '{ %s \n' % (node.get('type', ''))
-            
-            isValueNode = False
-            
-            for child in node:
-                if (True == isValueNode):
-                    if (0 == len(child)):
-                        RhapsodyFileParser._toChildString(child, level + 1)
-                    else:
-                        content += '\n' + '\t'*(level + 1)
-                        content += RhapsodyFileParser._toChildString(child, level + 1)
-                elif ('size' == child.tag):
-                    content += '\t'*(level + 1) + '- size = %s;\n' % (child.text)
-                    if (0 != int(child.text)):
-                        content += '\t'*(level + 1) + '- value = '
-                        isValueNode = True
-                elif ('elementList' == child.tag):
-                    content += '\t'*(level + 1) + '- elementList = %d;\n' % (len(child))
-                    for granChild in child:
-                        content += '\t'*(level + 1)
-                        content += RhapsodyFileParser._toChildString(granChild, (level + 1))
-                        content += '\n'
-                    content += '\t'*(level + 1) + '\n'
-                else:
-                    content += '\t'*(level + 1) + '- %s = ' % (child.tag)
-                    content += RhapsodyFileParser._toChildString(child, level + 1)
-                    content += '\n'
-
-            if (True == isValueNode):
-                content += '\n'
-                    
-            content += '\t'*level + '}'
+        skipMatch = RhapsodyFileParser.SKIP_RE.match
+        contentOffset = blockStart + 1
+        depth = 1
+        
+        while depth:
+            match = skipMatch(content, contentOffset)
+            while stream is not None and not stream.eof and (match is None or match.end() == len(content)):
+                content, _ = stream.extend(content, blockStart)
+                contentOffset -= blockStart
+                blockStart = 0
+                match = skipMatch(content, contentOffset)
+            if match is None:
+                raise ValueError('Expected } at line %d' % (RhapsodyFileParser._getStreamLineNum(stream, content, contentOffset)))
+            contentOffset = match.end()
             
-        return content
+            if '{' == match.group(1):
+                depth += 1
+            else:
+                depth -= 1
+        
+        return content, blockStart, match.end(1), contentOffset
     
     @staticmethod
     def _parseBlock(node, content, contentLength, contentOffset):
@@ -304,23 +2260,105 @@ class RhapsodyFileParser:
         
         return contentOffset
         
+    @staticmethod
+    def _findLinks(root):
+        """ Returns the (block type, file name) of each linked subsystem, class and component in the given xml tree"""
+        return [(node.getparent().get('type'), node.text) for node in root.xpath("//*[@type='ISubsystem' or @type='IClass' or @type='IComponent']/fileName")]
+    
+    @staticmethod
+    def _toSerialized(root):
+        """ Serializes a tree into xml for transfer between processes or storage in the parse cache"""
+        return etree.tostring(root, encoding='UTF-8')
+    
+    @staticmethod
+    def _fromSerialized(data):
+        """ Rebuilds a tree serialized by _toSerialized.
+        Serialized xml does not distinguish empty values from missing text, so empty values are restored here."""
+        
+        root = etree.fromstring(data, etree.XMLParser(huge_tree=True))
+        for node in root.xpath("//*[not(node()) and not(@type) and not(self::elementList)]"):
+            node.text = ''
+        
+        return root
+    
+    @staticmethod
+    def _recover(content, contentOffset, errors, lineIndex, message):
+        """ Appends a RhapsodyParseError for the problem at the given offset and returns the offset of the next
+        attribute or end of block to continue parsing from, or the end of the content when there is none."""
+        
+        line, column = lineIndex.getPosition(contentOffset)
+        errors.append(RhapsodyParseError(line, column, message))
+        
+        match = RhapsodyFileParser.RECOVER_RE.search(content, contentOffset)
+        if match is None:
+            return len(content)
+        
+        return match.end()
+    
     @staticmethod
     def _getLineNum(content, contentOffset):
         return content.count('\n', 0, contentOffset);
-
+    
     @staticmethod
-    def _valid_xml_char_ordinal(c):
-        codepoint = ord(c)
-        # conditions ordered by presumed frequency
-        return (
-            0x20 <= codepoint <= 0xD7FF or
-            codepoint in (0x9, 0xA, 0xD) or
-            0xE000 <= codepoint <= 0xFFFD or
-            0x10000 <= codepoint <= 0x10FFFF
-            )
+    def _getStreamLineNum(stream, content, contentOffset):
+        lineNum = RhapsodyFileParser._getLineNum(content, contentOffset)
+        if stream is not None:
+            lineNum += stream.lineNum
+        return lineNum
+    
+    @staticmethod
+    def _splitValues(packed):
+        """ Splits the raw text of a packed value list into its values, with a single split when no value is quoted"""
+        
+        if '"' not in packed:
+            return packed.split(';')[:-1]
+        
+        return RhapsodyFileParser.PACKED_VALUE_RE.findall(packed)
+    
+    @staticmethod
+    def _getValueRecords(packed):
+        """ Returns the hashed records of the values in a packed value list, the same as for value elements"""
+        return ''.join(['Svalue\0%s\0' % (text) for text in RhapsodyFileParser._splitValues(packed)]).encode('utf-8')
+    
+    @staticmethod
+    def _sanitize(content):
+        """ Removes characters which are not allowed in xml, returning the content itself when there are none"""
+        
+        if RhapsodyFileParser.INVALID_CHAR_RE.search(content) is None:
+            return content
+        
+        return RhapsodyFileParser.INVALID_CHAR_RE.sub('', content)
+    
+    @staticmethod
+    def _decode(data, encoding=None):
+        """ Decodes the bytes of a file straight from the buffer, translating line endings as reading a text file does"""
+        
+        if encoding is None or 'detect' == encoding:
+            encoding = None
+            header = bytes(data[:4])
+            for bom, bomEncoding in RhapsodyFileParser.BOMS:
+                if header.startswith(bom):
+                    encoding = bomEncoding
+                    break
+        
+        if encoding is not None:
+            content = str(data, encoding)
+        else:
+            try:
+                content = str(data, 'utf-8')
+            except UnicodeDecodeError:
+                content = str(data, 'latin-1')
+        
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+        
+        return content
     
     @staticmethod
-    def get_modified_time(date_time=time.localtime()):
+    def get_modified_time(date_time=None):
+        if date_time is None:
+            date_time = time.localtime()
+        
         return '%d.%d%d::%d.%d.%d' % (date_time.tm_mon, \
                                       date_time.tm_mday, \
                                       date_time.tm_year, \
@@ -330,27 +2368,35 @@ class RhapsodyFileParser:
     
     @staticmethod
     def add_requirement_dependency(node, guid, req_guid, req_name, req_subsystem):
-        dependencies = node.find('Dependencies')
-        if dependencies is None:
-            dependencies = etree.SubElement(node, 'Dependencies')
-            dependencies.set('type', 'IRPYContainer')
-        
-        size = dependencies.find('size')
-        if size is None:
-            size = etree.SubElement(dependencies, 'size')
-            size.text = '0'
+        RhapsodyFileParser.add_requirement_dependencies([(node, guid, req_guid, req_name, req_subsystem)])
+    
+    @staticmethod
+    def add_requirement_dependencies(links):
+        """ Adds a requirement dependency for each (node, guid, req_guid, req_name, req_subsystem) tuple.
+        The existing dependencies of each node are indexed once and all added dependencies share one modified time.
+        Returns the lists of added and skipped tuples, a tuple is skipped when its guid is already a dependency of the node."""
         
-        dependencyExists = False
-        for value in dependencies.findall('value'):
-            value_guid = value.find('_id')
-            if value_guid is not None:
-                if (guid == value_guid.text):
-                    dependencyExists = True
-                    break
+        modifiedTime = RhapsodyFileParser.get_modified_time()
+        containers = {}
+        added = []
+        skipped = []
         
-        if not dependencyExists:
-            # increment size
-            size.text = str(int(size.text) + 1)
+        for link in links:
+            node, guid, req_guid, req_name, req_subsystem = link
+            
+            container = containers.get(node)
+            if container is None:
+                container = containers[node] = RhapsodyFileParser._getDependencies(node)
+            dependencies, guids, _ = container
+            
+            if guid in guids:
+                skipped.append(link)
+                continue
+            
+            guids.add(guid)
+            container[2] += 1
+            added.append(link)
+            
             # add new value node
             value = etree.SubElement(dependencies, 'value')
             value.set('type', 'IDependency')
@@ -358,7 +2404,7 @@ class RhapsodyFileParser:
             etree.SubElement(value, '_id').text = guid
             etree.SubElement(value, '_myState').text = '2048'
             etree.SubElement(value, '_name').text = req_name
-            etree.SubElement(value, '_modifiedTimeWeak').text = RhapsodyFileParser.get_modified_time()
+            etree.SubElement(value, '_modifiedTimeWeak').text = modifiedTime
             dependsOn = etree.SubElement(value, '_dependsOn')
             dependsOn.set('type', 'INObjectHandle')
             etree.SubElement(dependsOn, '_m2Class').text = '"IRequirement"'
@@ -367,3 +2413,637 @@ class RhapsodyFileParser:
             etree.SubElement(dependsOn, '_class').text = '""'
             etree.SubElement(dependsOn, '_name').text = req_name
             etree.SubElement(dependsOn, '_id').text = req_guid
+        
+        # increment the size of each container once
+        for dependencies, _, count in containers.values():
+            if count:
+                size = dependencies.find('size')
+                size.text = str(int(size.text) + count)
+        
+        return added, skipped
+    
+    @staticmethod
+    def _getDependencies(node):
+        """ Returns [Dependencies container, guids of its dependencies, number of dependencies added] for a node, adding the container when it is missing"""
+        
+        dependencies = node.find('Dependencies')
+        if dependencies is None:
+            dependencies = etree.SubElement(node, 'Dependencies')
+            dependencies.set('type', 'IRPYContainer')
+        
+        size = dependencies.find('size')
+        if size is None:
+            size = etree.SubElement(dependencies, 'size')
+            size.text = '0'
+        
+        guids = set()
+        for value_guid in dependencies.iterfind('value/_id'):
+            guids.add(value_guid.text)
+        
+        return [dependencies, guids, 0]
+
+
+class RhapsodyCompactElement(object):
+    """RhapsodyCompactElement
+    Lightweight read-only element built by RhapsodyFileParser.fromString(content, tree='compact').
+    Tags and block types are interned, and attributes holding a single value are kept as packed tag and text
+    pairs in their parent's item list rather than as elements of their own. Navigation follows the lxml api
+    for find, findall, findtext and iter, and toLxml converts the tree into the one fromString builds by default.
+    """
+    
+    __slots__ = ('tag', 'type', 'text', '_items', '_attrib')
+    
+    def __init__(self, tag, type=None, text=None):
+        self.tag = tag
+        self.type = type
+        self.text = text
+        # child blocks are stored as elements, single values as a tag followed by its text
+        self._items = []
+        self._attrib = None
+    
+    def __repr__(self):
+        return '<RhapsodyCompactElement %s>' % (self.tag)
+    
+    def __len__(self):
+        return sum(1 for _ in self)
+    
+    def __iter__(self):
+        items = self._items
+        index = 0
+        
+        while index < len(items):
+            item = items[index]
+            if isinstance(item, RhapsodyCompactElement):
+                yield item
+                index += 1
+            else:
+                yield RhapsodyCompactElement._scalar(item, items[index + 1])
+                index += 2
+    
+    def get(self, key, default=None):
+        if 'type' == key and self.type is not None:
+            return self.type
+        elif self._attrib is not None:
+            return self._attrib.get(key, default)
+        
+        return default
+    
+    def set(self, key, value):
+        if 'type' == key:
+            self.type = intern(value)
+        else:
+            if self._attrib is None:
+                self._attrib = OrderedDict()
+            self._attrib[key] = value
+    
+    def items(self):
+        """ Returns the (name, value) attribute pairs in the same order as the lxml tree"""
+        
+        items = list(self._attrib.items()) if self._attrib is not None else []
+        if self.type is not None:
+            items.append(('type', self.type))
+        
+        return items
+    
+    def keys(self):
+        return [key for key, _ in self.items()]
+    
+    def iterchildren(self, tag=None):
+        """ Iterates over the children with the given tag, or all children when no tag is given"""
+        
+        if tag is None:
+            for child in self:
+                yield child
+            return
+        
+        items = self._items
+        index = 0
+        
+        while index < len(items):
+            item = items[index]
+            if isinstance(item, RhapsodyCompactElement):
+                if tag == item.tag:
+                    yield item
+                index += 1
+            else:
+                if tag == item:
+                    yield RhapsodyCompactElement._scalar(item, items[index + 1])
+                index += 2
+    
+    def find(self, tag):
+        """ Returns the first child with the given tag, or None"""
+        
+        for child in self.iterchildren(tag):
+            return child
+        
+        return None
+    
+    def findall(self, tag):
+        """ Returns all children with the given tag"""
+        return list(self.iterchildren(tag))
+    
+    def _setText(self, tag, text):
+        """ Replaces the text of the first single value with the given tag"""
+        
+        items = self._items
+        index = 0
+        
+        while index < len(items):
+            item = items[index]
+            if isinstance(item, RhapsodyCompactElement):
+                index += 1
+            elif tag == item:
+                items[index + 1] = text
+                return
+            else:
+                index += 2
+    
+    def findtext(self, tag, default=None):
+        """ Returns the text of the first child with the given tag, or the default when there is no such child"""
+        
+        child = self.find(tag)
+        if child is None:
+            return default
+        
+        return child.text if child.text is not None else ''
+    
+    def iter(self, tag=None):
+        """ Iterates depth first over this element and all of its descendants with the given tag, or all of them when no tag is given"""
+        
+        stack = [iter((self, ))]
+        
+        while stack:
+            for node in stack[-1]:
+                if tag is None or tag == node.tag:
+                    yield node
+                if node._items:
+                    stack.append(iter(node))
+                break
+            else:
+                stack.pop()
+    
+    def toLxml(self):
+        """ Converts the tree into an lxml tree, identical to the one fromString builds by default"""
+        
+        root = etree.Element(self.tag, OrderedDict(self.items()))
+        stack = [(self, root)]
+        
+        while stack:
+            node, element = stack.pop()
+            items = node._items
+            index = 0
+            
+            while index < len(items):
+                item = items[index]
+                if isinstance(item, RhapsodyCompactElement):
+                    child = etree.SubElement(element, item.tag, OrderedDict(item.items()))
+                    stack.append((item, child))
+                    index += 1
+                else:
+                    etree.SubElement(element, item).text = items[index + 1]
+                    index += 2
+        
+        return root
+    
+    @staticmethod
+    def _scalar(tag, text):
+        """ Returns a temporary element for a packed single value"""
+        
+        element = RhapsodyCompactElement(tag, None, text)
+        element._items = ()
+        return element
+    
+    @staticmethod
+    def _getBuilder():
+        """ Returns the functions the scanner uses to add blocks and single values to a compact tree.
+        Values repeat a lot within a file, so equal texts share one string for the whole tree."""
+        
+        texts = {}
+        
+        def subElement(parent, tag, type=None):
+            element = RhapsodyCompactElement(intern(tag), None if type is None else intern(type))
+            parent._items.append(element)
+            return element
+        
+        def addScalar(parent, tag, text):
+            items = parent._items
+            items.append(intern(tag))
+            items.append(texts.setdefault(text, text))
+        
+        return subElement, addScalar
+
+class RhapsodyParseCache:
+    """RhapsodyParseCache
+    On-disk cache of translated rhapsody files, keyed on the path, size and modification time of each file.
+    Entries are written atomically so the cache can be shared by several processes, and the least recently
+    used entries are removed once the cache grows beyond max_size bytes. The size of the cache is kept as a running total
+    and the directory is only listed again when the total goes over max_size, so entries written by other processes
+    are counted from then on.
+    """
+    
+    EXTENSION = '.xml'
+    FORMAT_VERSION = 2 # bumped by every change to the trees the parser builds, so entries written before it are never loaded
+    EVICT_RATIO = 0.9 # fraction of max_size the cache is reduced to, so a full cache is not listed again on every store
+    
+    def __init__(self, directory, max_size=1073741824, content_hash=False):
+        if not isinstance(directory, string_types):
+            raise ValueError('Expected directory of type string')
+        elif max_size is not None and 0 > max_size:
+            raise ValueError('Expected max_size to be a positive integer')
+        
+        self.directory = directory
+        self.max_size = max_size
+        self.content_hash = content_hash
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        
+        if True != os.path.isdir(directory):
+            os.makedirs(directory)
+    
+    def parse(self, filename, links=None, stats=None, element_index=None, hashes=None, **kwargs):
+        """ Translates a rhapsody file into xml, loading it from the cache when the file is unchanged.
+        When links is a list the (block type, file name) of each linked subsystem, class and component is appended to it.
+        When stats is a RhapsodyParseStats the timings and node counts of the file and whether it was cached are recorded in it.
+        When element_index is a RhapsodyElementIndex the blocks of the file are added to it.
+        When hashes is a dictionary the hashes of the blocks of the file are added to it.
+        Other keyword arguments are passed on to RhapsodyFileParser.parse and are part of the cache key, except for errors
+        since files parsed with errors are never stored."""
+        
+        if 'compact' == kwargs.get('tree'):
+            raise ValueError('Compact trees can not be cached')
+        
+        errors = kwargs.pop('errors', None)
+        errorCount = len(errors) if errors is not None else 0
+        
+        if stats is not None:
+            stats = RhapsodyParseStats._getUnit(stats, filename)
+            start = time.perf_counter()
+        
+        entry = self._getEntry(filename, kwargs)
+        
+        root = self._load(entry)
+        if root is not None:
+            self.hits += 1
+            if stats is not None:
+                stats.cacheHit = True
+                stats.read += time.perf_counter() - start
+                stats.countNodes(root)
+                start = time.perf_counter()
+            if links is not None:
+                links.extend(RhapsodyFileParser._findLinks(root))
+            if stats is not None:
+                stats.scan += time.perf_counter() - start
+            if element_index is not None:
+                element_index.addTree(root)
+            if hashes is not None:
+                RhapsodyFileParser.hashTree(root, hashes)
+            return root
+        
+        self.misses += 1
+        if stats is not None:
+            stats.cacheHit = False
+        root = RhapsodyFileParser.parse(filename, links=links, stats=stats, element_index=element_index, hashes=hashes, errors=errors, **kwargs)
+        if errors is None or errorCount == len(errors):
+            self._store(entry, root)
+        
+        return root
+    
+    def clear(self):
+        """ Removes all entries from the cache"""
+        for entry, _, _ in self._getEntries():
+            self._remove(entry)
+        self._size = None
+    
+    def _getEntry(self, filename, options=None):
+        """ Returns the cache file for the current version of the given file.
+        The key includes the parser and cache format versions and the options so entries written by other versions or with other options are never loaded."""
+        
+        stat = os.stat(filename)
+        
+        key = hashlib.sha1()
+        key.update(('%s\n%d\n%s\n%d\n%d\n' % (__version__, RhapsodyParseCache.FORMAT_VERSION, os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)).encode('utf-8'))
+        
+        if options:
+            for name in sorted(options):
+                value = options[name]
+                if isinstance(value, (set, frozenset, list, tuple)):
+                    value = sorted(value)
+                key.update(('%s=%r\n' % (name, value)).encode('utf-8'))
+        
+        if self.content_hash:
+            with open(filename, 'rb') as f:
+                key.update(hashlib.sha1(f.read()).digest())
+        
+        return os.path.join(self.directory, key.hexdigest() + RhapsodyParseCache.EXTENSION)
+    
+    def _load(self, entry):
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+            # mark the entry as recently used
+            os.utime(entry, None)
+        except (IOError, OSError):
+            return None
+        
+        try:
+            return RhapsodyFileParser._fromSerialized(data)
+        except etree.XMLSyntaxError:
+            # entry was damaged, parse the file again
+            self._remove(entry)
+            return None
+    
+    def _store(self, entry, root):
+        data = RhapsodyFileParser._toSerialized(root)
+        
+        if self.max_size is not None and len(data) > self.max_size:
+            return
+        
+        # write to a temporary file first so readers never see a partial entry
+        fd, temp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp, entry)
+        except:
+            self._remove(temp)
+            raise
+        
+        if self.max_size is not None:
+            if self._size is None:
+                self._size = sum(entrySize for _, entrySize, _ in self._getEntries())
+            else:
+                self._size += len(data)
+            
+            if self._size > self.max_size:
+                self._evict()
+    
+    def _evict(self):
+        """ Removes the least recently used entries once the cache has grown beyond max_size bytes,
+        until it fits in EVICT_RATIO of max_size"""
+        
+        entries = self._getEntries()
+        size = sum(entrySize for _, entrySize, _ in entries)
+        if size <= self.max_size:
+            self._size = size
+            return
+        
+        for entry, entrySize, _ in sorted(entries, key=lambda item: item[2]):
+            if size <= self.max_size * RhapsodyParseCache.EVICT_RATIO:
+                break
+            self._remove(entry)
+            size -= entrySize
+        
+        self._size = size
+    
+    def _getEntries(self):
+        """ Returns (filename, size, last used time) for each entry in the cache"""
+        
+        entries = []
+        
+        for name in os.listdir(self.directory):
+            if not name.endswith(RhapsodyParseCache.EXTENSION):
+                continue
+            
+            entry = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(entry)
+            except OSError:
+                # removed by another process
+                continue
+            entries.append((entry, stat.st_size, stat.st_mtime))
+        
+        return entries
+    
+    @staticmethod
+    def _remove(entry):
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+class RhapsodyParseStats(object):
+    """RhapsodyParseStats
+    Observer which is passed as stats to the parse methods to record a RhapsodyUnitStats for each translated file.
+    summary gives the totals for a project, toJson exports the summary and every file for other tools.
+    """
+    
+    def __init__(self):
+        self.units = OrderedDict()
+        self.elapsed = 0.0
+    
+    def addUnit(self, filename):
+        """ Starts recording a file, replacing any earlier record of it"""
+        
+        unit = RhapsodyUnitStats(filename)
+        self.units[filename] = unit
+        return unit
+    
+    def summary(self, slowest=10):
+        """ Returns the totals over all files along with the slowest files"""
+        
+        units = list(self.units.values())
+        types = {}
+        for unit in units:
+            for blockType, count in unit.types.items():
+                types[blockType] = types.get(blockType, 0) + count
+        
+        summary = OrderedDict()
+        summary['units'] = len(units)
+        summary['elapsed'] = self.elapsed
+        for field in ('bytes', 'read', 'sanitize', 'tokenize', 'scan', 'elements'):
+            summary[field] = sum(getattr(unit, field) for unit in units)
+        summary['depth'] = max([unit.depth for unit in units] or [0])
+        summary['cacheHits'] = sum(1 for unit in units if unit.cacheHit is True)
+        summary['cacheMisses'] = sum(1 for unit in units if unit.cacheHit is False)
+        summary['types'] = types
+        summary['slowest'] = [unit.filename for unit in sorted(units, key=lambda unit: unit.total, reverse=True)[:slowest]]
+        
+        return summary
+    
+    def toJson(self, indent=None):
+        """ Returns the summary and the record of every file as a json string"""
+        return json.dumps(OrderedDict((('summary', self.summary()), ('units', [unit.toDict() for unit in self.units.values()]))), indent=indent)
+    
+    @staticmethod
+    def _getUnit(stats, filename):
+        """ Returns the RhapsodyUnitStats to record a file in, adding one when given a RhapsodyParseStats"""
+        
+        if isinstance(stats, RhapsodyUnitStats):
+            return stats
+        elif isinstance(stats, RhapsodyParseStats):
+            return stats.addUnit(filename if filename is not None else '<string %d>' % (len(stats.units)))
+        
+        raise ValueError('Invalid stats (Expected RhapsodyParseStats or RhapsodyUnitStats)')
+
+class RhapsodyUnitStats(object):
+    """RhapsodyUnitStats
+    Timings in seconds, size and node counts recorded while translating a single file.
+    cacheHit is None when no cache was used.
+    """
+    
+    FIELDS = ('filename', 'bytes', 'read', 'sanitize', 'tokenize', 'scan', 'elements', 'depth', 'cacheHit', 'types')
+    
+    def __init__(self, filename):
+        self.filename = filename
+        self.bytes = 0
+        self.read = 0.0
+        self.sanitize = 0.0
+        self.tokenize = 0.0
+        self.scan = 0.0
+        self.elements = 0
+        self.depth = 0
+        self.cacheHit = None
+        self.types = {}
+    
+    @property
+    def total(self):
+        return self.read + self.sanitize + self.tokenize + self.scan
+    
+    def countNodes(self, root):
+        """ Counts the elements of a tree, and the blocks of each type, and finds its maximum depth"""
+        
+        types = {}
+        elements = 0
+        depth = 0
+        stack = [(root, 0)]
+        
+        while stack:
+            node, level = stack.pop()
+            elements += 1
+            if level > depth:
+                depth = level
+            
+            blockType = node.get('type')
+            if blockType is not None:
+                types[blockType] = types.get(blockType, 0) + 1
+            
+            for child in node:
+                stack.append((child, level + 1))
+        
+        self.types = types
+        self.elements = elements
+        self.depth = depth
+    
+    def toDict(self):
+        return OrderedDict((field, getattr(self, field)) for field in RhapsodyUnitStats.FIELDS)
+
+class _RhapsodyLineIndex:
+    """_RhapsodyLineIndex
+    Offsets of the line starts of a content, built on the first lookup so each position is a binary search.
+    """
+    
+    def __init__(self, content):
+        self.content = content
+        self.lineStarts = None
+    
+    def getPosition(self, contentOffset):
+        """ Returns the line and column of an offset, both counted from 1"""
+        
+        if self.lineStarts is None:
+            self.lineStarts = [0]
+            self.lineStarts.extend(match.end() for match in re.finditer('\n', self.content))
+        
+        line = bisect.bisect_right(self.lineStarts, contentOffset)
+        return line, contentOffset - self.lineStarts[line - 1] + 1
+
+class _RhapsodyStream:
+    """_RhapsodyStream
+    Window over a rhapsody file object which is read in chunks by the streaming parser.
+    Chunks read from binary files are decoded incrementally with the encoding RhapsodyFileParser._decode would detect.
+    """
+    
+    def __init__(self, source, chunkSize):
+        self.source = source
+        self.chunkSize = chunkSize
+        self.lineNum = 0
+        self.eof = False
+        self.encoding = None
+        self.decoder = None
+        self.carriageReturn = False
+    
+    def extend(self, content, contentOffset):
+        """ Drops the consumed content from the window and appends the next chunk"""
+        
+        chunk = self.source.read(self.chunkSize)
+        if not chunk:
+            self.eof = True
+        if isinstance(chunk, (bytes, bytearray)):
+            chunk = self._decode(chunk)
+        
+        self.lineNum += content.count('\n', 0, contentOffset)
+        
+        return content[contentOffset:] + RhapsodyFileParser._sanitize(chunk), 0
+    
+    def _decode(self, chunk):
+        """ Decodes a chunk of a binary file, translating line endings as reading a text file does"""
+        
+        if self.decoder is None:
+            # the byte order mark takes up to 4 bytes
+            while 4 > len(chunk) and not self.eof:
+                data = self.source.read(self.chunkSize)
+                if not data:
+                    self.eof = True
+                chunk = bytes(chunk) + data
+            
+            self.encoding = 'utf-8'
+            for bom, bomEncoding in RhapsodyFileParser.BOMS:
+                if chunk.startswith(bom):
+                    self.encoding = bomEncoding
+                    break
+            self.decoder = codecs.getincrementaldecoder(self.encoding)()
+        
+        try:
+            content = self.decoder.decode(chunk, self.eof)
+        except UnicodeDecodeError:
+            if 'utf-8' != self.encoding:
+                raise
+            # not utf-8, so read the rest as latin-1 from the bytes the decoder holds back
+            pending = self.decoder.getstate()[0]
+            self.encoding = 'latin-1'
+            self.decoder = codecs.getincrementaldecoder(self.encoding)()
+            content = self.decoder.decode(pending + bytes(chunk), self.eof)
+        
+        if self.carriageReturn:
+            content = '\r' + content
+        # a \r\n may be split between two chunks
+        self.carriageReturn = content.endswith('\r') and not self.eof
+        if self.carriageReturn:
+            content = content[:-1]
+        
+        if '\r' in content:
+            content = content.replace('\r\n', '\n').replace('\r', '\n')
+        
+        return content
+
+def main(argv=None):
+    """ Entry point of the rhapsody-convert command"""
+    
+    parser = argparse.ArgumentParser(prog='rhapsody-convert', description='Converts rhapsody projects into xml files, one per project file.')
+    parser.add_argument('inputs', nargs='+', help='rpy project files, or directories searched for them')
+    parser.add_argument('-o', '--output', required=True, help='directory the xml files and the manifest are written to')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes (default: %(default)s)')
+    parser.add_argument('-f', '--force', action='store_true', help='convert every file, even when its output is up to date')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only report the totals')
+    args = parser.parse_args(argv)
+    
+    def progress(filename, result):
+        if result[5] is not None:
+            print('failed    %s: %s' % (filename, result[5]))
+        elif not args.quiet:
+            print('converted %s (%d files, %d up to date)' % (filename, result[2], result[3]))
+    
+    try:
+        report = RhapsodyProjectConverter.convert(args.inputs, args.output, args.workers, args.force, progress)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    megabytes = report['bytes'] / 1048576.0
+    seconds = max(report['seconds'], 1e-9)
+    print('%d projects, %d files converted, %d up to date, %d failed' % (report['projects'], report['converted'], report['skipped'], len(report['failed'])))
+    print('%.2f MB in %.2f s (%.2f MB/s, %.1f files/s)' % (megabytes, report['seconds'], megabytes / seconds, report['converted'] / seconds))
+    
+    return 1 if report['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name = 'RhapsodyParser',
@@ -15,5 +15,7 @@ setup(
         'Programming Language :: Python :: 3',
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers'],
-    license = 'MIT License'
+    license = 'MIT License',
+    entry_points = {
+        'console_scripts': ['rhapsody-convert = RhapsodyParser.RhapsodyParser:main']}
 )
\ No newline at end of file
@@ -0,0 +1,45 @@
+import glob
+import sys
+import time
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyFileParser
+
+def benchmark(content, engine, repeat):
+    """ Returns the best wall-clock time of translating the content with the given engine"""
+    best = None
+    
+    for _ in range(0, repeat):
+        start = time.time()
+        RhapsodyFileParser.fromString(content, engine=engine)
+        elapsed = time.time() - start
+        
+        if best is None or elapsed < best:
+            best = elapsed
+    
+    return best
+
+if __name__ == "__main__":
+    test_files = sys.argv[1:] or (["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*")))
+    repeat = 3
+    
+    print('%-48s %10s %14s %14s %8s' % ('file', 'MB', 'regex MB/s', 'scanner MB/s', 'speedup'))
+    
+    totals = dict((engine, 0.0) for engine in RhapsodyFileParser.ENGINES)
+    totalSize = 0.0
+    
+    for test_file in test_files:
+        with open(test_file, 'r') as f:
+            content = f.read()
+        
+        size = len(content) / 1048576.0
+        totalSize += size
+        
+        elapsed = {}
+        for engine in RhapsodyFileParser.ENGINES:
+            elapsed[engine] = benchmark(content, engine, repeat)
+            totals[engine] += elapsed[engine]
+        
+        print('%-48s %10.3f %14.2f %14.2f %7.2fx' % (test_file, size, size / elapsed['regex'], size / elapsed['scanner'], elapsed['regex'] / elapsed['scanner']))
+    
+    print('%-48s %10.3f %14.2f %14.2f %7.2fx' % ('total', totalSize, totalSize / totals['regex'], totalSize / totals['scanner'], totals['regex'] / totals['scanner']))
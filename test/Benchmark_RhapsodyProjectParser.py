@@ -0,0 +1,39 @@
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyProjectParser
+
+def benchmark(test_file, workers, repeat):
+    """ Returns the best wall-clock time of parsing the project with the given number of workers"""
+    best = None
+    
+    for _ in range(0, repeat):
+        start = time.time()
+        projectFiles = RhapsodyProjectParser.parse(test_file, workers=workers)
+        elapsed = time.time() - start
+        
+        if best is None or elapsed < best:
+            best = elapsed
+    
+    return best, len(projectFiles)
+
+if __name__ == "__main__":
+    test_file = sys.argv[1] if 1 < len(sys.argv) else "./assets/Project.rpy"
+    repeat = int(sys.argv[2]) if 2 < len(sys.argv) else 3
+    
+    worker_counts = [1]
+    while worker_counts[-1] * 2 <= max(multiprocessing.cpu_count(), 2):
+        worker_counts.append(worker_counts[-1] * 2)
+    
+    print('project: %s' % (os.path.abspath(test_file)))
+    print('%8s %8s %10s %8s' % ('workers', 'units', 'seconds', 'speedup'))
+    
+    baseline = None
+    for workers in worker_counts:
+        elapsed, units = benchmark(test_file, workers, repeat)
+        if baseline is None:
+            baseline = elapsed
+        print('%8d %8d %10.3f %7.2fx' % (workers, units, elapsed, baseline / elapsed))
@@ -0,0 +1,124 @@
+import argparse
+import glob
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyFileParser, RhapsodyProjectParser
+from Generate_RhapsodyProject import RhapsodyProjectGenerator
+
+SIZES = (('small', 10), ('medium', 50), ('large', 200)) # (name, classes per package)
+OPERATIONS = ('fromString', 'packValues', 'toString', 'getGuidDict', 'project')
+
+def getUnitFiles(project):
+    basepath, _ = os.path.splitext(project)
+    return [project] + sorted(glob.glob(os.path.join(basepath + '_rpy', '*')))
+
+def measure(operation, project, repeat):
+    """ Returns the best wall-clock time of the operation on the generated project, run in this process"""
+    contents = []
+    for unit in getUnitFiles(project):
+        with open(unit, 'r') as f:
+            contents.append(f.read())
+
+    roots = None
+    if operation in ('toString', 'getGuidDict'):
+        roots = [RhapsodyFileParser.fromString(content) for content in contents]
+
+    best = None
+    for _ in range(0, repeat):
+        start = time.time()
+        if 'fromString' == operation:
+            for content in contents:
+                RhapsodyFileParser.fromString(content)
+        elif 'packValues' == operation:
+            for content in contents:
+                RhapsodyFileParser.fromString(content, pack_values=True)
+        elif 'toString' == operation:
+            for root in roots:
+                RhapsodyFileParser.toString(root)
+        elif 'getGuidDict' == operation:
+            for root in roots:
+                RhapsodyFileParser.getGuidDict(root)
+        else:
+            RhapsodyProjectParser.parse(project)
+        elapsed = time.time() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, sum(len(content) for content in contents)
+
+def run(operation, project, repeat):
+    """ Measures the operation in a fresh interpreter so the peak memory of each operation is reported separately"""
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--measure', operation, project, '--repeat', str(repeat)],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(output.decode('utf-8'))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmarks parsing and writing generated rhapsody projects of increasing size.')
+    parser.add_argument('--sizes', nargs='+', default=[name for name, _ in SIZES], help='sizes to run (%s)' % (', '.join(name for name, _ in SIZES)))
+    parser.add_argument('--operations', nargs='+', default=list(OPERATIONS), help='operations to run (%s)' % (', '.join(OPERATIONS)))
+    parser.add_argument('--repeat', type=int, default=3, help='runs per operation, the best time is reported')
+    parser.add_argument('--save', help='write the results to a json file to be used as a baseline')
+    parser.add_argument('--baseline', help='compare the results with a json file written by --save')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown against the baseline reported as a regression')
+    parser.add_argument('--measure', nargs=2, metavar=('OPERATION', 'PROJECT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure is not None:
+        elapsed, size = measure(args.measure[0], args.measure[1], args.repeat)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if 'darwin' == sys.platform:
+            peak //= 1024
+        print(json.dumps({'seconds': elapsed, 'bytes': size, 'peak_kb': peak}))
+        sys.exit(0)
+
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    directory = tempfile.mkdtemp()
+
+    print('%-8s %-12s %10s %10s %10s %10s %10s' % ('size', 'operation', 'MB', 'seconds', 'MB/s', 'peak MB', 'baseline'))
+
+    try:
+        for name, classes in SIZES:
+            if name not in args.sizes:
+                continue
+
+            project = RhapsodyProjectGenerator().generate(os.path.join(directory, name), classes=classes, depth=2)
+
+            for operation in args.operations:
+                key = '%s/%s' % (name, operation)
+                result = results[key] = run(operation, project, args.repeat)
+                size = result['bytes'] / 1048576.0
+
+                comparison = ''
+                if key in baseline:
+                    ratio = result['seconds'] / baseline[key]['seconds']
+                    comparison = '%.2fx' % (ratio)
+                    if ratio > 1.0 + args.threshold:
+                        regressions.append(key)
+                        comparison += ' !'
+
+                print('%-8s %-12s %10.3f %10.3f %10.2f %10.1f %10s' % (name, operation, size, result['seconds'], size / result['seconds'], result['peak_kb'] / 1024.0, comparison))
+    finally:
+        shutil.rmtree(directory)
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print('regressions against %s: %s' % (args.baseline, ', '.join(regressions)))
+        sys.exit(1)
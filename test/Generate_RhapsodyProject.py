@@ -0,0 +1,271 @@
+import os
+import random
+import sys
+import uuid
+
+class RhapsodyProjectGenerator:
+    """RhapsodyProjectGenerator
+    Writes synthetic rhapsody projects of a configurable size, used to measure how parsing scales.
+    The files follow the layout of the projects in ./assets, including property blocks, raw containers,
+    element lists, handles between files and quoted bodies holding ; and escaped quotes. As in the assets
+    escaped quotes come in pairs with no ; between them, since values are split on ; outside of quotes.
+    """
+
+    HEADER = 'I-Logix-RPY-Archive version 8.5.2 C++ 1159120\n'
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+
+    def generate(self, directory, name='Project', packages=4, classes=10, components=1, depth=1, properties=3, raw_values=16):
+        """ Writes <name>.rpy and the <name>_rpy directory into directory, returning the project filename.
+        Each of the packages is the top of a chain of depth nested packages holding classes classes each."""
+
+        basepath = os.path.join(directory, name + '_rpy')
+        if True != os.path.isdir(basepath):
+            os.makedirs(basepath)
+
+        packageNames = ['Package%d' % (index) for index in range(0, packages)]
+        componentNames = ['Component%d' % (index) for index in range(0, components)]
+
+        for packageName in packageNames:
+            parent = None
+            for level in range(0, depth):
+                unitName = packageName if 0 == level else '%s_%d' % (packageName, level)
+                nested = '%s_%d' % (packageName, level + 1) if level + 1 < depth else None
+                self._writeUnit(os.path.join(basepath, unitName + '.sbs'), self._package(unitName, parent, nested, classes, properties, raw_values))
+                parent = unitName
+
+        for componentName in componentNames:
+            self._writeUnit(os.path.join(basepath, componentName + '.cmp'), self._component(componentName, packageNames, properties))
+
+        filename = os.path.join(directory, name + '.rpy')
+        self._writeUnit(filename, self._project(name, packageNames, componentNames, properties, raw_values))
+
+        return filename
+
+    def guid(self):
+        return 'GUID %s' % (uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def _writeUnit(self, filename, lines):
+        with open(filename, 'w') as f:
+            f.write(RhapsodyProjectGenerator.HEADER)
+            f.write('\n'.join(lines))
+            f.write('\n')
+
+    def _project(self, name, packageNames, componentNames, properties, raw_values):
+        lines = ['{ IProject ']
+        lines.append('\t- _id = %s;' % (self.guid()))
+        lines.append('\t- _myState = 8192;')
+        lines.extend(self._properties(1, properties))
+        lines.append('\t- _name = "%s";' % (name))
+        lines.extend(self._values(1, 'Colors', raw_values))
+        lines.extend(self._links(1, 'Subsystems', 'ISubsystem', packageNames))
+        lines.extend(self._links(1, 'Components', 'IComponent', componentNames))
+        lines.append('}')
+        return lines
+
+    def _package(self, name, parent, nested, classes, properties, raw_values):
+        lines = ['{ ISubsystem ']
+        if parent is not None:
+            lines.extend(self._handle(1, '_ownerHandle', 'IHandle', 'ISubsystem', parent + '.sbs', parent))
+        lines.append('\t- _id = %s;' % (self.guid()))
+        lines.append('\t- _myState = 8192;')
+        lines.extend(self._properties(1, properties))
+        lines.append('\t- _name = "%s";' % (name))
+        lines.extend(self._links(1, 'Declaratives', 'ISubsystem', [nested] if nested is not None else []))
+
+        classGuids = [self.guid() for _ in range(0, classes)]
+        lines.append('\t- Classes = { IRPYRawContainer ')
+        lines.append('\t\t- size = %d;' % (classes))
+        if classes:
+            lines.append('\t\t- value = ')
+            for index, classGuid in enumerate(classGuids):
+                lines.extend(self._class(2, name, 'Class%d' % (index), classGuid, classGuids, properties, raw_values))
+        lines.append('\t}')
+
+        lines.extend(self._diagram(1, name, classGuids))
+        lines.append('}')
+        return lines
+
+    def _class(self, level, packageName, name, classGuid, classGuids, properties, raw_values):
+        indent = '\t'*level
+        lines = [indent + '{ IClass ']
+        lines.append(indent + '\t- _id = %s;' % (classGuid))
+        lines.append(indent + '\t- _myState = 40960;')
+        lines.extend(self._properties(level + 1, properties))
+        lines.append(indent + '\t- _name = "%s";' % (name))
+
+        # depend on another class of the package so handles can be resolved
+        target = classGuids[self.random.randrange(0, len(classGuids))]
+        lines.append(indent + '\t- Dependencies = { IRPYRawContainer ')
+        lines.append(indent + '\t\t- size = 1;')
+        lines.append(indent + '\t\t- value = ')
+        lines.append(indent + '\t\t{ IDependency ')
+        lines.append(indent + '\t\t\t- _id = %s;' % (self.guid()))
+        lines.append(indent + '\t\t\t- _myState = 2048;')
+        lines.append(indent + '\t\t\t- _name = "%s";' % (name))
+        lines.append(indent + '\t\t\t- _dependsOn = { INObjectHandle ')
+        lines.append(indent + '\t\t\t\t- _m2Class = "IClass";')
+        lines.append(indent + '\t\t\t\t- _id = %s;' % (target))
+        lines.append(indent + '\t\t\t}')
+        lines.append(indent + '\t\t}')
+        lines.append(indent + '\t}')
+
+        lines.append(indent + '\t- Operations = { IRPYRawContainer ')
+        lines.append(indent + '\t\t- size = 2;')
+        lines.append(indent + '\t\t- value = ')
+        for operation in ('update', 'report'):
+            lines.append(indent + '\t\t{ IPrimitiveOperation ')
+            lines.append(indent + '\t\t\t- _id = %s;' % (self.guid()))
+            lines.append(indent + '\t\t\t- _myState = 8192;')
+            lines.append(indent + '\t\t\t- _name = "%s";' % (operation))
+            lines.append(indent + '\t\t\t- Args = { IRPYRawContainer ')
+            lines.append(indent + '\t\t\t\t- size = 1;')
+            lines.append(indent + '\t\t\t\t- value = ')
+            lines.append(indent + '\t\t\t\t{ IArgument ')
+            lines.append(indent + '\t\t\t\t\t- _id = %s;' % (self.guid()))
+            lines.append(indent + '\t\t\t\t\t- _name = "value";')
+            lines.extend(self._handle(level + 5, '_typeOf', 'IHandle', 'IType', 'PredefinedTypesC++.sbs', 'int'))
+            lines.append(indent + '\t\t\t\t\t- _argumentDirection = In;')
+            lines.append(indent + '\t\t\t\t}')
+            lines.append(indent + '\t\t\t}')
+            lines.append(indent + '\t\t\t- _itsBody = { IBody ')
+            lines.append(indent + '\t\t\t\t- _bodyData = "int total = 0; // %s::%s\n' % (packageName, name) +
+                         'for (int i = 0; i < value; i++) { total += i; }\n' +
+                         'std::cout << \\"%s \\" << total << std::endl;";' % (operation))
+            lines.append(indent + '\t\t\t}')
+            lines.append(indent + '\t\t}')
+        lines.append(indent + '\t}')
+
+        lines.extend(self._values(level + 1, 'Colors', raw_values))
+        lines.append(indent + '}')
+        return lines
+
+    def _component(self, name, packageNames, properties):
+        lines = ['{ IComponent ']
+        lines.append('\t- _id = %s;' % (self.guid()))
+        lines.append('\t- _myState = 8192;')
+        lines.extend(self._properties(1, properties))
+        lines.append('\t- _name = "%s";' % (name))
+        lines.append('\t- _libraries = "";')
+        lines.append('\t- Scope = { IRPYRawContainer ')
+        lines.append('\t\t- size = %d;' % (len(packageNames)))
+        if packageNames:
+            lines.append('\t\t- value = ')
+            for packageName in packageNames:
+                lines.extend(self._handle(2, None, 'IHandle', 'ISubsystem', packageName + '.sbs', packageName))
+        lines.append('\t}')
+        lines.append('\t- Configs = { IRPYRawContainer ')
+        lines.append('\t\t- size = 1;')
+        lines.append('\t\t- value = ')
+        lines.append('\t\t{ IConfiguration ')
+        lines.append('\t\t\t- _id = %s;' % (self.guid()))
+        lines.append('\t\t\t- _name = "Release";')
+        lines.append('\t\t\t- _compilerSwitches = "/O2 /D \\"NDEBUG\\"; /W3";')
+        lines.append('\t\t}')
+        lines.append('\t}')
+        lines.append('}')
+        return lines
+
+    def _diagram(self, level, name, classGuids):
+        indent = '\t'*level
+        lines = [indent + '- Diagrams = { IRPYRawContainer ']
+        lines.append(indent + '\t- size = 1;')
+        lines.append(indent + '\t- value = ')
+        lines.append(indent + '\t{ IDiagram ')
+        lines.append(indent + '\t\t- _id = %s;' % (self.guid()))
+        lines.append(indent + '\t\t- _name = "%s Overview";' % (name))
+        lines.append(indent + '\t\t- _graphicChart = { CGIClassChart ')
+        lines.append(indent + '\t\t\t- _id = %s;' % (self.guid()))
+        lines.append(indent + '\t\t\t- elementList = %d;' % (len(classGuids)))
+        for index, classGuid in enumerate(classGuids):
+            lines.append(indent + '\t\t\t{ CGIClass ')
+            lines.append(indent + '\t\t\t\t- _id = %s;' % (self.guid()))
+            lines.append(indent + '\t\t\t\t- m_type = 78;')
+            lines.append(indent + '\t\t\t\t- m_pModelObject = { IHandle ')
+            lines.append(indent + '\t\t\t\t\t- _m2Class = "IClass";')
+            lines.append(indent + '\t\t\t\t\t- _id = %s;' % (classGuid))
+            lines.append(indent + '\t\t\t\t}')
+            lines.append(indent + '\t\t\t\t- m_transform = 1 0 0 1 %d %d ;' % (index*160, index*40))
+            lines.append(indent + '\t\t\t}')
+        lines.append(indent + '\t\t\t')
+        lines.append(indent + '\t\t\t- m_drawBehavior = 4096;')
+        lines.append(indent + '\t\t}')
+        lines.append(indent + '\t}')
+        lines.append(indent + '}')
+        return lines
+
+    def _properties(self, level, count):
+        indent = '\t'*level
+        lines = [indent + '- _properties = { IPropertyContainer ']
+        lines.append(indent + '\t- Subjects = { IRPYRawContainer ')
+        lines.append(indent + '\t\t- size = 1;')
+        lines.append(indent + '\t\t- value = ')
+        lines.append(indent + '\t\t{ IPropertySubject ')
+        lines.append(indent + '\t\t\t- _Name = "CPP_CG";')
+        lines.append(indent + '\t\t\t- Metaclasses = { IRPYRawContainer ')
+        lines.append(indent + '\t\t\t\t- size = 1;')
+        lines.append(indent + '\t\t\t\t- value = ')
+        lines.append(indent + '\t\t\t\t{ IPropertyMetaclass ')
+        lines.append(indent + '\t\t\t\t\t- _Name = "Class";')
+        lines.append(indent + '\t\t\t\t\t- Properties = { IRPYRawContainer ')
+        lines.append(indent + '\t\t\t\t\t\t- size = %d;' % (count))
+        if count:
+            lines.append(indent + '\t\t\t\t\t\t- value = ')
+            for index in range(0, count):
+                lines.append(indent + '\t\t\t\t\t\t{ IProperty ')
+                lines.append(indent + '\t\t\t\t\t\t\t- _Name = "Property%d";' % (index))
+                lines.append(indent + '\t\t\t\t\t\t\t- _Value = "#include <vector>; #define NAME \\"value%d\\"";' % (index))
+                lines.append(indent + '\t\t\t\t\t\t\t- _Type = MultiLine;')
+                lines.append(indent + '\t\t\t\t\t\t}')
+        lines.append(indent + '\t\t\t\t\t}')
+        lines.append(indent + '\t\t\t\t}')
+        lines.append(indent + '\t\t\t}')
+        lines.append(indent + '\t\t}')
+        lines.append(indent + '\t}')
+        lines.append(indent + '}')
+        return lines
+
+    def _values(self, level, name, count):
+        indent = '\t'*level
+        lines = [indent + '- %s = { IRPYRawContainer ' % (name)]
+        lines.append(indent + '\t- size = %d;' % (count))
+        if count:
+            lines.append(indent + '\t- value = ' + ' '.join('%d;' % (self.random.randrange(0, 16777216)) for _ in range(0, count)) + ' ')
+        lines.append(indent + '}')
+        return lines
+
+    def _links(self, level, name, blockType, fileNames):
+        indent = '\t'*level
+        lines = [indent + '- %s = { IRPYRawContainer ' % (name)]
+        lines.append(indent + '\t- size = %d;' % (len(fileNames)))
+        if fileNames:
+            lines.append(indent + '\t- value = ')
+            for fileName in fileNames:
+                lines.append(indent + '\t{ %s ' % (blockType))
+                lines.append(indent + '\t\t- fileName = "%s";' % (fileName))
+                lines.append(indent + '\t\t- _id = %s;' % (self.guid()))
+                lines.append(indent + '\t}')
+        lines.append(indent + '}')
+        return lines
+
+    def _handle(self, level, name, handleType, m2Class, filename, elementName):
+        indent = '\t'*level
+        if name is None:
+            lines = [indent + '{ %s ' % (handleType)]
+        else:
+            lines = [indent + '- %s = { %s ' % (name, handleType)]
+        lines.append(indent + '\t- _m2Class = "%s";' % (m2Class))
+        lines.append(indent + '\t- _filename = "%s";' % (filename))
+        lines.append(indent + '\t- _subsystem = "";')
+        lines.append(indent + '\t- _class = "";')
+        lines.append(indent + '\t- _name = "%s";' % (elementName))
+        lines.append(indent + '\t- _id = %s;' % (self.guid()))
+        lines.append(indent + '}')
+        return lines
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if 1 < len(sys.argv) else "./generated"
+    classes = int(sys.argv[2]) if 2 < len(sys.argv) else 10
+
+    print(RhapsodyProjectGenerator().generate(directory, classes=classes))
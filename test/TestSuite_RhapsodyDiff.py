@@ -0,0 +1,96 @@
+import copy
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+import sys
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyFileParser, RhapsodyProjectParser
+
+class TestSuite_RhapsodyDiff(unittest.TestCase):
+
+    def test01_hashes(self):
+        test_files = ["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*"))
+
+        for test_file in test_files:
+            hashes = {}
+
+            # run the test
+            root = RhapsodyFileParser.parse(test_file, hashes=hashes)
+            regex = RhapsodyFileParser.parse(test_file, engine='regex', hashes={})
+
+            # validate the output
+            self.assertEqual(RhapsodyFileParser.hashTree(root), hashes, test_file)
+            self.assertEqual(len(root.xpath('//*[@type]')), len(hashes), test_file)
+            self.assertEqual(hashes[root], RhapsodyFileParser.hashTree(regex)[regex], test_file)
+
+        # changing a value changes the hash of every enclosing block only
+        hashes = {}
+        root = RhapsodyFileParser.parse("./assets/Project_rpy/LinuxOS.sbs", hashes=hashes)
+        node = root.xpath('//*[@type="IPrimitiveOperation"]')[0].find('_name')
+        node.text = '"Renamed"'
+        changed = RhapsodyFileParser.hashTree(root)
+        self.assertEqual(set(node.iterancestors()), set(block for block in hashes if hashes[block] != changed[block]))
+
+    def test02_diff(self):
+        test_file = "./assets/Project_rpy/LinuxOS.sbs"
+        old = RhapsodyFileParser.parse(test_file)
+        new = copy.deepcopy(old)
+        operations = [node for node in new.xpath('//*[@type="IPrimitiveOperation"]') if not node.xpath('.//*[@type="IArgument"]')]
+        classes = [node for node in new.xpath('//*[@type="IClass"]') if node.xpath('.//*[@type="IPrimitiveOperation"]')]
+
+        # rename an operation, remove another, move one to another class and add a copy of one
+        operations[0].find('_name').text = '"Renamed"'
+        operations[1].getparent().remove(operations[1])
+        moved = operations[2]
+        target = [node for node in classes if moved not in node.iter()][0]
+        target.xpath('.//*[@type="IPrimitiveOperation"]')[0].getparent().append(moved)
+        added = copy.deepcopy(operations[3])
+        added.find('_id').text = 'GUID 00000000-0000-0000-0000-000000000000'
+        operations[3].getparent().append(added)
+
+        # run the test
+        changes = RhapsodyFileParser.diff(old, new)
+
+        # validate the output
+        self.assertEqual([added.findtext('_id')], changes.added)
+        self.assertEqual([operations[1].findtext('_id')], changes.removed)
+        self.assertEqual([moved.findtext('_id')], changes.moved)
+        self.assertTrue(operations[0].findtext('_id') in changes.modified)
+        self.assertFalse(RhapsodyFileParser.diff(old, copy.deepcopy(old)))
+
+    def test03_project_diff(self):
+        directory = tempfile.mkdtemp()
+
+        try:
+            shutil.copytree("./assets", os.path.join(directory, "assets"))
+            test_file = os.path.join(directory, "assets", "Project.rpy")
+            old = RhapsodyProjectParser.parse(test_file, hashes=True)
+
+            # rename a class in one file
+            unit = os.path.join(directory, "assets", "Project_rpy", "LinuxOS.sbs")
+            with open(unit, 'r') as f:
+                content = f.read()
+            with open(unit, 'w') as f:
+                f.write(content.replace('- _name = "TopLevel"', '- _name = "Renamed"', 1))
+
+            # run the test
+            new = RhapsodyProjectParser.parse(test_file, hashes=True)
+            changes = RhapsodyProjectParser.diff(old, new)
+
+            # validate the output
+            self.assertEqual([os.path.join("Project_rpy", "LinuxOS.sbs")], list(changes))
+            renamed = RhapsodyFileParser.parse(unit).xpath('//*[_name=\'"Renamed"\']')[0]
+            self.assertEqual([renamed.findtext('_id')], changes[os.path.join("Project_rpy", "LinuxOS.sbs")].modified)
+
+            # files are paired by their path relative to the project file, with or without hashes from parsing
+            self.assertEqual(changes, RhapsodyProjectParser.diff(RhapsodyProjectParser.parse("./assets/Project.rpy"), new))
+            self.assertEqual({}, RhapsodyProjectParser.diff(RhapsodyProjectParser.parse("./assets/Project.rpy"), old))
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSuite_RhapsodyDiff)
+    unittest.TextTestRunner(verbosity=2).run(suite)
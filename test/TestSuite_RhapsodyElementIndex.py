@@ -0,0 +1,103 @@
+import glob
+import shutil
+import tempfile
+import unittest
+import sys
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyElementIndex, RhapsodyFileParser, RhapsodyParseCache, RhapsodyProjectParser
+
+class TestSuite_RhapsodyElementIndex(unittest.TestCase):
+
+    def test01_types(self):
+        test_files = ["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*"))
+
+        for test_file in test_files:
+            elementIndex = RhapsodyElementIndex()
+
+            # run the test
+            root = RhapsodyFileParser.parse(test_file, element_index=elementIndex)
+
+            # validate the output
+            for blockType in ('IClass', 'IPrimitiveOperation', 'IAttribute', 'IProperty'):
+                self.assertEqual(root.xpath('//*[@type="%s"]' % (blockType)), elementIndex.findType(blockType), test_file)
+            self.assertEqual(root, elementIndex.findType(root.get('type'))[0])
+            self.assertEqual(sum(len(nodes) for nodes in elementIndex.types.values()), len(root.xpath('//*[@type]')))
+
+            # an index built from the tree is the same as the one built while parsing
+            fromTree = RhapsodyElementIndex(root)
+            self.assertEqual(elementIndex.types, fromTree.types, test_file)
+            self.assertEqual(elementIndex.names, fromTree.names, test_file)
+
+    def test02_names(self):
+        test_file = "./assets/Project_rpy/LinuxOS.sbs"
+        elementIndex = RhapsodyElementIndex()
+
+        # run the test
+        root = RhapsodyFileParser.parse(test_file, element_index=elementIndex)
+        found = elementIndex.findName('TopLevel')
+
+        # validate the output
+        self.assertEqual([node.getparent() for node in root.iter('_name') if '"TopLevel"' == node.text], found)
+        self.assertEqual('IClass', found[0].get('type'))
+        self.assertEqual(found, elementIndex.findName('TopLevel', 'IClass'))
+        self.assertEqual([], elementIndex.findName('TopLevel', 'IPrimitiveOperation'))
+        self.assertEqual([], elementIndex.findName('Missing'))
+
+    def test03_project(self):
+        test_file = "./assets/Project.rpy"
+        cache_dir = tempfile.mkdtemp()
+
+        try:
+            # run the test
+            projectFiles = RhapsodyProjectParser.parse(test_file, element_index=True)
+            cached = RhapsodyProjectParser.parse(test_file, element_index=True, cache_dir=cache_dir)
+            cached = RhapsodyProjectParser.parse(test_file, element_index=True, cache_dir=cache_dir)
+            parallel = RhapsodyProjectParser.parse(test_file, element_index=True, workers=2)
+
+            # validate the output
+            expected = [(filename, node) for filename in projectFiles for node in projectFiles[filename].xpath('//*[@type="IClass"]')]
+            self.assertEqual(sorted(expected, key=lambda entry: id(entry[1])), sorted(projectFiles.elements.findType('IClass'), key=lambda entry: id(entry[1])))
+            for other in (cached, parallel):
+                self.assertEqual(sorted(projectFiles.elements.types), sorted(other.elements.types))
+                self.assertEqual(sorted(projectFiles.elements.names), sorted(other.elements.names))
+                self.assertEqual(len(projectFiles.elements.findType('IClass')), len(other.elements.findType('IClass')))
+
+            filename, node = projectFiles.elements.findName('TopLevel', 'IClass')[0]
+            self.assertEqual('"TopLevel"', node.findtext('_name'))
+            self.assertTrue(node in projectFiles[filename].iter())
+
+            # removing a file removes its blocks
+            projectFiles.elements.removeUnit(filename)
+            self.assertFalse(any(filename == entry[0] for entry in projectFiles.elements.findName('TopLevel', 'IClass')))
+            self.assertFalse(any(filename == entry[0] for entry in projectFiles.elements.findType('IClass')))
+            self.assertTrue(projectFiles.elements.findType('IClass'))
+            self.assertTrue(RhapsodyProjectParser.parse(test_file).elements is None)
+        finally:
+            shutil.rmtree(cache_dir)
+
+    def test04_keep_skipped(self):
+        test_file = "./assets/Project_rpy/Continuous.sbs"
+        cache = RhapsodyParseCache(tempfile.mkdtemp())
+
+        try:
+            indexes = [RhapsodyElementIndex(), RhapsodyElementIndex()]
+
+            # run the test
+            for elementIndex in indexes:
+                root = RhapsodyFileParser.parse(test_file, skip_types=('IPropertyContainer', ), keep_skipped=True)
+                cache.parse(test_file, element_index=elementIndex, skip_types=('IPropertyContainer', ), keep_skipped=True)
+
+            # validate the output
+            self.assertEqual((1, 1), (cache.misses, cache.hits))
+            self.assertTrue(root.xpath('//*[@rhapsody_skipped]'))
+            self.assertEqual([], indexes[0].findType('IPropertyContainer'))
+            for miss, hit in ((indexes[0].types, indexes[1].types), (indexes[0].names, indexes[1].names)):
+                self.assertEqual(dict((key, len(nodes)) for key, nodes in miss.items()), dict((key, len(nodes)) for key, nodes in hit.items()))
+            self.assertEqual(RhapsodyElementIndex(root).types.keys(), indexes[0].types.keys())
+        finally:
+            shutil.rmtree(cache.directory)
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSuite_RhapsodyElementIndex)
+    unittest.TextTestRunner(verbosity=2).run(suite)
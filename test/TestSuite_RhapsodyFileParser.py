@@ -1,9 +1,11 @@
 import unittest
 from lxml import etree
+import glob
+import io
 import sys
 
 sys.path.append('../RhapsodyParser')
-from RhapsodyParser import RhapsodyFileParser
+from RhapsodyParser import RhapsodyFileParser, RhapsodyParseError
 
 class TestSuite_RhapsodyFileParser(unittest.TestCase):
     
@@ -107,6 +109,438 @@ class TestSuite_RhapsodyFileParser(unittest.TestCase):
         self.failIf(root is None, 'Failed to parse string content')
         self.elements_equal(root, expected_tree.getroot())
 
+    def test04_engines_equal(self):
+        test_files = ["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*"))
+        
+        for test_file in test_files:
+            with open(test_file, 'r') as f:
+                content = f.read()
+            
+            # run the test
+            expected = RhapsodyFileParser.fromString(content, engine='regex')
+            actual = RhapsodyFileParser.fromString(content, engine='scanner')
+            
+            # validate the output
+            self.assertEqual(etree.tostring(expected), etree.tostring(actual), test_file)
+    
+    def test05_scanner_deep_nesting(self):
+        depth = 5000
+        test_content = 'I-Logix-RPY-Archive version 8.5.2 C++ 1159120\n{ IProject \n'
+        test_content += '- _child = { IBlock \n' * depth
+        test_content += '- _name = "leaf";\n'
+        test_content += '}\n' * (depth + 1)
+        
+        # run the test
+        root = RhapsodyFileParser.fromString(test_content)
+        
+        # validate the output
+        node = root
+        for _ in range(0, depth):
+            node = node.find('_child')
+            self.assertEqual('IBlock', node.get('type'))
+        self.assertEqual('"leaf"', node.findtext('_name'))
+    
+    def test06_invalid_engine(self):
+        self.assertRaises(ValueError, RhapsodyFileParser.fromString, 'I-Logix-RPY-Archive version 8.5.2 C++ 1\n{ IProject \n}', engine='unknown')
+
+    def test07_iterparse_chunks(self):
+        test_file = "./assets/Project.rpy"
+        
+        with open(test_file, 'r') as f:
+            content = f.read()
+        expected = RhapsodyFileParser.fromString(content)
+        expected_events = [(event, node.tag) for event, node in etree.iterwalk(expected, events=('start', 'end'))]
+        
+        for chunk_size in (7, 4096):
+            # run the test
+            actual_events = []
+            root = None
+            for event, node in RhapsodyFileParser.iterparse(io.StringIO(content), events=('start', 'end'), chunk_size=chunk_size):
+                if root is None:
+                    root = node
+                actual_events.append((event, node.tag))
+            
+            # validate the output
+            self.assertEqual(expected_events, actual_events)
+            self.assertEqual(etree.tostring(expected), etree.tostring(root))
+    
+    def test08_iterparse_tag_clear(self):
+        test_file = "./assets/Project_rpy/Application.sbs"
+        
+        expected = [node.text for node in RhapsodyFileParser.parse(test_file).iter('_id')]
+        
+        # run the test
+        actual = []
+        for event, node in RhapsodyFileParser.iterparse(test_file, tag='_id'):
+            actual.append(node.text)
+            node.clear()
+        
+        # validate the output
+        self.assertEqual(expected, actual)
+    
+    def test09_iterparse_invalid_event(self):
+        self.assertRaises(ValueError, RhapsodyFileParser.iterparse, "./assets/Project.rpy", events=('start-ns', ))
+
+    def test10_links(self):
+        test_file = "./assets/Project.rpy"
+        
+        with open(test_file, 'r') as f:
+            content = f.read()
+        
+        # run the test
+        expected = []
+        RhapsodyFileParser.fromString(content, engine='regex', links=expected)
+        actual = []
+        RhapsodyFileParser.fromString(content, links=actual)
+        
+        # validate the output
+        self.assertEqual(expected, actual)
+        self.assertTrue(('ISubsystem', '"LinuxOS"') in actual)
+        self.assertTrue(('IComponent', '"DefaultComponent"') in actual)
+        self.assertFalse(('IProfile', '"CodeCentric75Cpp"') in actual)
+
+    def test11_compact_tree(self):
+        test_files = ["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*"))
+        
+        for test_file in test_files:
+            with open(test_file, 'r') as f:
+                content = f.read()
+            
+            # run the test
+            expected = RhapsodyFileParser.fromString(content)
+            actual = RhapsodyFileParser.fromString(content, tree='compact')
+            
+            # validate the output
+            self.assertEqual(etree.tostring(expected), etree.tostring(actual.toLxml()), test_file)
+            self.assertEqual([(node.tag, node.get('type'), node.text) for node in expected.iter()], [(node.tag, node.get('type'), node.text) for node in actual.iter()], test_file)
+    
+    def test12_compact_navigation(self):
+        test_file = "./assets/Project.rpy"
+        
+        expected = RhapsodyFileParser.parse(test_file)
+        
+        # run the test
+        actual = RhapsodyFileParser.parse(test_file, tree='compact')
+        
+        # validate the output
+        self.assertEqual(expected.items(), actual.items())
+        self.assertEqual(len(expected), len(actual))
+        self.assertEqual(expected.findtext('_id'), actual.findtext('_id'))
+        self.assertEqual(expected.find('Subsystems').get('type'), actual.find('Subsystems').get('type'))
+        self.assertEqual(len(expected.find('Subsystems').findall('value')), len(actual.find('Subsystems').findall('value')))
+        self.assertEqual([node.text for node in expected.iter('_name')], [node.text for node in actual.iter('_name')])
+        self.assertTrue(actual.find('Missing') is None)
+        self.assertRaises(ValueError, RhapsodyFileParser.parse, test_file, tree='unknown')
+
+    def test13_skip_types(self):
+        test_files = ["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*"))
+        skip_types = ('IPropertyContainer', 'IColor')
+        
+        for test_file in test_files:
+            # remove the skipped blocks from a full parse
+            expected = RhapsodyFileParser.parse(test_file)
+            for node in list(expected.iter()):
+                if node.get('type') in skip_types and node.getparent() is not None:
+                    node.getparent().remove(node)
+            
+            # run the test
+            actual = RhapsodyFileParser.parse(test_file, skip_types=skip_types, skip_attributes='_Value')
+            
+            # validate the output
+            for node in list(expected.iter('_Value')):
+                node.getparent().remove(node)
+            self.assertEqual(etree.tostring(expected), etree.tostring(actual), test_file)
+        
+        self.assertRaises(ValueError, RhapsodyFileParser.parse, test_files[0], engine='regex', skip_types=skip_types)
+    
+    def test14_keep_skipped_expand(self):
+        test_files = ["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*"))
+        
+        for test_file in test_files:
+            expected = RhapsodyFileParser.parse(test_file)
+            
+            # run the test
+            actual = RhapsodyFileParser.parse(test_file, skip_types=('IPropertyContainer', 'IClass'), keep_skipped=True)
+            placeholders = actual.xpath('//*[@rhapsody_skipped]')
+            for node in placeholders:
+                self.assertTrue(node.text.startswith('{'))
+                self.assertTrue(node.text.endswith('}'))
+                RhapsodyFileParser.expand(node)
+            
+            # validate the output
+            self.assertEqual(etree.tostring(expected), etree.tostring(actual), test_file)
+        
+        self.assertTrue(placeholders)
+        self.assertRaises(ValueError, RhapsodyFileParser.expand, actual)
+
+    def test15_write_round_trip(self):
+        test_files = ["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*"))
+        
+        for test_file in test_files:
+            expected = RhapsodyFileParser.parse(test_file)
+            output = io.StringIO()
+            
+            # run the test
+            RhapsodyFileParser.write(expected, output, chunk_size=16)
+            actual = RhapsodyFileParser.fromString(output.getvalue())
+            
+            # validate the output
+            self.assertEqual(etree.tostring(expected), etree.tostring(actual), test_file)
+            self.assertEqual(output.getvalue(), RhapsodyFileParser.toString(expected), test_file)
+        
+        self.assertRaises(ValueError, RhapsodyFileParser.write, expected, None)
+    
+    def test16_write_values(self):
+        test_content = '''I-Logix-RPY-Archive version 8.5.2 C++ 1159120
+{ IProject 
+	- _id = GUID 00000000-0000-0000-0000-000000000000;
+	- _name = "";
+	- Colors = { IRPYRawContainer 
+		- size = 3;
+		- value = 1; 2; 3; 
+	}
+	- Empty = { IRPYRawContainer 
+	}
+	- Nested = { IRPYRawContainer 
+		- size = 1;
+		- value = 
+		{ IColor 
+			- m_fgColor = 0;
+		}
+	}
+}
+'''
+        
+        # run the test
+        actual = RhapsodyFileParser.toString(RhapsodyFileParser.fromString(test_content))
+        
+        # validate the output
+        self.assertTrue('- value = 1; 2; 3;\n' in actual)
+        self.assertTrue('- Empty = { IRPYRawContainer \n\t}\n' in actual)
+        self.assertTrue('- _name = "";\n' in actual)
+        self.assertEqual(test_content, actual.replace('2; 3;\n', '2; 3; \n'))
+
+    def test17_parse_bytes(self):
+        test_file = "./assets/Project_rpy/LinuxOS.sbs"
+        
+        expected = etree.tostring(RhapsodyFileParser.parse(test_file))
+        with open(test_file, 'rb') as f:
+            data = f.read()
+        
+        # run the test
+        actual = [
+            RhapsodyFileParser.parse(test_file, encoding='utf-8'),
+            RhapsodyFileParser.parse(test_file, encoding='detect'),
+            RhapsodyFileParser.parse(io.BytesIO(data)),
+            RhapsodyFileParser.parse(memoryview(data)),
+            RhapsodyFileParser.fromString(data.replace(b'\n', b'\r\n')),
+            RhapsodyFileParser.fromString(data.decode('utf-8').encode('utf-16')),
+            RhapsodyFileParser.fromString(b'\xef\xbb\xbf' + data),
+            ]
+        
+        # validate the output
+        for root in actual:
+            self.assertEqual(expected, etree.tostring(root))
+        self.assertRaises(ValueError, RhapsodyFileParser.parse, 1)
+    
+    def test18_sanitize(self):
+        test_content = u'I-Logix-RPY-Archive version 8.5.2 C++ 1159120\n{ IProject \n\t- _name = "a\x00b\x1fc\u00e9";\n}\n'
+        
+        # run the test
+        actual = RhapsodyFileParser.fromString(test_content)
+        latin = RhapsodyFileParser.fromString(test_content.encode('latin-1'))
+        
+        # validate the output
+        self.assertEqual(u'"abc\u00e9"', actual.findtext('_name'))
+        self.assertEqual(u'"abc\u00e9"', latin.findtext('_name'))
+        clean = test_content.split('\n')[0]
+        self.assertTrue(RhapsodyFileParser._sanitize(clean) is clean)
+
+    def test19_add_requirement_dependencies(self):
+        test_file = "./assets/Project_rpy/AbstractHW.sbs"
+        
+        root = RhapsodyFileParser.parse(test_file)
+        node = root.xpath('//Dependencies/..')[0]
+        existing = node.find('Dependencies/value/_id').text
+        size = int(node.findtext('Dependencies/size'))
+        other = root.xpath('//*[@type="IClass"][not(Dependencies)]')[0]
+        links = [
+            (node, existing, 'GUID 1', '"Req1"', '"Requirements"'),
+            (node, 'GUID 2', 'GUID 1', '"Req1"', '"Requirements"'),
+            (node, 'GUID 3', 'GUID 4', '"Req2"', '"Requirements"'),
+            (node, 'GUID 2', 'GUID 1', '"Req1"', '"Requirements"'),
+            (other, 'GUID 5', 'GUID 4', '"Req2"', '"Requirements"'),
+            ]
+        
+        # run the test
+        added, skipped = RhapsodyFileParser.add_requirement_dependencies(iter(links))
+        
+        # validate the output
+        self.assertEqual([links[1], links[2], links[4]], added)
+        self.assertEqual([links[0], links[3]], skipped)
+        self.assertEqual(str(size + 2), node.findtext('Dependencies/size'))
+        self.assertEqual('1', other.findtext('Dependencies/size'))
+        self.assertEqual(['GUID 2', 'GUID 3'], [value.findtext('_id') for value in node.findall('Dependencies/value')][-2:])
+        self.assertEqual(1, len(set(value.text for value in root.iter('_modifiedTimeWeak'))))
+        self.assertEqual(etree.tostring(root), etree.tostring(RhapsodyFileParser.fromString(RhapsodyFileParser.toString(root))))
+
+    def test20_pack_values(self):
+        test_file = "./assets/Project_rpy/AbstractHW.sbs"
+        test_content = u'I-Logix-RPY-Archive version 8.5.2 C++ 1159120\n{ IProject \n\t- Points = { IRPYRawContainer \n\t\t- size = 3;\n\t\t- value = 1; 2;\n\t\t\t3;\n\t}\n\t- Names = { IRPYRawContainer \n\t\t- size = 2;\n\t\t- value = "a;b"; "c";\n\t}\n}\n'
+        
+        expected = RhapsodyFileParser.parse(test_file)
+        
+        # run the test
+        actual = RhapsodyFileParser.parse(test_file, pack_values=True)
+        compact = RhapsodyFileParser.parse(test_file, pack_values=True, tree='compact')
+        packed = RhapsodyFileParser.fromString(test_content, pack_values=True)
+        
+        # validate the output
+        self.assertTrue(actual.xpath('//*[@rhapsody_values]'))
+        self.assertFalse(actual.xpath('//*[@rhapsody_values]/value'))
+        self.assertEqual(RhapsodyFileParser.toString(expected), RhapsodyFileParser.toString(actual))
+        self.assertEqual(RhapsodyFileParser.toString(expected), RhapsodyFileParser.toString(compact))
+        self.assertEqual(RhapsodyFileParser.hashTree(expected)[expected], RhapsodyFileParser.hashTree(actual)[actual])
+        
+        self.assertEqual(['1', ' 2', '\n\t\t\t3'], RhapsodyFileParser.getValues(packed.find('Points')))
+        self.assertEqual([1, 2, 3], list(RhapsodyFileParser.getValues(packed.find('Points'), 'l')))
+        self.assertEqual(['"a;b"', ' "c"'], RhapsodyFileParser.getValues(packed.find('Names')))
+        self.assertEqual(RhapsodyFileParser.getValues(RhapsodyFileParser.fromString(test_content).find('Points')), RhapsodyFileParser.getValues(packed.find('Points')))
+        self.assertRaises(ValueError, RhapsodyFileParser.fromString, test_content, engine='regex', pack_values=True)
+        
+        for node in actual.xpath('//*[@rhapsody_values]'):
+            RhapsodyFileParser.expandValues(node)
+        for node in [node for node in compact.iter() if node.get('rhapsody_values') is not None]:
+            RhapsodyFileParser.expandValues(node)
+        self.assertEqual(etree.tostring(expected), etree.tostring(actual))
+        self.assertEqual(etree.tostring(expected), etree.tostring(compact.toLxml()))
+        self.assertRaises(ValueError, RhapsodyFileParser.expandValues, actual)
+        
+        # long lists are matched in runs of items
+        long_content = test_content.replace('- size = 3;\n\t\t- value = 1; 2;', '- size = 131;\n\t\t- value = ' + '0; ' * 128 + '1; 2;', 1)
+        long = RhapsodyFileParser.fromString(long_content, pack_values=True)
+        self.assertEqual(131, len(RhapsodyFileParser.getValues(long.find('Points'))))
+        self.assertEqual(RhapsodyFileParser.getValues(RhapsodyFileParser.fromString(long_content).find('Points')), RhapsodyFileParser.getValues(long.find('Points')))
+
+    def test21_recover(self):
+        test_file = "./assets/Project_rpy/LinuxOS.sbs"
+        test_content = u'I-Logix-RPY-Archive version 8.5.2 C++ 1159120\n{ IProject \n\t- _id = GUID 1\n\t- _name = "P";\n\t- Items = { IRPYRawContainer \n\t\t- size = x;\n\t}\n\t garbage\n\t- Sub = { IClass \n\t\t- _name = "C";\n'
+        errors = []
+        clean = []
+        
+        # run the test
+        actual = RhapsodyFileParser.fromString(test_content, errors=errors)
+        expected = RhapsodyFileParser.parse(test_file, errors=clean)
+        
+        # validate the output
+        self.assertEqual([
+            RhapsodyParseError(3, 16, 'Missing ;'),
+            RhapsodyParseError(6, 12, 'Invalid size attribute'),
+            RhapsodyParseError(8, 3, 'Expected }'),
+            RhapsodyParseError(10, 17, 'Expected }'),
+            ], errors)
+        self.assertEqual('Missing ; at line 3, column 16', str(errors[0]))
+        self.assertEqual('GUID 1', actual.findtext('_id'))
+        self.assertEqual('"P"', actual.findtext('_name'))
+        self.assertEqual('IRPYRawContainer', actual.find('Items').get('type'))
+        self.assertEqual('"C"', actual.findtext('Sub/_name'))
+        
+        self.assertEqual([], clean)
+        self.assertEqual(etree.tostring(RhapsodyFileParser.parse(test_file)), etree.tostring(expected))
+        self.assertRaises(ValueError, RhapsodyFileParser.fromString, test_content)
+        self.assertRaises(ValueError, RhapsodyFileParser.fromString, test_content, engine='regex', errors=[])
+        
+        errors = []
+        self.assertEqual('root', RhapsodyFileParser.fromString(u'invalid', errors=errors).tag)
+        self.assertEqual([RhapsodyParseError(1, 1, 'Expected file information')], errors)
+
+    def test22_compact_scalars(self):
+        test_file = "./assets/Project.rpy"
+        
+        expected = RhapsodyFileParser.parse(test_file)
+        
+        # run the test
+        actual = RhapsodyFileParser.parse(test_file, tree='compact')
+        
+        # validate the output
+        for tag in ('_id', '_name'):
+            self.assertEqual(len(expected.find(tag)), len(actual.find(tag)))
+            self.assertEqual(list(expected.find(tag)), list(actual.find(tag)))
+            self.assertEqual(None, actual.find(tag).find('value'))
+            self.assertEqual([tag], [node.tag for node in actual.find(tag).iter()])
+        self.assertEqual(len(list(expected.iter())), len(list(actual.iter())))
+
+    def test23_recover_attributes(self):
+        test_content = u'I-Logix-RPY-Archive version 8.5.2 C++ 1159120\n{ IProject \n\t- _name = "P"\n\t- _id = GUID 1;\n\t- _na"me = "Q";\n\t- a{b = { IClass \n\t\t- _name = "C";\n\t}\n\t- _description = "a\n\t- b = c";\n}\n'
+        errors = []
+        
+        # run the test
+        actual = RhapsodyFileParser.fromString(test_content, errors=errors)
+        compact = RhapsodyFileParser.fromString(test_content, tree='compact', errors=[])
+        
+        # validate the output
+        self.assertEqual([
+            RhapsodyParseError(3, 15, 'Missing ;'),
+            RhapsodyParseError(5, 4, 'Invalid attribute name'),
+            RhapsodyParseError(6, 4, 'Invalid attribute name'),
+            ], errors)
+        self.assertEqual(['_name', '_id', '_description'], [node.tag for node in actual])
+        self.assertEqual('"P"', actual.findtext('_name'))
+        self.assertEqual('GUID 1', actual.findtext('_id'))
+        self.assertEqual('"a\n\t- b = c"', actual.findtext('_description'))
+        self.assertEqual(etree.tostring(actual), etree.tostring(compact.toLxml()))
+        self.assertRaises(ValueError, RhapsodyFileParser.fromString, test_content)
+
+    def test24_skip_round_trip(self):
+        test_file = "./assets/Project.rpy"
+        
+        for options in ({'skip_types': ('ISubsystem', )}, {'skip_attributes': ('value', )}, {'skip_types': ('ISubsystem', ), 'tree': 'compact'}):
+            hashes = {}
+            
+            # run the test
+            actual = RhapsodyFileParser.parse(test_file, hashes=hashes, **options)
+            output = io.StringIO()
+            RhapsodyFileParser.write(actual, output)
+            
+            # validate the output
+            subsystems = actual.find('Subsystems')
+            self.assertEqual(len(subsystems.findall('value')), int(subsystems.findtext('size')), options)
+            self.assertEqual(RhapsodyFileParser.toString(actual), RhapsodyFileParser.toString(RhapsodyFileParser.fromString(output.getvalue(), **options)), options)
+            self.assertEqual(RhapsodyFileParser.hashTree(actual), hashes, options)
+        
+        self.assertEqual('8', RhapsodyFileParser.parse(test_file, skip_types=('ISubsystem', ), keep_skipped=True).findtext('Subsystems/size'))
+
+    def test25_iterparse_bytes(self):
+        test_file = "./assets/Project_rpy/LinuxOS.sbs"
+        
+        expected = etree.tostring(RhapsodyFileParser.parse(test_file))
+        with open(test_file, 'rb') as f:
+            data = f.read()
+        latin = data.replace(b'"TopLevel"', b'"Top\xe9Level"', 1)
+        
+        for chunk_size in (3, 4096):
+            sources = [
+                open(test_file, 'rb'),
+                io.BytesIO(data.replace(b'\n', b'\r\n')),
+                io.BytesIO(data.decode('utf-8').encode('utf-16')),
+                io.BytesIO(b'\xef\xbb\xbf' + data),
+                ]
+            
+            # run the test
+            actual = []
+            for source in sources:
+                with source:
+                    root = None
+                    for event, node in RhapsodyFileParser.iterparse(source, chunk_size=chunk_size):
+                        root = node
+                    actual.append(root)
+            encoded = [node for event, node in RhapsodyFileParser.iterparse(io.BytesIO(latin), chunk_size=chunk_size)][-1]
+            
+            # validate the output
+            for root in actual:
+                self.assertEqual(expected, etree.tostring(root), chunk_size)
+            self.assertEqual(etree.tostring(RhapsodyFileParser.fromString(latin)), etree.tostring(encoded), chunk_size)
+
     def elements_equal(self, e1, e2):
         self.failIf(e1.tag != e2.tag)
         self.failIf(e1.tag != e2.tag)
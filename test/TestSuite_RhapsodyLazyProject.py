@@ -0,0 +1,59 @@
+import glob
+import unittest
+from lxml import etree
+import sys
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyFileParser, RhapsodyProjectParser
+
+class TestSuite_RhapsodyLazyProject(unittest.TestCase):
+    
+    def test01_scan_links(self):
+        test_files = ["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*"))
+        
+        for test_file in test_files:
+            # run the test
+            expected = []
+            RhapsodyFileParser.parse(test_file, links=expected)
+            actual = RhapsodyFileParser.scanLinks(test_file)
+            
+            # validate the output
+            self.assertEqual(expected, actual, test_file)
+    
+    def test02_parse_lazy(self):
+        test_file = "./assets/Project.rpy"
+        
+        expected = RhapsodyProjectParser.parse(test_file)
+        
+        # run the test
+        projectFiles = RhapsodyProjectParser.parseLazy(test_file, max_units=3)
+        
+        # validate the output
+        self.assertEqual(list(expected.keys()), list(projectFiles.keys()))
+        self.assertEqual(expected.graph.edges, projectFiles.graph.edges)
+        self.assertFalse(any(projectFiles.isLoaded(filename) for filename in projectFiles))
+        
+        for filename in expected:
+            self.assertEqual(etree.tostring(expected[filename]), etree.tostring(projectFiles[filename]))
+            self.assertTrue(projectFiles.isLoaded(filename))
+            self.assertTrue(3 >= sum(1 for loaded in projectFiles if projectFiles.isLoaded(loaded)))
+        
+        # evicted files are translated again when accessed
+        self.assertFalse(projectFiles.isLoaded(test_file))
+        self.assertEqual(etree.tostring(expected[test_file]), etree.tostring(projectFiles[test_file]))
+    
+    def test03_max_bytes(self):
+        test_file = "./assets/Project.rpy"
+        
+        # run the test
+        projectFiles = RhapsodyProjectParser.parseLazy(test_file, max_bytes=1)
+        for filename in projectFiles:
+            projectFiles[filename]
+        
+        # validate the output
+        self.assertEqual(1, sum(1 for loaded in projectFiles if projectFiles.isLoaded(loaded)))
+        self.assertRaises(KeyError, projectFiles.__getitem__, "./assets/Project_rpy/Missing.sbs")
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSuite_RhapsodyLazyProject)
+    unittest.TextTestRunner(verbosity=2).run(suite)
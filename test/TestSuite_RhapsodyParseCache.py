@@ -0,0 +1,116 @@
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+from lxml import etree
+import sys
+
+sys.path.append('../RhapsodyParser')
+import RhapsodyParser
+from RhapsodyParser import RhapsodyParseCache, RhapsodyProjectParser
+
+class TestSuite_RhapsodyParseCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+    
+    def test01_parse_rpy_cached(self):
+        test_file = "./assets/Project.rpy"
+        
+        expected = RhapsodyProjectParser.parse(test_file)
+        cache = RhapsodyParseCache(self.cache_dir)
+        
+        # run the test
+        first = RhapsodyProjectParser.parse(test_file, cache_dir=cache)
+        second = RhapsodyProjectParser.parse(test_file, cache_dir=cache)
+        
+        # validate the output
+        self.assertEqual(len(expected), cache.misses)
+        self.assertEqual(len(expected), cache.hits)
+        for actual in (first, second):
+            self.assertEqual(sorted(expected.keys()), sorted(actual.keys()))
+            for filename in expected:
+                self.assertEqual(etree.tostring(expected[filename]), etree.tostring(actual[filename]))
+    
+    def test02_modified_file(self):
+        test_file = os.path.join(self.cache_dir, "Wfdb.sbs")
+        shutil.copy("./assets/Project_rpy/Wfdb.sbs", test_file)
+        cache = RhapsodyParseCache(os.path.join(self.cache_dir, 'cache'))
+        
+        # run the test
+        cache.parse(test_file)
+        stat = os.stat(test_file)
+        os.utime(test_file, (stat.st_atime, stat.st_mtime + 10))
+        cache.parse(test_file)
+        cache.parse(test_file)
+        
+        # validate the output
+        self.assertEqual(2, cache.misses)
+        self.assertEqual(1, cache.hits)
+    
+    def test03_parser_version(self):
+        test_file = "./assets/Project_rpy/Wfdb.sbs"
+        cache = RhapsodyParseCache(self.cache_dir)
+        
+        # run the test
+        entry = cache._getEntry(test_file)
+        version = RhapsodyParser.__version__
+        try:
+            RhapsodyParser.__version__ = version + '.1'
+            new_entry = cache._getEntry(test_file)
+        finally:
+            RhapsodyParser.__version__ = version
+        formatVersion = RhapsodyParseCache.FORMAT_VERSION
+        try:
+            RhapsodyParseCache.FORMAT_VERSION = formatVersion + 1
+            format_entry = cache._getEntry(test_file)
+        finally:
+            RhapsodyParseCache.FORMAT_VERSION = formatVersion
+        
+        # validate the output
+        self.assertNotEqual(entry, new_entry)
+        self.assertNotEqual(entry, format_entry)
+        self.assertEqual(entry, cache._getEntry(test_file))
+        self.assertRaises(ValueError, cache.parse, test_file, tree='compact')
+        self.assertEqual([], cache._getEntries())
+    
+    def test04_eviction(self):
+        test_files = ["./assets/Project_rpy/DefaultComponent.cmp", "./assets/Project_rpy/TargetComponent.cmp", "./assets/Project_rpy/Domain.sbs"]
+        cache = RhapsodyParseCache(self.cache_dir, max_size=40000)
+        
+        # run the test
+        for index, test_file in enumerate(test_files):
+            cache.parse(test_file)
+            os.utime(cache._getEntry(test_file), (index, index))
+        
+        # validate the output
+        entries = cache._getEntries()
+        self.assertTrue(cache.max_size >= sum(size for _, size, _ in entries))
+        self.assertFalse(os.path.isfile(cache._getEntry(test_files[0])))
+        self.assertTrue(os.path.isfile(cache._getEntry(test_files[-1])))
+        
+    def test05_running_size(self):
+        test_files = ["./assets/Project.rpy"] + sorted(glob.glob("./assets/Project_rpy/*"))
+        cache = RhapsodyParseCache(self.cache_dir, max_size=100000)
+        scans = []
+        getEntries = cache._getEntries
+        cache._getEntries = lambda: scans.append(True) or getEntries()
+        
+        # run the test
+        for test_file in test_files:
+            cache.parse(test_file)
+        
+        # validate the output
+        self.assertTrue(len(scans) < len(test_files))
+        self.assertEqual(cache._size, sum(size for _, size, _ in getEntries()))
+        self.assertTrue(cache.max_size >= cache._size)
+        cache.clear()
+        self.assertEqual([], getEntries())
+        
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSuite_RhapsodyParseCache)
+    unittest.TextTestRunner(verbosity=2).run(suite)
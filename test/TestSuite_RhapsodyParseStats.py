@@ -0,0 +1,92 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import sys
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyFileParser, RhapsodyParseStats, RhapsodyProjectParser
+
+class TestSuite_RhapsodyParseStats(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test01_file_stats(self):
+        test_file = "./assets/Project_rpy/LinuxOS.sbs"
+        stats = RhapsodyParseStats()
+
+        # run the test
+        root = RhapsodyFileParser.parse(test_file, stats=stats)
+        RhapsodyFileParser.fromString(RhapsodyFileParser.toString(root), stats=stats)
+
+        # validate the output
+        self.assertEqual([test_file, '<string 1>'], list(stats.units))
+        unit = stats.units[test_file]
+        self.assertEqual(os.path.getsize(test_file), unit.bytes)
+        self.assertTrue(0 < unit.read and 0 < unit.sanitize and 0 < unit.tokenize)
+        self.assertEqual(len(list(root.iter())), unit.elements)
+        self.assertEqual(len(root.xpath('//*[@type="IClass"]')), unit.types['IClass'])
+        self.assertEqual(max(len(list(node.iterancestors())) for node in root.iter()), unit.depth)
+        self.assertTrue(unit.cacheHit is None)
+        self.assertRaises(ValueError, RhapsodyFileParser.parse, test_file, stats={})
+
+    def test02_project_stats(self):
+        test_file = "./assets/Project.rpy"
+        stats = RhapsodyParseStats()
+        cached = RhapsodyParseStats()
+
+        # run the test
+        projectFiles = RhapsodyProjectParser.parse(test_file, cache_dir=self.cache_dir, stats=stats)
+        RhapsodyProjectParser.parse(test_file, cache_dir=self.cache_dir, stats=cached)
+
+        # validate the output
+        self.assertEqual(sorted(projectFiles), sorted(stats.units))
+        summary = stats.summary()
+        self.assertEqual(len(projectFiles), summary['units'])
+        self.assertEqual(0, summary['cacheHits'])
+        self.assertEqual(len(projectFiles), summary['cacheMisses'])
+        self.assertEqual(sum(os.path.getsize(filename) for filename in projectFiles), summary['bytes'])
+        self.assertTrue(summary['elapsed'] >= summary['read'] + summary['sanitize'] + summary['tokenize'])
+        self.assertEqual(len(projectFiles), cached.summary()['cacheHits'])
+        self.assertEqual(summary['types'], cached.summary()['types'])
+
+        exported = json.loads(stats.toJson())
+        self.assertEqual(summary['units'], exported['summary']['units'])
+        self.assertEqual(sorted(projectFiles), sorted(unit['filename'] for unit in exported['units']))
+
+    def test03_project_stats_workers(self):
+        test_file = "./assets/Project.rpy"
+        stats = RhapsodyParseStats()
+
+        # run the test
+        projectFiles = RhapsodyProjectParser.parse(test_file, workers=2, stats=stats)
+
+        # validate the output
+        self.assertEqual(sorted(projectFiles), sorted(stats.units))
+        for filename in projectFiles:
+            self.assertEqual(len(list(projectFiles[filename].iter())), stats.units[filename].elements)
+
+    def test04_compact_stats(self):
+        test_file = "./assets/Project_rpy/LinuxOS.sbs"
+        expected = RhapsodyParseStats()
+        stats = RhapsodyParseStats()
+
+        # run the test
+        RhapsodyFileParser.parse(test_file, stats=expected)
+        root = RhapsodyFileParser.parse(test_file, stats=stats, tree='compact')
+
+        # validate the output
+        unit = stats.units[test_file]
+        self.assertEqual(len(list(root.iter())), unit.elements)
+        self.assertEqual(expected.units[test_file].elements, unit.elements)
+        self.assertEqual(expected.units[test_file].depth, unit.depth)
+        self.assertEqual(expected.units[test_file].types, unit.types)
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSuite_RhapsodyParseStats)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,89 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import sys
+
+from lxml import etree
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyFileParser, RhapsodyProjectConverter, RhapsodyProjectParser, main
+
+class TestSuite_RhapsodyProjectConverter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input = os.path.join(self.directory, "models")
+        self.output = os.path.join(self.directory, "xml")
+        shutil.copytree("./assets", os.path.join(self.input, "a"))
+        shutil.copytree("./assets", os.path.join(self.input, "b"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test01_convert(self):
+        test_file = os.path.join(self.input, "a", "Project.rpy")
+        projectFiles = RhapsodyProjectParser.parse(test_file)
+
+        # run the test
+        report = RhapsodyProjectConverter.convert([self.input], self.output, workers=2)
+
+        # validate the output
+        self.assertEqual(2, report['projects'])
+        self.assertEqual(2 * len(projectFiles), report['converted'])
+        self.assertEqual({}, report['failed'])
+        for filename, root in projectFiles.items():
+            target = os.path.join(self.output, "a", "Project", os.path.relpath(filename, os.path.join(self.input, "a")) + '.xml')
+            expected = etree.tostring(etree.fromstring(etree.tostring(root)))
+            self.assertEqual(expected, etree.tostring(etree.parse(target).getroot()), filename)
+
+        with open(os.path.join(self.output, RhapsodyProjectConverter.MANIFEST), 'r') as f:
+            self.assertEqual(2 * len(projectFiles), len(json.load(f)))
+
+    def test02_resume(self):
+        RhapsodyProjectConverter.convert([self.input], self.output, workers=1)
+        unit = os.path.join(self.input, "b", "Project_rpy", "LinuxOS.sbs")
+        removed = os.path.join(self.output, "a", "Project", "Project_rpy", "Comm.sbs.xml")
+
+        # run the test
+        unchanged = RhapsodyProjectConverter.convert([self.input], self.output)
+        with open(unit, 'a') as f:
+            f.write('\n')
+        os.remove(removed)
+        resumed = RhapsodyProjectConverter.convert([self.input], self.output)
+        forced = RhapsodyProjectConverter.convert([self.input], self.output, force=True)
+
+        # validate the output
+        self.assertEqual(0, unchanged['converted'])
+        self.assertEqual(2, resumed['converted'])
+        self.assertEqual(unchanged['skipped'] - 2, resumed['skipped'])
+        self.assertTrue(os.path.isfile(removed))
+        self.assertEqual(unchanged['skipped'], forced['converted'])
+
+    def test03_main(self):
+        with open(os.path.join(self.input, "b", "Broken.rpy"), 'w') as f:
+            f.write('invalid')
+        output = io.StringIO()
+
+        # run the test
+        with contextlib.redirect_stdout(output):
+            failed = main([self.input, '-o', self.output, '-j', '1', '-q'])
+            converted = main([os.path.join(self.input, "a", "Project.rpy"), '--output', self.output])
+
+        # validate the output
+        self.assertEqual(1, failed)
+        self.assertEqual(0, converted)
+        lines = output.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('failed    %s' % (os.path.join(self.input, "b", "Broken.rpy"))))
+        totals = [index for index, line in enumerate(lines) if ' projects, ' in line]
+        self.assertTrue(lines[totals[0]].startswith('3 projects, '))
+        self.assertTrue(lines[totals[0]].endswith(', 1 failed'))
+        self.assertTrue(lines[totals[0] + 1].endswith('files/s)'))
+        self.assertTrue(lines[totals[1]].startswith('1 projects, '))
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSuite_RhapsodyProjectConverter)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+import unittest
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyProjectExporter, RhapsodyProjectParser
+
+class TestSuite_RhapsodyProjectExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        shutil.copytree("./assets", os.path.join(self.directory, "assets"))
+        self.test_file = os.path.join(self.directory, "assets", "Project.rpy")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test01_export(self):
+        projectFiles = RhapsodyProjectParser.parse(self.test_file, index=True)
+        exporter = RhapsodyProjectExporter(os.path.join(self.directory, "project.db"))
+
+        # run the test
+        exported = exporter.exportProject(self.test_file)
+
+        # validate the output
+        self.assertEqual(sorted(projectFiles), sorted(exported))
+        connection = exporter.connection
+        self.assertEqual(sorted(projectFiles.index.guids), [row[0] for row in connection.execute('SELECT DISTINCT guid FROM elements ORDER BY guid')])
+        self.assertEqual(sum(len(list(root.iter('_dependsOn'))) for root in projectFiles.values()), connection.execute('SELECT COUNT(*) FROM refs').fetchone()[0])
+
+        unit = os.path.join(self.directory, "assets", "Project_rpy", "LinuxOS.sbs")
+        node = projectFiles[unit].xpath('//*[@type="IClass" and _name=\'"TopLevel"\']')[0]
+        owners = [ancestor for ancestor in node.iterancestors() if ancestor.find('_id') is not None]
+        row = connection.execute('SELECT type, name, parent, unit, depth FROM elements WHERE guid = ?', (node.findtext('_id'), )).fetchone()
+        self.assertEqual(('IClass', 'TopLevel', owners[0].findtext('_id'), os.path.abspath(unit), len(owners)), row)
+
+        # the same project exported by parse gives the same tables
+        other = RhapsodyProjectExporter(':memory:')
+        self.assertEqual(sorted(projectFiles), sorted(other.addProject(projectFiles)))
+        for query in ('SELECT guid, type, name, parent, unit, depth FROM elements ORDER BY rowid', 'SELECT * FROM refs ORDER BY rowid'):
+            self.assertEqual(connection.execute(query).fetchall(), other.connection.execute(query).fetchall())
+        exporter.close()
+
+    def test02_incremental(self):
+        database = os.path.join(self.directory, "project.db")
+        unit = os.path.join(self.directory, "assets", "Project_rpy", "LinuxOS.sbs")
+        RhapsodyProjectExporter(database).exportProject(self.test_file)
+
+        # run the test
+        unchanged = RhapsodyProjectExporter(database).exportProject(self.test_file)
+        with open(unit, 'r') as f:
+            content = f.read()
+        with open(unit, 'w') as f:
+            f.write(content.replace('- _name = "TopLevel"', '- _name = "Renamed"', 1))
+        exporter = RhapsodyProjectExporter(database)
+        changed = exporter.exportProject(self.test_file)
+
+        # validate the output
+        self.assertEqual([], unchanged)
+        self.assertEqual([unit], changed)
+        self.assertEqual(1, exporter.connection.execute('SELECT COUNT(*) FROM elements WHERE name = ?', ('Renamed', )).fetchone()[0])
+
+        exporter.removeUnit(unit)
+        self.assertEqual(0, exporter.connection.execute('SELECT COUNT(*) FROM elements WHERE unit = ?', (os.path.abspath(unit), )).fetchone()[0])
+        self.assertEqual([unit], exporter.exportProject(self.test_file))
+        self.assertRaises(ValueError, RhapsodyProjectExporter, 1)
+
+    @unittest.skipIf(numpy is None, 'requires numpy')
+    def test03_arrays(self):
+        exporter = RhapsodyProjectExporter(':memory:')
+        exporter.exportProject(self.test_file)
+
+        # run the test
+        arrays = exporter.toArrays()
+
+        # validate the output
+        count = exporter.connection.execute('SELECT COUNT(*) FROM elements').fetchone()[0]
+        self.assertEqual(sorted(RhapsodyProjectExporter.ELEMENT_COLUMNS), sorted(arrays))
+        self.assertEqual(count, len(arrays['guid']))
+        self.assertEqual(numpy.int32, arrays['depth'].dtype)
+        self.assertEqual(len(RhapsodyProjectExporter.REF_COLUMNS), len(exporter.toArrays('refs')))
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSuite_RhapsodyProjectExporter)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,60 @@
+import unittest
+import sys
+
+sys.path.append('../RhapsodyParser')
+from RhapsodyParser import RhapsodyFileParser, RhapsodyProjectIndex, RhapsodyProjectParser
+
+class TestSuite_RhapsodyProjectIndex(unittest.TestCase):
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.projectFiles = RhapsodyProjectParser.parse("./assets/Project.rpy", index=True)
+    
+    def test01_find(self):
+        index = self.projectFiles.index
+        
+        for filename in self.projectFiles:
+            # run the test
+            guid_dict = RhapsodyFileParser.getGuidDict(self.projectFiles[filename])
+            
+            # validate the output
+            for guid, node in guid_dict.items():
+                if node.get('type', '').endswith('Handle'):
+                    continue
+                found = index.find(guid)
+                self.assertFalse(found is None, guid)
+                self.assertEqual(found[1].findtext('_id'), guid)
+    
+    def test02_resolve(self):
+        linked_file = "./assets/Project_rpy/LinuxOS.sbs"
+        nested_file = "./assets/Project_rpy/std.sbs"
+        index = self.projectFiles.index
+        guid = 'GUID f4dcf840-b0c4-4dee-9e11-35d9a61431d6'
+        
+        # run the test
+        handle = [node for node in self.projectFiles[linked_file].iter('_dependsOn') if guid == node.findtext('_id')][0]
+        found = index.resolve(handle)
+        references = index.getReferences(guid)
+        
+        # validate the output
+        self.assertEqual(nested_file, found[0])
+        self.assertEqual('"std"', found[1].findtext('_name'))
+        self.assertTrue((linked_file, handle) in references)
+    
+    def test03_remove_unit(self):
+        linked_file = "./assets/Project_rpy/LinuxOS.sbs"
+        nested_file = "./assets/Project_rpy/std.sbs"
+        guid = 'GUID f4dcf840-b0c4-4dee-9e11-35d9a61431d6'
+        
+        # run the test
+        index = RhapsodyProjectIndex(self.projectFiles)
+        index.removeUnit(linked_file)
+        
+        # validate the output
+        self.assertEqual(nested_file, index.find(guid)[0])
+        self.assertFalse(any(linked_file == filename for filename, _ in index.getReferences(guid)))
+        self.assertFalse(any(linked_file == filename for filename, _ in index.guids.values()))
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSuite_RhapsodyProjectIndex)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -1,8 +1,13 @@
+import os
+import shutil
+import tempfile
 import unittest
+from lxml import etree
 import sys
 
 sys.path.append('../RhapsodyParser')
-from RhapsodyParser import RhapsodyProjectParser
+from RhapsodyParser import RhapsodyFileParser, RhapsodyParseCache, RhapsodyProjectChanges, RhapsodyProjectParser
+from Generate_RhapsodyProject import RhapsodyProjectGenerator
 
 class TestSuite_RhapsodyProjectParser(unittest.TestCase):
     
@@ -28,6 +33,240 @@ class TestSuite_RhapsodyProjectParser(unittest.TestCase):
         
         self.failIf(root is None, 'failed to parse Rhapsody project file')
         
+    def test02_parse_rpy_workers(self):
+        test_file = "./assets/Project.rpy"
+        
+        # run the test
+        expected = RhapsodyProjectParser.parse(test_file)
+        actual = RhapsodyProjectParser.parse(test_file, workers=2)
+        
+        # validate the output
+        self.assertEqual(sorted(expected.keys()), sorted(actual.keys()))
+        for filename in expected:
+            self.assertEqual(etree.tostring(expected[filename]), etree.tostring(actual[filename]))
+        
+    def test03_parse_rpy_invalid_workers(self):
+        test_file = "./assets/Project.rpy"
+        
+        self.assertRaises(ValueError, RhapsodyProjectParser.parse, test_file, workers=0)
+    
+    def test04_reparse(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            shutil.copytree("./assets", os.path.join(temp_dir, "assets"))
+            test_file = os.path.join(temp_dir, "assets", "Project.rpy")
+            linked_file = os.path.join(temp_dir, "assets", "Project_rpy", "LinuxOS.sbs")
+            nested_file = os.path.join(temp_dir, "assets", "Project_rpy", "std.sbs")
+            
+            with open(test_file, 'r') as f:
+                content = f.read()
+            
+            projectFiles = RhapsodyProjectParser.parse(test_file)
+            self.assertTrue(linked_file in projectFiles)
+            
+            # run the test
+            unchanged = RhapsodyProjectParser.reparse(projectFiles)
+            
+            self.set_content(test_file, content.replace('- fileName = "LinuxOS";', '- fileName = "Missing";'))
+            removed = RhapsodyProjectParser.reparse(projectFiles)
+            
+            self.set_content(test_file, content)
+            added = RhapsodyProjectParser.reparse(projectFiles)
+            
+            # validate the output
+            self.assertFalse(unchanged)
+            self.assertEqual([test_file], removed.changed)
+            self.assertEqual(sorted([linked_file, nested_file]), sorted(removed.removed))
+            self.assertEqual([], removed.added)
+            self.assertEqual([test_file], added.changed)
+            self.assertEqual([linked_file, nested_file], added.added)
+            self.assertEqual(sorted(RhapsodyProjectParser.parse(test_file).keys()), sorted(projectFiles.keys()))
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def test05_graph(self):
+        test_file = "./assets/Project.rpy"
+        linked_file = "./assets/Project_rpy/LinuxOS.sbs"
+        nested_file = "./assets/Project_rpy/std.sbs"
+        
+        # run the test
+        projectFiles = RhapsodyProjectParser.parse(test_file)
+        graph = projectFiles.graph
+        order = graph.topologicalOrder()
+        
+        # validate the output
+        self.assertEqual(sorted(projectFiles.keys()), sorted(order))
+        self.assertEqual(test_file, order[0])
+        for filename in graph.edges:
+            for linked in graph.edges[filename]:
+                self.assertTrue(order.index(filename) < order.index(linked))
+                self.assertTrue(filename in graph.reverseEdges[linked])
+        self.assertEqual([nested_file], graph.edges[linked_file])
+        self.assertEqual(set([test_file, linked_file]), graph.getLinkingUnits(nested_file))
+        self.assertTrue((test_file, "./assets/Project_rpy/Discrete_.sbs") in graph.getMissingFiles())
+    
+    def test06_parse_rpy_skip_types(self):
+        test_file = "./assets/Project.rpy"
+        cache_dir = tempfile.mkdtemp()
+        
+        try:
+            # run the test
+            expected = RhapsodyProjectParser.parse(test_file, skip_types=('IPropertyContainer', ))
+            cached = RhapsodyProjectParser.parse(test_file, cache_dir=cache_dir, skip_types=('IPropertyContainer', ))
+            full = RhapsodyProjectParser.parse(test_file, cache_dir=cache_dir)
+            actual = RhapsodyProjectParser.parse(test_file, workers=2, skip_types=('IPropertyContainer', ))
+            
+            # validate the output
+            self.assertEqual(sorted(expected.keys()), sorted(actual.keys()))
+            for filename in expected:
+                self.assertEqual(0, len(expected[filename].xpath('//*[@type="IPropertyContainer"]')))
+                self.assertEqual(etree.tostring(expected[filename]), etree.tostring(cached[filename]))
+                self.assertEqual(etree.tostring(expected[filename]), etree.tostring(actual[filename]))
+            self.assertTrue(full[test_file].xpath('//*[@type="IPropertyContainer"]'))
+            self.assertEqual({'skip_types': ('IPropertyContainer', )}, expected.options)
+        finally:
+            shutil.rmtree(cache_dir)
+    
+    def test07_parse_generated(self):
+        directory = tempfile.mkdtemp()
+        
+        try:
+            test_file = RhapsodyProjectGenerator().generate(directory, packages=3, classes=4, components=2, depth=3)
+            
+            # run the test
+            projectFiles = RhapsodyProjectParser.parse(test_file, index=True)
+            
+            # validate the output
+            self.assertEqual(1 + 3*3 + 2, len(projectFiles))
+            self.assertEqual([], projectFiles.graph.getMissingFiles())
+            for filename in projectFiles:
+                root = projectFiles[filename]
+                self.assertEqual(etree.tostring(RhapsodyFileParser.parse(filename, engine='regex')), etree.tostring(root))
+                self.assertEqual(etree.tostring(root), etree.tostring(RhapsodyFileParser.fromString(RhapsodyFileParser.toString(root))))
+            for dependsOn in projectFiles[os.path.join(directory, 'Project_rpy', 'Package0_2.sbs')].iter('_dependsOn'):
+                self.assertEqual('IClass', projectFiles.index.resolve(dependsOn)[1].get('type'))
+            
+            # worker processes give the files in the same order and count the cache hits of the parent cache
+            cache = RhapsodyParseCache(os.path.join(directory, 'cache'))
+            for _ in range(2):
+                parallel = RhapsodyProjectParser.parse(test_file, workers=4, cache_dir=cache, index=True)
+                self.assertEqual(list(projectFiles), list(parallel))
+                self.assertEqual(list(projectFiles.index.guids), list(parallel.index.guids))
+                self.assertEqual(projectFiles.graph.topologicalOrder(), parallel.graph.topologicalOrder())
+            self.assertEqual((len(projectFiles), len(projectFiles)), (cache.misses, cache.hits))
+        finally:
+            shutil.rmtree(directory)
+    
+    def test08_parse_rpy_compact(self):
+        test_file = "./assets/Project.rpy"
+        cache_dir = tempfile.mkdtemp()
+        
+        try:
+            # run the test
+            expected = RhapsodyProjectParser.parse(test_file)
+            actual = RhapsodyProjectParser.parse(test_file, tree='compact', element_index=True, hashes=True)
+            
+            # validate the output
+            self.assertEqual(sorted(expected), sorted(actual))
+            for filename in expected:
+                self.assertEqual(etree.tostring(expected[filename]), etree.tostring(actual[filename].toLxml()))
+            self.assertEqual(len(expected[test_file].xpath('//*[@type="IClass"]')), len([entry for entry in actual.elements.findType('IClass') if test_file == entry[0]]))
+            self.assertFalse(RhapsodyProjectParser.diff(expected, actual))
+            
+            self.assertRaises(ValueError, RhapsodyProjectParser.parse, test_file, tree='compact', cache_dir=cache_dir)
+            self.assertRaises(ValueError, RhapsodyProjectParser.parse, test_file, tree='compact', workers=2)
+            self.assertRaises(ValueError, RhapsodyProjectParser.parse, test_file, tree='compact', index=True)
+            self.assertRaises(ValueError, RhapsodyProjectParser.reparse, actual, cache_dir=cache_dir)
+            self.assertFalse(RhapsodyProjectParser.reparse(actual))
+        finally:
+            shutil.rmtree(cache_dir)
+    
+    def test09_parse_rpy_errors(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            shutil.copytree("./assets", os.path.join(temp_dir, "assets"))
+            test_file = os.path.join(temp_dir, "assets", "Project.rpy")
+            linked_file = os.path.join(temp_dir, "assets", "Project_rpy", "LinuxOS.sbs")
+            nested_file = os.path.join(temp_dir, "assets", "Project_rpy", "std.sbs")
+            cache_dir = os.path.join(temp_dir, "cache")
+            with open(linked_file, 'r') as f:
+                content = f.read()
+            self.set_content(linked_file, content.replace('- _name = "TopLevel";', '- _name = "TopLevel"', 1).replace('- _id = ', '- _i"d = ', 1))
+            with open(nested_file, 'r') as f:
+                self.set_content(nested_file, f.read().replace('- _id = ', '- _i"d = ', 1))
+            
+            # run the test
+            results = []
+            for options in ({}, {'cache_dir': cache_dir}, {'cache_dir': cache_dir}, {'workers': 2}, {'workers': 2, 'cache_dir': cache_dir}):
+                errors = []
+                projectFiles = RhapsodyProjectParser.parse(test_file, errors=errors, **options)
+                results.append((errors, dict(projectFiles.errors), etree.tostring(projectFiles[linked_file])))
+            
+            # validate the output
+            self.assertEqual(3, len(results[0][0]))
+            self.assertEqual([linked_file, nested_file], sorted(results[0][1]))
+            self.assertEqual(['Invalid attribute name', 'Missing ;'], sorted(error.message for error in results[0][1][linked_file]))
+            self.assertEqual(['Invalid attribute name'], [error.message for error in results[0][1][nested_file]])
+            self.assertEqual([error for filename in projectFiles for error in results[0][1].get(filename, [])], results[0][0])
+            for result in results[1:]:
+                self.assertEqual(results[0], result)
+            
+            # only the files parsed without errors are cached
+            self.assertEqual(len(projectFiles) - 2, len(os.listdir(cache_dir)))
+            self.assertEqual(None, RhapsodyProjectParser.parse("./assets/Project.rpy").errors)
+            
+            # errors of fixed and removed files are dropped by reparse
+            self.set_content(linked_file, content)
+            os.remove(nested_file)
+            changes = RhapsodyProjectParser.reparse(projectFiles)
+            self.assertEqual([linked_file], changes.changed)
+            self.assertTrue(nested_file in changes.removed)
+            self.assertEqual({}, projectFiles.errors)
+            self.assertEqual([], errors)
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def test10_watch(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            shutil.copytree("./assets", os.path.join(temp_dir, "assets"))
+            test_file = os.path.join(temp_dir, "assets", "Project.rpy")
+            linked_file = os.path.join(temp_dir, "assets", "Project_rpy", "LinuxOS.sbs")
+            nested_file = os.path.join(temp_dir, "assets", "Project_rpy", "std.sbs")
+            cache_dir = os.path.join(temp_dir, "cache")
+            
+            with open(test_file, 'r') as f:
+                content = f.read()
+            with open(linked_file, 'r') as f:
+                linked_content = f.read()
+            
+            projectFiles = RhapsodyProjectParser.parse(test_file)
+            watcher = RhapsodyProjectParser.watch(projectFiles, interval=0, cache_dir=cache_dir)
+            
+            # run the test
+            self.set_content(linked_file, linked_content.replace('- _name = "TopLevel"', '- _name = "Renamed"', 1))
+            changed = next(watcher)
+            
+            self.set_content(test_file, content.replace('- fileName = "LinuxOS";', '- fileName = "Missing";'))
+            removed = next(watcher)
+            watcher.close()
+            
+            # validate the output
+            self.assertEqual(RhapsodyProjectChanges([linked_file], [], []), changed)
+            self.assertEqual(RhapsodyProjectChanges([test_file], [], sorted([linked_file, nested_file])), removed._replace(removed=sorted(removed.removed)))
+            self.assertEqual(sorted(RhapsodyProjectParser.parse(test_file).keys()), sorted(projectFiles.keys()))
+            self.assertTrue(os.listdir(cache_dir))
+            self.assertRaises(ValueError, next, RhapsodyProjectParser.watch({}, interval=0))
+        finally:
+            shutil.rmtree(temp_dir)
+    
+    def set_content(self, filename, content):
+        stat = os.stat(filename)
+        with open(filename, 'w') as f:
+            f.write(content)
+        # make sure the modification time changes on file systems with coarse timestamps
+        os.utime(filename, (stat.st_atime, stat.st_mtime + 10))
+        
 if __name__ == "__main__":
     suite = unittest.TestLoader().loadTestsFromTestCase(TestSuite_RhapsodyProjectParser)
     unittest.TextTestRunner(verbosity=2).run(suite)
\ No newline at end of file